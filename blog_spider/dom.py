@@ -0,0 +1,81 @@
+"""Batched DOM queries for selenium drivers.
+
+Every WebElement call (``find_element_*``, ``get_attribute``, ``.text``,
+``is_displayed()``) is one WebDriver http round trip.  ``query_nodes`` does
+the lookup, href, text and visibility of a whole result set in a single
+``execute_script`` and returns plain tuples.
+"""
+from collections import namedtuple
+
+DomNode = namedtuple('DomNode', ['element', 'href', 'text', 'visible'])
+
+QUERY_NODES_JS = """
+var snapshot = document.evaluate(arguments[0], document, null,
+                                 XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var subXpath = arguments[1];
+var result = [];
+for (var i = 0; i < snapshot.snapshotLength; i++) {
+    var node = snapshot.snapshotItem(i);
+    if (subXpath) {
+        node = document.evaluate(subXpath, node, null,
+                                 XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        if (!node) {
+            continue;
+        }
+    }
+    var style = window.getComputedStyle(node);
+    var visible = !!(node.offsetWidth || node.offsetHeight || node.getClientRects().length)
+        && style.visibility !== 'hidden' && style.display !== 'none';
+    result.push([node, node.href || node.getAttribute('href') || '', node.innerText || '', visible]);
+}
+return result;
+"""
+
+
+def query_nodes(driver, xpath, sub_xpath=None):
+    """Return a DomNode for every node matching xpath, in one round trip.
+
+    With sub_xpath, each match is replaced by the first node sub_xpath
+    selects relative to it, and matches without one are left out.
+    ``element`` is still a WebElement, for clicking.
+    """
+    return [DomNode(*row) for row in driver.execute_script(QUERY_NODES_JS, xpath, sub_xpath)]
+
+
+def visible_nodes(driver, xpath, sub_xpath=None):
+    return [node for node in query_nodes(driver, xpath, sub_xpath) if node.visible]
+
+
+class CommandCounter(object):
+    """Counts the WebDriver commands a driver sends, per page.
+
+    Wraps ``driver.execute``, which every driver and WebElement call goes
+    through.  ``start_page(url)`` closes the count of the current page.
+    """
+
+    def __init__(self, driver):
+        self.total = 0
+        self.url = None
+        self.current = 0
+        self.pages = []
+        execute = driver.execute
+
+        def counted_execute(driver_command, params=None):
+            self.total += 1
+            self.current += 1
+            return execute(driver_command, params)
+
+        driver.execute = counted_execute
+
+    def start_page(self, url):
+        if self.url is not None:
+            self.pages.append((self.url, self.current))
+        self.url = url
+        self.current = 0
+
+    def per_page(self):
+        """Average commands per page, the current page included."""
+        counts = [count for url, count in self.pages]
+        if self.url is not None:
+            counts.append(self.current)
+        return sum(counts) / len(counts) if counts else 0
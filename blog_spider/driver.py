@@ -0,0 +1,73 @@
+"""Selenium webdriver construction, shared by the spiders and utils/renderer.py.
+
+Importing this module has no side effects: no logging setup, no sys.path
+changes and no scrapy imports.
+"""
+from importlib import import_module
+
+from selenium.webdriver import DesiredCapabilities
+from user_agent import generate_user_agent
+
+WINDOW_WIDTH = 1366
+WINDOW_HEIGHT = 942
+
+
+def create_driver(driver_name, driver_executable_path, driver_arguments,
+                  browser_executable_path, proxy=None, width=WINDOW_WIDTH,
+                  height=WINDOW_HEIGHT, page_load_timeout=60):
+    """Create a selenium webdriver
+
+    Parameters
+    ----------
+    driver_name: str
+        The selenium ``WebDriver`` to use
+    driver_executable_path: str
+        The path of the executable binary of the driver
+    driver_arguments: list
+        A list of arguments to initialize the driver
+    browser_executable_path: str
+        The path of the executable binary of the browser
+    proxy: str
+        ``host:port`` of the proxy server to use, if any
+    """
+    webdriver_base_path = f'selenium.webdriver.{driver_name}'
+
+    driver_klass_module = import_module(f'{webdriver_base_path}.webdriver')
+    driver_klass = getattr(driver_klass_module, 'WebDriver')
+    if driver_name == 'phantomjs':
+        cap = DesiredCapabilities.PHANTOMJS.copy()
+
+        # for key, value in settings.SELENIUM_DRIVER_HEADERS.items():
+        #     cap['phantomjs.page.customHeaders.{}'.format(key)] = value
+        service_args = ['--web-security=no', '--ssl-protocol=any', '--ignore-ssl-errors=true']
+        driver_kwargs = {
+            'executable_path': driver_executable_path,
+            'service_args': service_args,
+            'desired_capabilities': cap
+        }
+    else:
+        driver_options_module = import_module(f'{webdriver_base_path}.options')
+        driver_options_klass = getattr(driver_options_module, 'Options')
+        driver_options = driver_options_klass()
+        if browser_executable_path:
+            driver_options.binary_location = browser_executable_path
+        for argument in driver_arguments or ():
+            driver_options.add_argument(argument)
+        # 随机头
+        driver_options.add_argument(
+            f"user-agent={generate_user_agent(os=('win',), device_type=('desktop',), navigator=('chrome',))}")
+        # 代理
+        if proxy:
+            driver_options.add_argument(
+                f"--proxy-server={proxy}"
+            )
+        driver_kwargs = {
+            'executable_path': driver_executable_path,
+            f'{driver_name}_options': driver_options
+        }
+
+    driver = driver_klass(**driver_kwargs)
+    driver.set_page_load_timeout(page_load_timeout)
+    # driver.maximize_window()
+    driver.set_window_size(width, height)
+    return driver
@@ -0,0 +1,85 @@
+"""Streaming readers for sitemaps and Atom/RSS feeds.
+
+Both are parsed with ``lxml.etree.iterparse`` and every entry is cleared
+as soon as it has been read, so a sitemap of thousands of urls never
+becomes a full tree.
+"""
+import io
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from lxml import etree
+
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+
+
+def parse_timestamp(value):
+    """Parse a W3C datetime (sitemap lastmod, Atom updated) or an RFC 822 date
+    (RSS pubDate) into an aware UTC datetime; None if it is not a date."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        stamp = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            stamp = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if stamp.tzinfo is None:
+        stamp = stamp.replace(tzinfo=timezone.utc)
+    return stamp.astimezone(timezone.utc)
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def child_text(element, name):
+    for child in element:
+        if isinstance(child.tag, str) and local_name(child.tag) == name:
+            return (child.text or '').strip()
+    return None
+
+
+def release(element):
+    """Free an element that has been read, along with its earlier siblings."""
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def iter_sitemap(data):
+    """Yield (loc, lastmod datetime or None, is_index) for every <url> of a
+    sitemap, or every <sitemap> of a sitemap index."""
+    for event, element in etree.iterparse(io.BytesIO(data), events=('end',),
+                                          tag=(f'{SITEMAP_NS}url', f'{SITEMAP_NS}sitemap', 'url', 'sitemap')):
+        loc = child_text(element, 'loc')
+        if loc:
+            yield loc, parse_timestamp(child_text(element, 'lastmod')), local_name(element.tag) == 'sitemap'
+        release(element)
+
+
+def iter_feed(data):
+    """Yield (link, updated datetime or None) for every Atom <entry> or RSS
+    <item> of a feed."""
+    for event, element in etree.iterparse(io.BytesIO(data), events=('end',),
+                                          tag=(f'{ATOM_NS}entry', 'item')):
+        if local_name(element.tag) == 'entry':
+            link = None
+            for child in element:
+                if child.tag == f'{ATOM_NS}link' and child.get('rel', 'alternate') == 'alternate':
+                    link = child.get('href')
+                    break
+            updated = child_text(element, 'updated') or child_text(element, 'published')
+        else:
+            link = child_text(element, 'link')
+            updated = child_text(element, 'pubDate') or child_text(element, 'date')
+        if link:
+            yield link.strip(), parse_timestamp(updated)
+        release(element)
@@ -7,6 +7,18 @@ import scrapy
 
 
 class BlogSpiderItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    url = scrapy.Field()
+    title = scrapy.Field()
+    # 发布时间, iso格式字符串
+    date = scrapy.Field()
+    tags = scrapy.Field()
+    categories = scrapy.Field()
+    # 正文的html
+    html = scrapy.Field()
+    markdown = scrapy.Field()
+    # BlogSpiderPipeline写入的文件名(相对HEXO_POSTS_DIR)
+    file = scrapy.Field()
+    # 近似重复(SimHash)时, 先出现的那篇的url
+    duplicate_of = scrapy.Field()
+    # 文章已经不存在(404/410), 从输出和索引里删掉
+    deleted = scrapy.Field()
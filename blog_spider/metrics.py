@@ -0,0 +1,260 @@
+"""Per-callback timing, item pipeline latency and queue depths of a crawl.
+
+Everything is kept in fixed-bucket histograms, so memory does not grow
+with the number of responses.  CallbackMetrics appends a snapshot to a
+JSON-lines file and rewrites a Prometheus text-format file every
+``interval`` seconds, and summarizes the crawl when it closes.
+"""
+import json
+import os
+import time
+from os.path import dirname
+
+from itemadapter import is_item
+from scrapy import Request
+
+INF = float('inf')
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, INF)
+DEPTHS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, INF)
+QUEUES = ('scheduler', 'downloader', 'scraper', 'pipeline')
+
+
+class Histogram(object):
+    """Streaming histogram over fixed upper bounds."""
+
+    def __init__(self, buckets=SECONDS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile (the max for the last one)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': round(self.sum, 6), 'mean': round(self.mean(), 6),
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'max': round(self.max, 6)}
+
+    def prometheus(self, name, labels):
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            le = '+Inf' if bound == INF else repr(bound)
+            yield f'{name}_bucket{{{labels},le="{le}"}} {seen}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+def callback_name(response):
+    request = getattr(response, 'request', None)
+    callback = request.callback if request is not None else None
+    if callback is None:
+        return 'parse'
+    return getattr(callback, '__name__', repr(callback))
+
+
+class CallbackStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.requests = 0
+        self.items = 0
+        self.errors = 0
+        self.wall = Histogram()
+        self.cpu = Histogram()
+        self.pipeline = Histogram()
+
+    def to_dict(self):
+        return {'calls': self.calls, 'requests': self.requests, 'items': self.items, 'errors': self.errors,
+                'wall': self.wall.to_dict(), 'cpu': self.cpu.to_dict(), 'pipeline': self.pipeline.to_dict()}
+
+
+class CallbackMetrics(object):
+    """Timing of spider callbacks and of items in the pipeline.
+
+    The spider middleware wraps the callback output with track(); the time
+    spent producing each output is the callback's wall and CPU time.  That
+    is all of the work of a generator callback, like every callback of
+    this project; the call itself is not timed, since scrapy makes it 0.1s
+    after process_spider_input and request.callback is left alone.
+    Calls are counted by called() from process_spider_input and errors by
+    failed() from process_spider_exception, which scrapy calls once for
+    an exception of the callback, whether it raised when called or while
+    its output was iterated.
+    Items are followed until item_scraped, item_dropped or item_error.
+    """
+
+    def __init__(self, crawler, jsonl_path=None, prom_path=None, interval=10):
+        self.crawler = crawler
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.interval = interval
+        self.callbacks = {}
+        # id(item) -> (item, callback, start); keeping the item keeps its id from being reused
+        self.in_pipeline = {}
+        self.depths = {queue: Histogram(DEPTHS) for queue in QUEUES}
+        self.current = dict.fromkeys(QUEUES, 0)
+        self.opened = time.time()
+
+    def callback(self, name):
+        stats = self.callbacks.get(name)
+        if stats is None:
+            stats = self.callbacks[name] = CallbackStats()
+        return stats
+
+    def called(self, response):
+        """The response is about to be passed to its callback."""
+        self.callback(callback_name(response)).calls += 1
+
+    def failed(self, response):
+        """The callback raised."""
+        self.callback(callback_name(response)).errors += 1
+
+    def track(self, response, result):
+        """Wrap the callback output.  Scrapy iterates it later, from a
+        Cooperator, so only the time inside each next() is counted."""
+        return self.iterate(callback_name(response), result)
+
+    def iterate(self, name, result):
+        stats = self.callback(name)
+        wall = cpu = 0.0
+        iterator = iter(result)
+        try:
+            while True:
+                wall_start, cpu_start = time.perf_counter(), time.thread_time()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    wall += time.perf_counter() - wall_start
+                    cpu += time.thread_time() - cpu_start
+                if isinstance(value, Request):
+                    stats.requests += 1
+                elif is_item(value):
+                    stats.items += 1
+                    self.in_pipeline[id(value)] = (value, name, time.perf_counter())
+                yield value
+        finally:
+            stats.wall.observe(wall)
+            stats.cpu.observe(cpu)
+
+    def item_done(self, item, **kwargs):
+        started = self.in_pipeline.get(id(item))
+        if started is not None and started[0] is item:
+            del self.in_pipeline[id(item)]
+            _, name, start = started
+            self.callback(name).pipeline.observe(time.perf_counter() - start)
+
+    def sample(self):
+        engine = self.crawler.engine
+        if engine is None or engine.slot is None:
+            return
+        scraper = engine.scraper.slot
+        self.current = {
+            'scheduler': len(engine.slot.scheduler),
+            'downloader': len(engine.downloader.active),
+            'scraper': len(scraper.active) if scraper else 0,
+            'pipeline': len(self.in_pipeline),
+        }
+        for queue, depth in self.current.items():
+            self.depths[queue].observe(depth)
+
+    def snapshot(self):
+        return {
+            'time': round(time.time(), 3),
+            'elapsed': round(time.time() - self.opened, 3),
+            'queues': dict(self.current),
+            'depths': {queue: histogram.to_dict() for queue, histogram in self.depths.items()},
+            'callbacks': {name: stats.to_dict() for name, stats in sorted(self.callbacks.items())},
+        }
+
+    def prometheus(self, spider_name):
+        lines = []
+        families = [
+            ('blog_spider_callback_seconds', 'histogram', 'Wall time of a spider callback', 'wall'),
+            ('blog_spider_callback_cpu_seconds', 'histogram', 'CPU time of a spider callback', 'cpu'),
+            ('blog_spider_pipeline_seconds', 'histogram', 'Time an item spends in the item pipeline', 'pipeline'),
+        ]
+        for metric, kind, description, field in families:
+            lines += [f'# HELP {metric} {description}', f'# TYPE {metric} {kind}']
+            for name, stats in sorted(self.callbacks.items()):
+                lines += getattr(stats, field).prometheus(metric, f'spider="{spider_name}",callback="{name}"')
+        for field in ('requests', 'items', 'errors'):
+            metric = f'blog_spider_callback_{field}_total'
+            lines += [f'# HELP {metric} {field.capitalize()} of a spider callback', f'# TYPE {metric} counter']
+            for name, stats in sorted(self.callbacks.items()):
+                lines.append(f'{metric}{{spider="{spider_name}",callback="{name}"}} {getattr(stats, field)}')
+        lines += ['# HELP blog_spider_queue_depth Current length of a crawl queue',
+                  '# TYPE blog_spider_queue_depth gauge']
+        for queue, depth in self.current.items():
+            lines.append(f'blog_spider_queue_depth{{spider="{spider_name}",queue="{queue}"}} {depth}')
+        return '\n'.join(lines) + '\n'
+
+    def flush(self, spider_name):
+        self.sample()
+        if self.jsonl_path:
+            os.makedirs(dirname(self.jsonl_path) or '.', exist_ok=True)
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(self.snapshot(), spider=spider_name), ensure_ascii=False) + '\n')
+        if self.prom_path:
+            os.makedirs(dirname(self.prom_path) or '.', exist_ok=True)
+            tmp = f'{self.prom_path}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus(spider_name))
+            os.replace(tmp, self.prom_path)
+
+    def summary(self):
+        """Report lines, ending with the stage that limits throughput.
+
+        Callbacks are compared by the share of the crawl they kept the
+        reactor busy, the downloader by its mean depth against
+        CONCURRENT_REQUESTS.  The scraper and the pipeline have no global
+        limit in items (CONCURRENT_ITEMS is per response), their depths are
+        only reported."""
+        settings = self.crawler.settings
+        elapsed = max(time.time() - self.opened, 1e-9)
+        lines = []
+        loads = []
+        for name, stats in sorted(self.callbacks.items(), key=lambda kv: -kv[1].wall.sum):
+            busy = stats.wall.sum / elapsed
+            loads.append((busy, f'回调 {name}'))
+            lines.append(
+                f'{name}: {stats.calls} 次, 占用 {busy:.1%} 时间, p50 {stats.wall.quantile(0.5) * 1000:.1f}ms '
+                f'p95 {stats.wall.quantile(0.95) * 1000:.1f}ms, CPU {stats.cpu.sum:.2f}s, '
+                f'请求 {stats.requests}, item {stats.items}, 出错 {stats.errors}, '
+                f'pipeline p95 {stats.pipeline.quantile(0.95) * 1000:.1f}ms')
+        for queue, histogram in self.depths.items():
+            lines.append(f'{queue} 队列: 平均 {histogram.mean():.1f}, p95 {histogram.quantile(0.95):g}, '
+                         f'最大 {histogram.max:g}')
+        downloads = self.depths['downloader'].mean() / max(settings.getint('CONCURRENT_REQUESTS', 16), 1)
+        loads.append((downloads, 'downloader'))
+        if loads:
+            load, stage = max(loads)
+            if load >= 0.5:
+                lines.append(f'限制吞吐的是{stage} (利用率 {load:.0%})')
+            else:
+                lines.append(f'没有饱和的环节, 最忙的是{stage} (利用率 {load:.0%}), 瓶颈在下载延迟或者待爬的请求太少')
+        return lines
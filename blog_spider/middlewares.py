@@ -3,22 +3,64 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import json
+import os
+import re
+import time
+import zlib
+from collections import deque
+from email.utils import parsedate_to_datetime
+from hashlib import sha1
+from os.path import dirname, exists, join
+
+from lxml import etree
 from scrapy import signals
+from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.request import request_fingerprint
+from twisted.internet import task
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from blog_spider.metrics import CallbackMetrics
+from blog_spider.simhash import SimHashIndex, simhash
+
 
 class BlogSpiderSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    """
+    丢弃(或标记)近似重复的文章: 同一篇文章在原博客和镜像站(比如www.itdaan.com)上都会爬到,
+    item正文的64位SimHash和已有的相差不超过SIMHASH_DISTANCE位时,
+    SIMHASH_ACTION为drop就不再交给pipeline, 为link就在duplicate_of里记下先出现的url.
+    指纹按url保存在SIMHASH_INDEX_FILE, 跨次运行也能查重.
+    丢弃的item发送item_dropped信号, 和pipeline里丢弃的一样计入统计
+    """
+
+    def __init__(self, crawler, path=None, distance=3, action='drop'):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.path = path
+        self.action = action
+        self.index = SimHashIndex(distance)
+        self.changed = False
+        self.checked = 0
+        self.duplicates = 0
+        if path and exists(path):
+            with open(path, encoding='utf-8') as f:
+                for url, fingerprint in json.load(f).items():
+                    self.index.add(url, int(fingerprint, 16))
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        settings = crawler.settings
+        s = cls(crawler, settings.get('SIMHASH_INDEX_FILE'),
+                distance=settings.getint('SIMHASH_DISTANCE', 3),
+                action=settings.get('SIMHASH_ACTION', 'drop'))
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
     def process_spider_input(self, response, spider):
@@ -34,8 +76,39 @@ class BlogSpiderSpiderMiddleware:
 
         # Must return an iterable of Request, or item objects.
         for i in result:
+            if is_item(i) and self.duplicate(i, spider):
+                self.crawler.signals.send_catch_log(
+                    signal=signals.item_dropped, item=i, response=response, spider=spider,
+                    exception=DropItem(f'近似重复: {ItemAdapter(i).get("url")}'))
+                continue
             yield i
 
+    def duplicate(self, item, spider):
+        """True if the item is a near-duplicate that should be dropped."""
+        adapter = ItemAdapter(item)
+        url = adapter.get('url')
+        html = adapter.get('html')
+        root = etree.HTML(html) if html else None
+        text = root.xpath('string()') if root is not None else adapter.get('markdown') or ''
+        fingerprint = simhash(text)
+        if not url or fingerprint is None:
+            return False
+        self.checked += 1
+        self.stats.inc_value('simhash/checked')
+        match = self.index.near(fingerprint, exclude=url)
+        if match is None:
+            self.index.add(url, fingerprint)
+            self.changed = True
+            return False
+        original, distance = match
+        self.duplicates += 1
+        self.stats.inc_value('simhash/duplicates')
+        spider.logger.info(f'近似重复({distance}位): {url} 和 {original}')
+        if self.action == 'link':
+            adapter['duplicate_of'] = original
+            return False
+        return True
+
     def process_spider_exception(self, response, exception, spider):
         # Called when a spider or process_spider_input() method
         # (from other spider middleware) raises an exception.
@@ -55,19 +128,143 @@ class BlogSpiderSpiderMiddleware:
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
 
+    def spider_closed(self, spider):
+        if self.checked:
+            rate = self.duplicates / self.checked
+            self.stats.set_value('simhash/duplicate_rate', round(rate, 4))
+            spider.logger.info(f'近似重复: {self.duplicates}/{self.checked} 篇, 重复率 {rate:.1%}')
+        if self.path and self.changed:
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({url: f'{fingerprint:016x}' for url, fingerprint in self.index.fingerprints.items()},
+                          f, indent=0, sort_keys=True)
+            os.replace(tmp, self.path)
+            self.changed = False
+
+
+class MetricsSpiderMiddleware:
+    """
+    统计每个回调的耗时(墙钟和CPU)、产生的请求和item数, item从产生到离开pipeline的时间和各队列长度,
+    每METRICS_INTERVAL秒追加到METRICS_JSONL_FILE、重写METRICS_PROM_FILE(Prometheus文本格式),
+    结束时打印哪个回调或环节限制了吞吐. METRICS_ENABLED为False时不启用.
+    顺序要比其它spider中间件大(离spider最近), 计时才只包括回调本身
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.flusher = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED', True):
+            raise NotConfigured
+        metrics = CallbackMetrics(crawler, settings.get('METRICS_JSONL_FILE'), settings.get('METRICS_PROM_FILE'),
+                                  settings.getfloat('METRICS_INTERVAL', 10))
+        s = cls(metrics)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        for signal in (signals.item_scraped, signals.item_dropped, signals.item_error):
+            crawler.signals.connect(metrics.item_done, signal=signal)
+        return s
+
+    def process_spider_input(self, response, spider):
+        self.metrics.called(response)
+
+    def process_spider_output(self, response, result, spider):
+        return self.metrics.track(response, result)
+
+    def process_spider_exception(self, response, exception, spider):
+        self.metrics.failed(response)
+
+    def spider_opened(self, spider):
+        self.metrics.opened = time.time()
+        self.flusher = task.LoopingCall(self.metrics.flush, spider.name)
+        self.flusher.start(self.metrics.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.flusher is not None and self.flusher.running:
+            self.flusher.stop()
+        self.metrics.flush(spider.name)
+        for line in self.metrics.summary():
+            spider.logger.info(line)
+
 
 class BlogSpiderDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """
+    持久化的响应缓存
+    响应正文按sha1去重、zlib压缩后保存在HTTP_CACHE_DIR/bodies,
+    index.json里每个请求指纹对应 [正文hash, ETag, Last-Modified, 获取时间, Content-Type, url];
+    还在HTTP_CACHE_FRESHNESS的新鲜期内直接返回缓存, 过期了带上ETag/Last-Modified重新验证,
+    304时返回缓存的正文. 请求自己带了验证头(比如hexo_spider)时不改它的请求也不改它的304,
+    meta['dont_cache']为True的请求不走缓存
+    """
+
+    def __init__(self, path=None, freshness=()):
+        self.path = path
+        self.freshness = [(re.compile(pattern), seconds) for pattern, seconds in freshness]
+        self.index = {}
+        self.changed = False
+        self.stats = dict(lookups=0, hits=0, revalidated=0, misses=0, stored=0, deduplicated=0,
+                          bytes_saved=0, stored_bytes=0)
+        if path and exists(join(path, 'index.json')):
+            with open(join(path, 'index.json'), encoding='utf-8') as f:
+                self.index = json.load(f)
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        s = cls(crawler.settings.get('HTTP_CACHE_DIR'), crawler.settings.getlist('HTTP_CACHE_FRESHNESS'))
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
+    def fresh_for(self, url):
+        """新鲜期(秒): 第一个匹配url的规则, 都不匹配是0"""
+        for pattern, seconds in self.freshness:
+            if pattern.search(url):
+                return seconds
+        return 0
+
+    def body_path(self, digest):
+        return join(self.path, 'bodies', digest[:2], digest)
+
+    def load(self, entry, request):
+        digest, etag, last_modified, fetched_at, content_type, url = entry
+        path = self.body_path(digest)
+        if not exists(path):
+            return None
+        with open(path, 'rb') as f:
+            body = zlib.decompress(f.read())
+        headers = Headers({key: value for key, value in (
+            ('Content-Type', content_type), ('ETag', etag), ('Last-Modified', last_modified)) if value})
+        respcls = responsetypes.from_args(headers=headers, url=request.url, body=body)
+        return respcls(url=request.url, status=200, headers=headers, body=body, flags=['cached'])
+
+    def store(self, fingerprint, request, response):
+        body = response.body
+        digest = sha1(body).hexdigest()
+        path = self.body_path(digest)
+        if exists(path):
+            self.stats['deduplicated'] += 1
+        else:
+            os.makedirs(dirname(path), exist_ok=True)
+            data = zlib.compress(body)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self.stats['stored_bytes'] += len(data)
+        self.stats['stored'] += 1
+        self.index[fingerprint] = [digest, self.header(response, 'ETag'), self.header(response, 'Last-Modified'),
+                                   time.time(), self.header(response, 'Content-Type'), request.url]
+        self.changed = True
+
+    @staticmethod
+    def header(response, name):
+        value = response.headers.get(name)
+        return value.decode('latin-1') if value else None
+
     def process_request(self, request, spider):
         # Called for each request that goes through the downloader
         # middleware.
@@ -78,6 +275,38 @@ class BlogSpiderDownloaderMiddleware:
         # - or return a Request object
         # - or raise IgnoreRequest: process_exception() methods of
         #   installed downloader middleware will be called
+        if not self.path or request.method != 'GET' or request.meta.get('dont_cache'):
+            return None
+        fingerprint = request_fingerprint(request)
+        if request.meta.get('http_cache_entry', fingerprint) != fingerprint:
+            # 重定向后的请求复制了原来请求的meta和验证头, 它们属于原来的url
+            del request.meta['http_cache_entry']
+            request.headers.pop('If-None-Match', None)
+            request.headers.pop('If-Modified-Since', None)
+        self.stats['lookups'] += 1
+        entry = self.index.get(fingerprint)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        if time.time() - entry[3] < self.fresh_for(request.url):
+            response = self.load(entry, request)
+            if response is not None:
+                self.stats['hits'] += 1
+                self.stats['bytes_saved'] += len(response.body)
+                return response
+        if request.headers.get('If-None-Match') or request.headers.get('If-Modified-Since'):
+            # 请求自己做条件请求, 304交给它处理
+            self.stats['misses'] += 1
+            return None
+        etag, last_modified = entry[1], entry[2]
+        if etag:
+            request.headers['If-None-Match'] = etag
+        if last_modified:
+            request.headers['If-Modified-Since'] = last_modified
+        if etag or last_modified:
+            request.meta['http_cache_entry'] = fingerprint
+        else:
+            self.stats['misses'] += 1
         return None
 
     def process_response(self, request, response, spider):
@@ -87,6 +316,24 @@ class BlogSpiderDownloaderMiddleware:
         # - return a Response object
         # - return a Request object
         # - or raise IgnoreRequest
+        if not self.path or 'cached' in response.flags or request.method != 'GET' \
+                or request.meta.get('dont_cache'):
+            return response
+        fingerprint = request.meta.get('http_cache_entry')
+        if fingerprint and response.status == 304:
+            entry = self.index[fingerprint]
+            cached = self.load(entry, request)
+            if cached is not None:
+                entry[3] = time.time()
+                self.changed = True
+                self.stats['revalidated'] += 1
+                self.stats['bytes_saved'] += len(cached.body)
+                return cached
+            self.stats['misses'] += 1
+        elif fingerprint:
+            self.stats['misses'] += 1
+        if response.status == 200:
+            self.store(fingerprint or request_fingerprint(request), request, response)
         return response
 
     def process_exception(self, request, exception, spider):
@@ -101,3 +348,198 @@ class BlogSpiderDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+    def spider_closed(self, spider):
+        s = self.stats
+        if not s['lookups']:
+            return
+        for key, value in s.items():
+            spider.crawler.stats.set_value(f'httpcache/{key}', value)
+        hit_ratio = (s['hits'] + s['revalidated']) / s['lookups']
+        spider.logger.info(
+            f'缓存: {s["lookups"]} 次查找, 命中 {s["hits"]}, 304 {s["revalidated"]}, 未命中 {s["misses"]}, '
+            f'命中率 {hit_ratio:.1%}, 节省 {s["bytes_saved"] / 1024:.0f} KB; '
+            f'新保存 {s["stored"]} 个 (重复正文 {s["deduplicated"]}), 压缩后 {s["stored_bytes"] / 1024:.0f} KB')
+        if self.changed:
+            os.makedirs(self.path, exist_ok=True)
+            tmp = join(self.path, f'index.json.{os.getpid()}.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f, separators=(',', ':'))
+            os.replace(tmp, join(self.path, 'index.json'))
+            self.changed = False
+
+
+class HostState(object):
+    """AIMD state of one download slot (host)."""
+
+    def __init__(self, concurrency, delay=0.0, window=20):
+        self.concurrency = float(concurrency)
+        self.delay = delay
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.round_ok = 0
+        self.round_errors = 0
+        self.backoff_until = 0
+        self.retry_until = 0
+        self.increases = 0
+        self.decreases = 0
+
+    def p95(self):
+        if not self.latencies:
+            return 0
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(0.95 * len(values)))]
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+
+class AdaptiveConcurrencyMiddleware:
+    """
+    按host自适应并发数(AIMD)
+    每完成一轮(当前并发数个响应), p95延迟和错误率都低于ADAPTIVE_TARGET_LATENCY、
+    ADAPTIVE_TARGET_ERROR_RATE时并发数加1; p95超过目标时乘0.75;
+    429/5xx、超时和连接错误时减半(已经是1时加大下载间隔), 有Retry-After时在这段时间内按它的间隔下载.
+    调整的是scrapy下载器里这个host的slot, 每个host学到的并发数和间隔保存在ADAPTIVE_STATE_FILE,
+    下次运行从这里开始.
+    要放在RetryMiddleware(550)之后, 否则看不到会被重试的响应和异常
+    """
+
+    def __init__(self, crawler, path=None, start=2, maximum=16, target_latency=2.0,
+                 target_error_rate=0.05, window=20, max_delay=60):
+        self.crawler = crawler
+        self.path = path
+        self.start = start
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.target_error_rate = target_error_rate
+        self.window = window
+        self.max_delay = max_delay
+        self.hosts = {}
+        self.saved = {}
+        if path and exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.saved = json.load(f)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        s = cls(crawler, settings.get('ADAPTIVE_STATE_FILE'),
+                start=settings.getint('ADAPTIVE_START_CONCURRENCY', 2),
+                maximum=settings.getint('ADAPTIVE_MAX_CONCURRENCY', 16),
+                target_latency=settings.getfloat('ADAPTIVE_TARGET_LATENCY', 2.0),
+                target_error_rate=settings.getfloat('ADAPTIVE_TARGET_ERROR_RATE', 0.05),
+                window=settings.getint('ADAPTIVE_WINDOW', 20),
+                max_delay=settings.getfloat('ADAPTIVE_MAX_DELAY', 60))
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def host(self, key):
+        state = self.hosts.get(key)
+        if state is None:
+            saved = self.saved.get(key, {})
+            state = HostState(min(saved.get('concurrency', self.start), self.maximum),
+                              saved.get('delay', 0.0), self.window)
+            self.hosts[key] = state
+        return state
+
+    def slot(self, request, spider):
+        """(key, slot) of the downloader slot the request goes to, created if needed."""
+        return self.crawler.engine.downloader._get_slot(request, spider)
+
+    def apply(self, state, slot):
+        slot.concurrency = max(1, int(state.concurrency))
+        # Retry-After只在给出的时间内生效, 之后恢复学到的间隔
+        slot.delay = max(state.delay, state.retry_until - time.time(), 0)
+
+    def process_request(self, request, spider):
+        key, slot = self.slot(request, spider)
+        self.apply(self.host(key), slot)
+        return None
+
+    def process_response(self, request, response, spider):
+        if 'cached' in response.flags:
+            return response
+        key, slot = self.slot(request, spider)
+        state = self.host(key)
+        retry_after = self.retry_after(response)
+        if response.status == 429 or response.status >= 500 or retry_after:
+            self.back_off(state, retry_after)
+        else:
+            self.succeeded(state, request.meta.get('download_latency'))
+        self.apply(state, slot)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        # 只有网络错误和超时才减速, robots.txt等中间件的IgnoreRequest不算
+        if not isinstance(exception, RetryMiddleware.EXCEPTIONS_TO_RETRY):
+            return None
+        key, slot = self.slot(request, spider)
+        state = self.host(key)
+        self.back_off(state)
+        self.apply(state, slot)
+
+    def succeeded(self, state, latency):
+        state.outcomes.append(True)
+        if latency is not None:
+            state.latencies.append(latency)
+        state.round_ok += 1
+        if state.round_ok + state.round_errors < int(state.concurrency) or len(state.latencies) < 5:
+            return
+        errors = state.round_errors / (state.round_ok + state.round_errors)
+        state.round_ok = state.round_errors = 0
+        if state.p95() > self.target_latency:
+            state.concurrency = max(1.0, state.concurrency * 0.75)
+            state.decreases += 1
+        elif errors <= self.target_error_rate and time.time() >= state.backoff_until:
+            if state.delay:
+                state.delay = state.delay / 2 if state.delay > 0.1 else 0.0
+            else:
+                state.concurrency = min(self.maximum, state.concurrency + 1)
+            state.increases += 1
+
+    def back_off(self, state, retry_after=None):
+        state.outcomes.append(False)
+        state.round_errors += 1
+        now = time.time()
+        if retry_after:
+            state.retry_until = max(state.retry_until, now + retry_after)
+        if now < state.backoff_until:
+            # 同一轮里已经退避过, 这些是退避前就发出的请求
+            return
+        if state.concurrency > 1:
+            state.concurrency = max(1.0, state.concurrency / 2)
+        elif not retry_after:
+            state.delay = min(self.max_delay, max(0.5, state.delay * 2))
+        state.decreases += 1
+        state.round_ok = state.round_errors = 0
+        state.backoff_until = max(now + max(1.0, state.p95(), state.delay), state.retry_until)
+
+    def retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        value = value.decode('latin-1').strip()
+        if value.isdigit():
+            return min(self.max_delay, float(value))
+        try:
+            return min(self.max_delay, max(0.0, parsedate_to_datetime(value).timestamp() - time.time()))
+        except (TypeError, ValueError):
+            return None
+
+    def spider_closed(self, spider):
+        if not self.hosts:
+            return
+        for key, state in sorted(self.hosts.items()):
+            spider.logger.info(
+                f'{key}: 并发 {int(state.concurrency)}, 间隔 {state.delay:.2f}s, p95 {state.p95():.2f}s, '
+                f'错误率 {state.error_rate():.1%}, 增加 {state.increases} 次, 减少 {state.decreases} 次')
+            self.saved[key] = {'concurrency': int(state.concurrency), 'delay': round(state.delay, 3),
+                               'p95': round(state.p95(), 3), 'updated': int(time.time())}
+        if self.path:
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.saved, f, ensure_ascii=False, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
@@ -2,12 +2,374 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from hashlib import md5
+from os.path import abspath, dirname, exists, join
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from lxml import etree
+from twisted.internet import defer, reactor, threads
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'utils'))
+from html2text import html2text
+
+from blog_spider.search import SearchIndex, backfill, post_text, read_post
+
+INDEX_FILE = '.posts.json'
+unsafe_chars = re.compile(r'[\\/:*?"<>|\s]+')
+
+
+def convert_post(html, url):
+    """Runs in a worker process: (markdown, seconds it took)."""
+    start = time.perf_counter()
+    markdown = html2text(html, url)
+    return markdown, time.perf_counter() - start
+
+
+def post_filename(title, url, taken=None):
+    """文件名用标题; taken(文件名 -> url)里已经有别的url用了这个名字时加上url的hash"""
+    digest = md5(url.encode('utf-8')).hexdigest()
+    name = unsafe_chars.sub('', title or '') or digest[:12]
+    if taken is not None and taken.get(name + '.md', url) != url:
+        name = f'{name}-{digest[:8]}'
+    return name + '.md'
+
+
+def hexo_date(value):
+    """2020-01-20T23:00:00.000Z -> 2020-01-20 23:00:00, as Hexo writes it."""
+    if not value:
+        return ''
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return value
+
+
+def yaml_str(value):
+    # JSON的字符串也是YAML的双引号字符串, 标题里的: # [ 开头的-都不会破坏front-matter
+    return json.dumps(value or '', ensure_ascii=False)
+
+
+def yaml_list(values):
+    return ''.join(f'\n- {yaml_str(value)}' for value in values or [])
+
+
+def render_post(item):
+    """Hexo post: the same front-matter html2text.write_post writes, filled
+    with what the spider found on the page, its strings quoted."""
+    return f"""---
+title: {yaml_str(item['title'])}
+tags:{yaml_list(item.get('tags'))}
+date: {hexo_date(item.get('date'))}
+categories:{yaml_list(item.get('categories'))}
+description: {yaml_str(item['title'])}
+---
+
+转自[{item['title']}]({item['url']})
+
+
+{item['markdown']}"""
+
+
+def write_atomic(path, content):
+    """写到同一目录下的唯一临时文件再rename, 并发写入的线程不会用到同一个临时文件;
+    不用mkstemp(), 它创建的文件权限是0600, 这里和普通文件一样按umask给权限"""
+    tmp = f'{path}.{os.urandom(6).hex()}.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
 
 
 class BlogSpiderPipeline:
+    """
+    把item转换成Markdown, 写成Hexo文章
+    转换在进程池里做, 不占用Twisted的reactor线程;
+    写好的文章先缓存, 每HEXO_WRITE_BATCH篇在线程里一起写入(临时文件+rename),
+    正文hash和上次写入的一样、文件也还在的不再转换和写入, 标记了duplicate_of的近似重复文章也不写,
+    deleted的文章删掉以前写的文件, 还在缓存里没写的也不再写, 正在写的写完再删掉,
+    每个url写到哪个文件、正文hash保存在目录里的.posts.json,
+    标题相同的不同文章, 后写的文件名加上url的hash, 不会互相覆盖
+    """
+
+    def __init__(self, out_dir, workers=None, batch_size=20):
+        self.out_dir = out_dir
+        self.workers = workers
+        self.batch_size = batch_size
+        self.index = {}
+        # 文件名 -> url, 包括还没写入的
+        self.files = {}
+        self.buffer = []
+        self.flushing = set()
+        # 删掉的url, 正在写的批次里有它的话写完以后删掉
+        self.cancelled = set()
+        self.executor = None
+        self.started = None
+        self.stats = dict(converted=0, convert_seconds=0.0, chars=0, skipped=0, duplicates=0, deleted=0, failed=0,
+                          written=0, bytes=0, write_seconds=0.0, batches=0)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(settings.get('HEXO_POSTS_DIR'),
+                   workers=settings.getint('HEXO_CONVERT_WORKERS') or None,
+                   batch_size=settings.getint('HEXO_WRITE_BATCH', 20))
+
+    def open_spider(self, spider):
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = join(self.out_dir, INDEX_FILE)
+        if exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.index = json.load(f)
+        self.files = {entry['file']: url for url, entry in self.index.items()}
+        self.executor = ProcessPoolExecutor(self.workers)
+        self.started = time.perf_counter()
+
     def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        url = adapter['url']
+        if adapter.get('deleted'):
+            for pending in self.buffer:
+                if pending[0] == url:
+                    self.files.pop(pending[1], None)
+            self.buffer = [pending for pending in self.buffer if pending[0] != url]
+            self.cancelled.add(url)
+            entry = self.index.pop(url, None)
+            if entry:
+                self.files.pop(entry['file'], None)
+            if entry and exists(join(self.out_dir, entry['file'])):
+                os.remove(join(self.out_dir, entry['file']))
+                self.stats['deleted'] += 1
+            return item
+        if adapter.get('duplicate_of'):
+            self.stats['duplicates'] += 1
+            return item
+        html = adapter.get('html') or ''
+        digest = md5(html.encode('utf-8')).hexdigest()
+        entry = self.index.get(url)
+        if entry and entry['hash'] == digest and exists(join(self.out_dir, entry['file'])):
+            self.stats['skipped'] += 1
+            adapter['file'] = entry['file']
+            return item
+        if adapter.get('markdown') is not None:
+            d = defer.succeed((adapter['markdown'], 0.0))
+        else:
+            d = self.submit(convert_post, html, url)
+        d.addCallback(self.converted, item, digest)
+        d.addErrback(self.convert_failed, item, spider)
+        return d
+
+    def submit(self, func, *args):
+        """Run func in the process pool, the result arrives on a Deferred."""
+        d = defer.Deferred()
+
+        def done(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                reactor.callFromThread(d.errback, Failure(e))
+            else:
+                reactor.callFromThread(d.callback, result)
+
+        self.executor.submit(func, *args).add_done_callback(done)
+        return d
+
+    def converted(self, result, item, digest):
+        markdown, seconds = result
+        adapter = ItemAdapter(item)
+        adapter['markdown'] = markdown
+        self.stats['converted'] += 1
+        self.stats['convert_seconds'] += seconds
+        self.stats['chars'] += len(adapter.get('html') or '')
+        name = post_filename(adapter.get('title'), adapter['url'], self.files)
+        self.files[name] = adapter['url']
+        self.cancelled.discard(adapter['url'])
+        adapter['file'] = name
+        self.buffer.append((adapter['url'], name, digest, render_post(adapter)))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
         return item
+
+    def convert_failed(self, failure, item, spider):
+        self.stats['failed'] += 1
+        spider.logger.error(f'转换失败: {ItemAdapter(item)["url"]} {failure.value!r}')
+        return item
+
+    def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        d = threads.deferToThread(self.write_batch, batch)
+        d.addCallback(self.written, batch)
+        self.flushing.add(d)
+        d.addBoth(self.flushed, d)
+
+    def write_batch(self, batch):
+        """Runs in the reactor's thread pool: (seconds, bytes)."""
+        start = time.perf_counter()
+        size = 0
+        for url, name, digest, content in batch:
+            write_atomic(join(self.out_dir, name), content)
+            size += len(content.encode('utf-8'))
+        return time.perf_counter() - start, size
+
+    def written(self, result, batch):
+        seconds, size = result
+        self.stats['write_seconds'] += seconds
+        self.stats['bytes'] += size
+        self.stats['written'] += len(batch)
+        self.stats['batches'] += 1
+        for url, name, digest, content in batch:
+            if url in self.cancelled:
+                # 写的时候文章被删了, 文件名没有被别的url用的话删掉文件
+                if self.files.get(name, url) == url:
+                    self.files.pop(name, None)
+                    os.remove(join(self.out_dir, name))
+                continue
+            self.index[url] = {'file': name, 'hash': digest}
+
+    def flushed(self, result, d):
+        self.flushing.discard(d)
+        return result
+
+    @defer.inlineCallbacks
+    def close_spider(self, spider):
+        self.flush()
+        yield defer.DeferredList(list(self.flushing))
+        self.executor.shutdown()
+        write_atomic(join(self.out_dir, INDEX_FILE),
+                     json.dumps(self.index, ensure_ascii=False, indent=1, sort_keys=True))
+        self.report(spider)
+
+    def report(self, spider):
+        s = self.stats
+        elapsed = time.perf_counter() - self.started
+        for key, value in s.items():
+            spider.crawler.stats.set_value(f'posts/{key}', value)
+        spider.logger.info(
+            f'转换 {s["converted"]} 篇 (失败 {s["failed"]}, 未变化跳过 {s["skipped"]}, 重复 {s["duplicates"]}, 删除 {s["deleted"]}), '
+            f'进程内耗时 {s["convert_seconds"]:.2f}s, '
+            f'{s["chars"] / max(s["convert_seconds"], 1e-9) / 1024:.0f} KB/s')
+        spider.logger.info(
+            f'写入 {s["written"]} 篇 {s["bytes"] / 1024:.0f} KB, {s["batches"]} 批, '
+            f'耗时 {s["write_seconds"]:.2f}s; 总共 {elapsed:.1f}s, '
+            f'{s["written"] / max(elapsed, 1e-9):.1f} 篇/秒')
+
+
+class SearchIndexPipeline:
+    """
+    把文章加进全文索引SEARCH_INDEX_FILE(SQLite FTS5, 中文按二元组切分),
+    正文和标题没变的不更新, deleted和duplicate_of的文章从索引里删掉,
+    索引的是BlogSpiderPipeline转换好的文章(没有转换的读写好的文件), 不再解析html;
+    所有索引操作在一个专用线程里用它自己的连接做, 不占用reactor线程.
+    打开时把HEXO_POSTS_DIR/.posts.json里有、索引里还没有的文章补进索引,
+    所以没变化、不再输出的文章和删掉重建的索引也能搜到.
+    查询: python -m blog_spider.search 关键词
+    """
+
+    def __init__(self, path, posts_dir=None, batch=100):
+        self.path = path
+        self.posts_dir = posts_dir
+        self.batch = batch
+        self.index = None
+        self.pool = None
+        self.seconds = 0.0
+        self.counts = dict(added=0, updated=0, unchanged=0, deleted=0, backfilled=0)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(settings.get('SEARCH_INDEX_FILE'), settings.get('HEXO_POSTS_DIR'),
+                   settings.getint('SEARCH_INDEX_BATCH', 100))
+
+    def call(self, func, *args):
+        """Run func on the index thread, the result arrives on a Deferred."""
+        return threads.deferToThreadPool(reactor, self.pool, func, *args)
+
+    def open_spider(self, spider):
+        os.makedirs(dirname(self.path) or '.', exist_ok=True)
+        self.pool = ThreadPool(1, 1, name='search-index')
+        self.pool.start()
+        d = self.call(self.open_index)
+        d.addCallback(self.counted, 'backfilled')
+        return d
+
+    def open_index(self):
+        """Runs on the index thread: open the index and backfill it."""
+        start = time.perf_counter()
+        self.index = SearchIndex(self.path, self.batch)
+        posts = {}
+        if self.posts_dir and exists(join(self.posts_dir, INDEX_FILE)):
+            with open(join(self.posts_dir, INDEX_FILE), encoding='utf-8') as f:
+                posts = json.load(f)
+        return backfill(self.index, self.posts_dir, posts), time.perf_counter() - start
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        if adapter.get('deleted') or adapter.get('duplicate_of'):
+            d = self.call(self.delete, adapter['url'])
+        else:
+            d = self.call(self.add, adapter.asdict())
+        d.addCallback(self.counted)
+        d.addCallback(lambda _: item)
+        return d
+
+    def add(self, post):
+        """Runs on the index thread: (added, updated or unchanged, seconds)."""
+        start = time.perf_counter()
+        url = post['url']
+        path = join(self.posts_dir, post['file']) if self.posts_dir and post.get('file') else None
+        if post.get('markdown') is not None:
+            text = post_text(render_post(post))
+        elif path and exists(path):
+            text = read_post(path)[2]
+        else:
+            # 转换失败了, 只能用html的文字
+            root = etree.HTML(post['html']) if post.get('html') else None
+            text = root.xpath('string()') if root is not None else ''
+        result = self.index.add(url, post.get('title'), text, file=post.get('file'),
+                                date=hexo_date(post.get('date')) or None)
+        return result, time.perf_counter() - start
+
+    def delete(self, url):
+        start = time.perf_counter()
+        return self.index.delete(url) and 'deleted', time.perf_counter() - start
+
+    def counted(self, result, key=None):
+        value, seconds = result
+        self.seconds += seconds
+        if key:
+            self.counts[key] += value
+        elif value:
+            self.counts[value] += 1
+
+    @defer.inlineCallbacks
+    def close_spider(self, spider):
+        total = yield self.call(self.close_index)
+        self.pool.stop()
+        c = self.counts
+        for key, value in c.items():
+            spider.crawler.stats.set_value(f'search/{key}', value)
+        indexed = c['added'] + c['updated'] + c['backfilled']
+        spider.logger.info(
+            f'索引: 新增 {c["added"]}, 更新 {c["updated"]}, 未变 {c["unchanged"]}, 删除 {c["deleted"]}, '
+            f'补充 {c["backfilled"]}, 共 {total} 篇, 耗时 {self.seconds:.2f}s, '
+            f'{indexed / max(self.seconds, 1e-9):.0f} 篇/秒')
+
+    def close_index(self):
+        total = len(self.index)
+        self.index.close()
+        return total
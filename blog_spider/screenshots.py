@@ -0,0 +1,97 @@
+"""Screenshot policy and background writing for the selenium spiders."""
+import logging
+import os
+import queue
+import threading
+import time
+from hashlib import md5
+from random import random
+
+
+class ScreenshotWriter(object):
+    """Writes PNG screenshots to a directory on a background thread.
+
+    save() only queues the bytes and returns the path the file will have,
+    so the browser thread does not wait on the disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='screenshot-writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, png = item
+            try:
+                with open(path, 'wb') as f:
+                    f.write(png)
+            except OSError as e:
+                logging.warning(f'截图保存失败: {path} {e}')
+
+    def save(self, url, png, reason=''):
+        name = md5(url.encode('utf-8')).hexdigest()
+        if reason:
+            name = f'{name}-{reason}'
+        path = os.path.join(self.path, f'{name}-{int(time.time() * 1000)}.png')
+        self.queue.put((path, png))
+        return path
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class ScreenshotPolicy(object):
+    """Decides when a page is worth a screenshot.
+
+    A page is captured when its meta asks for it (``meta['screenshot']``),
+    when loading it failed and on_error is set, or otherwise with
+    probability sample_rate.
+    """
+
+    def __init__(self, path, sample_rate=0.0, on_error=True):
+        self.sample_rate = sample_rate
+        self.on_error = on_error
+        self.path = path
+        self._writer = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(getattr(settings, 'SCREENSHOT_DIR', 'screenshots'),
+                   sample_rate=getattr(settings, 'SCREENSHOT_SAMPLE_RATE', 0.0),
+                   on_error=getattr(settings, 'SCREENSHOT_ON_ERROR', True))
+
+    @property
+    def writer(self):
+        # the directory and thread are only created once something is captured
+        if self._writer is None:
+            self._writer = ScreenshotWriter(self.path)
+        return self._writer
+
+    def wanted(self, meta=None, error=False):
+        if error:
+            return self.on_error
+        if meta and meta.get('screenshot'):
+            return True
+        return self.sample_rate > 0 and random() < self.sample_rate
+
+    def capture(self, driver, url, meta=None, error=False):
+        """Take a screenshot if the policy wants one; return its path or None."""
+        if not self.wanted(meta, error):
+            return None
+        try:
+            png = driver.get_screenshot_as_png()
+        except Exception as e:
+            logging.warning(f'截图失败: {url} {e}')
+            return None
+        return self.writer.save(url, png, 'error' if error else '')
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
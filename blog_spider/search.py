@@ -0,0 +1,322 @@
+"""Full-text index of the crawled posts, in SQLite FTS5.
+
+FTS5's own tokenizers either keep a run of Chinese text as one token
+(unicode61) or need three characters per query term (trigram), so the
+text is tokenized here: CJK runs become overlapping bigrams, the way
+Lucene's CJK analyzer does it, other words are lowercased as they are.
+A query term is searched as the phrase of its tokens, so 自动化测试 only
+matches the bigrams 自动 动化 化测 测试 next to each other.  A single
+character is searched as the prefix of a bigram, which misses it at the
+end of a run (化 in 自动化), so the last character of every run is also
+indexed on its own, after the rest of the text where it cannot come
+between the tokens of a phrase.
+
+    python -m blog_spider.search [--index FILE] [--limit N] 关键词 ...
+    python -m blog_spider.search --reindex [--posts DIR]
+
+The text indexed for a post is its Hexo file without the front-matter
+and the targets of links and images, whether it comes from the crawl or
+from the files (backfill(), --reindex), so both give the same hash.
+"""
+import json
+import optparse
+import os
+import re
+import sqlite3
+import time
+import zlib
+from hashlib import md5
+
+CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+token_pattern = re.compile(f'([{CJK}]+)|((?:(?![{CJK}])[^\\W_])+)')
+EXCERPT = 120
+# 分词方式改了就加1, 打开旧的索引时按posts里保存的正文重新分词
+TOKENS_VERSION = 2
+front_matter = re.compile(r'\A---\n(.*?)\n---\n', re.S)
+link_target = re.compile(r'\]\([^)\s]*(?:\s+"[^"]*")?\)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY,
+    url TEXT UNIQUE NOT NULL,
+    title TEXT,
+    file TEXT,
+    date TEXT,
+    hash TEXT,
+    excerpt TEXT,
+    body BLOB
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(title, body, content='',
+                                                        tokenize="unicode61 remove_diacritics 0");
+"""
+
+
+def tokens(text):
+    """Tokens of the text as a list: CJK runs as overlapping bigrams (a
+    lone character as itself), other words lowercased."""
+    result = []
+    for cjk, word in token_pattern.findall(text.lower()):
+        if word:
+            result.append(word)
+        elif len(cjk) == 1:
+            result.append(cjk)
+        else:
+            result.extend(map(str.__add__, cjk[:-1], cjk[1:]))
+    return result
+
+
+def index_tokens(text):
+    """The tokens indexed for the text, joined by spaces: tokens(), then
+    the last character of each CJK run longer than one."""
+    result = tokens(text)
+    ends = dict.fromkeys(cjk[-1] for cjk, word in token_pattern.findall(text.lower()) if len(cjk) > 1)
+    return ' '.join(result + list(ends))
+
+
+def match_query(query):
+    """FTS5 MATCH expression: every whitespace separated term, as a phrase."""
+    phrases = []
+    for term in query.split():
+        words = tokens(term)
+        if not words:
+            continue
+        phrase = '"' + ' '.join(words) + '"'
+        if len(words) == 1 and len(words[0]) == 1 and token_pattern.match(words[0]).group(1):
+            # 单个汉字按前缀匹配二元组, 也匹配单独索引的词尾的字
+            phrase += '*'
+        phrases.append(phrase)
+    return ' AND '.join(phrases)
+
+
+def post_text(content):
+    """Searchable text of a Hexo post file."""
+    return link_target.sub(']', front_matter.sub('', content, 1))
+
+
+def unquote(value):
+    """A front-matter value, without the double quotes render_post puts
+    around strings."""
+    if value.startswith('"'):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+def read_post(path):
+    """(title, date, text) of a Hexo post file written by BlogSpiderPipeline."""
+    with open(path, encoding='utf-8') as f:
+        content = f.read()
+    fields = {}
+    header = front_matter.match(content)
+    if header:
+        for line in header.group(1).splitlines():
+            key, sep, value = line.partition(':')
+            if sep and not line.startswith(('-', ' ')):
+                fields.setdefault(key, unquote(value.strip()))
+    return fields.get('title', ''), fields.get('date') or None, post_text(content)
+
+
+def backfill(index, posts_dir, posts, missing_only=True):
+    """Index the posts of a HEXO_POSTS_DIR, whose .posts.json maps url ->
+    {'file': ...}: only those the index does not have yet, or all of them
+    (unchanged ones cost a hash).  Returns the number added or updated."""
+    known = index.urls() if missing_only else set()
+    count = 0
+    for url, entry in posts.items():
+        path = os.path.join(posts_dir, entry['file'])
+        if url in known or not os.path.exists(path):
+            continue
+        title, date, text = read_post(path)
+        if index.add(url, title, text, file=entry['file'], date=date) != 'unchanged':
+            count += 1
+    index.commit()
+    return count
+
+
+class SearchIndex(object):
+    """Posts by url: title, file, date, an excerpt and the zlib compressed
+    text in ``posts``; the tokenized title and text are indexed in the
+    contentless ``posts_fts`` under the same rowid.  A contentless table
+    only forgets a row when given the tokens it was indexed with, which
+    is what the compressed text is kept for.
+
+    An index written with another TOKENS_VERSION is tokenized again from
+    the text in ``posts`` when it is opened.
+
+    Changes are committed every ``batch`` add() or delete() calls, and by
+    commit() and close().
+
+    bm25 is computed for every row a query matches, which takes hundreds
+    of milliseconds for a word found in most of 100k posts.  A query
+    matching more than ``max_ranked`` posts only ranks the ``max_ranked``
+    matches indexed last (highest rowid) and the posts it matches in the
+    title, the last ``max_ranked`` of those too if there are more, so an
+    old post with the words in its title is still found.
+    """
+
+    def __init__(self, path, batch=100, max_ranked=1000):
+        self.path = path
+        self.batch = batch
+        self.max_ranked = max_ranked
+        self.pending = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('PRAGMA cache_size=-65536')
+        created = not self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'posts_fts'").fetchone()
+        self.db.executescript(SCHEMA)
+        if created:
+            # 标题的权重是正文的10倍
+            self.db.execute("INSERT INTO posts_fts(posts_fts, rank) VALUES('rank', 'bm25(10.0, 1.0)')")
+            self.db.execute(f'PRAGMA user_version={TOKENS_VERSION}')
+            self.db.commit()
+        elif self.db.execute('PRAGMA user_version').fetchone()[0] != TOKENS_VERSION:
+            self.retokenize()
+
+    def __len__(self):
+        return self.db.execute('SELECT count(*) FROM posts').fetchone()[0]
+
+    def urls(self):
+        return {url for url, in self.db.execute('SELECT url FROM posts')}
+
+    def add(self, url, title, text, file=None, date=None):
+        """Index or re-index a post: 'added', 'updated' or 'unchanged'."""
+        title = title or ''
+        digest = md5(f'{title}\0{text}'.encode('utf-8')).hexdigest()
+        row = self.db.execute('SELECT id, hash FROM posts WHERE url = ?', (url,)).fetchone()
+        if row and row[1] == digest:
+            return 'unchanged'
+        excerpt = ' '.join(text.split())[:EXCERPT]
+        body = zlib.compress(text.encode('utf-8'), 1)
+        if row:
+            rowid = row[0]
+            self.unindex(rowid)
+            self.db.execute('UPDATE posts SET title = ?, file = ?, date = ?, hash = ?, excerpt = ?, body = ? '
+                            'WHERE id = ?', (title, file, date, digest, excerpt, body, rowid))
+        else:
+            rowid = self.db.execute('INSERT INTO posts (url, title, file, date, hash, excerpt, body) '
+                                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (url, title, file, date, digest, excerpt, body)).lastrowid
+        self.db.execute('INSERT INTO posts_fts (rowid, title, body) VALUES (?, ?, ?)',
+                        (rowid, index_tokens(title), index_tokens(text)))
+        self.changed()
+        return 'updated' if row else 'added'
+
+    def delete(self, url):
+        row = self.db.execute('SELECT id FROM posts WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return False
+        self.unindex(row[0])
+        self.db.execute('DELETE FROM posts WHERE id = ?', (row[0],))
+        self.changed()
+        return True
+
+    def unindex(self, rowid):
+        title, body = self.db.execute('SELECT title, body FROM posts WHERE id = ?', (rowid,)).fetchone()
+        self.db.execute("INSERT INTO posts_fts (posts_fts, rowid, title, body) VALUES ('delete', ?, ?, ?)",
+                        (rowid, index_tokens(title), index_tokens(zlib.decompress(body).decode('utf-8'))))
+
+    def retokenize(self):
+        """Index all the posts again, with the current tokens()."""
+        # 旧的分词删不掉单独的行, 只能整个清空
+        self.db.execute("INSERT INTO posts_fts(posts_fts) VALUES('delete-all')")
+        for rowid, title, body in self.db.execute('SELECT id, title, body FROM posts').fetchall():
+            self.db.execute('INSERT INTO posts_fts (rowid, title, body) VALUES (?, ?, ?)',
+                            (rowid, index_tokens(title), index_tokens(zlib.decompress(body).decode('utf-8'))))
+        self.db.execute(f'PRAGMA user_version={TOKENS_VERSION}')
+        self.commit()
+
+    def changed(self):
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+
+    def search(self, query, limit=10):
+        """[(url, title, file, date, excerpt, score)], best first."""
+        match = match_query(query)
+        if not match:
+            return []
+        select = ('SELECT p.url, p.title, p.file, p.date, p.excerpt, posts_fts.rank FROM posts_fts '
+                  'JOIN posts p ON p.id = posts_fts.rowid WHERE posts_fts MATCH ? ')
+        # +rank: 让SQLite过滤以后再排序, ORDER BY rank交给FTS5的话它会先给所有匹配的行打分
+        bound = self.bound(match)
+        if bound is None:
+            return self.db.execute(select + 'ORDER BY +posts_fts.rank LIMIT ?', (match, limit)).fetchall()
+        # 匹配太多时只给最后索引的max_ranked篇和标题匹配的(太多时也是最后的max_ranked篇)打分
+        title_match = f'title : ({match})'
+        return self.db.execute(
+            select + 'AND (posts_fts.rowid > ? OR posts_fts.rowid IN ('
+                     'SELECT rowid FROM posts_fts WHERE posts_fts MATCH ? AND rowid > ?)) '
+                     'ORDER BY +posts_fts.rank LIMIT ?',
+            (match, bound, title_match, self.bound(title_match) or 0, limit)).fetchall()
+
+    def bound(self, match):
+        """rowid below the ``max_ranked`` last matches, None if there are
+        no more.  Only walks the rowids, without computing bm25."""
+        row = self.db.execute('SELECT rowid FROM posts_fts WHERE posts_fts MATCH ? '
+                              'ORDER BY rowid DESC LIMIT 1 OFFSET ?', (match, self.max_ranked)).fetchone()
+        return row[0] if row else None
+
+    def optimize(self):
+        """Merge the FTS5 segments, for faster queries after a large import."""
+        self.db.execute("INSERT INTO posts_fts(posts_fts) VALUES('optimize')")
+        self.commit()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+def main():
+    from blog_spider import settings
+
+    p = optparse.OptionParser('%prog [options] 关键词 ...')
+    p.add_option("--index", dest="index", default=getattr(settings, 'SEARCH_INDEX_FILE', None),
+                 help="索引文件, 默认是SEARCH_INDEX_FILE")
+    p.add_option("--limit", dest="limit", type="int", default=10, help="最多显示几条")
+    p.add_option("--reindex", dest="reindex", action="store_true", default=False,
+                 help="按文章目录里的.posts.json和Markdown文件重建索引, 删掉已经没有的文章")
+    p.add_option("--posts", dest="posts", default=getattr(settings, 'HEXO_POSTS_DIR', None),
+                 help="--reindex的文章目录, 默认是HEXO_POSTS_DIR")
+    options, args = p.parse_args()
+    if options.reindex:
+        reindex(options.index, options.posts)
+        return
+    if not args:
+        p.error('需要关键词')
+    index = SearchIndex(options.index)
+    start = time.perf_counter()
+    results = index.search(' '.join(args), options.limit)
+    elapsed = time.perf_counter() - start
+    for n, (url, title, file, date, excerpt, score) in enumerate(results, 1):
+        print(f'{n:>3}. {title}  [{-score:.3f}]')
+        print(f'     {url}' + (f'  {file}' if file else ''))
+        print(f'     {excerpt}')
+    print(f'{len(results)} 条结果, 共 {len(index)} 篇, {elapsed * 1000:.1f}ms')
+    index.close()
+
+
+def reindex(path, posts_dir):
+    from blog_spider.pipelines import INDEX_FILE
+
+    with open(os.path.join(posts_dir, INDEX_FILE), encoding='utf-8') as f:
+        posts = json.load(f)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    index = SearchIndex(path)
+    start = time.perf_counter()
+    deleted = sum(index.delete(url) for url in index.urls() - set(posts))
+    indexed = backfill(index, posts_dir, posts, missing_only=False)
+    index.optimize()
+    print(f'索引 {indexed} 篇, 删除 {deleted} 篇, 共 {len(index)} 篇, {time.perf_counter() - start:.1f}s')
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -43,15 +43,17 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-# SPIDER_MIDDLEWARES = {
-#    'blog_spider.middlewares.BlogSpiderSpiderMiddleware': 543,
-# }
+SPIDER_MIDDLEWARES = {
+   'blog_spider.middlewares.BlogSpiderSpiderMiddleware': 543,
+   'blog_spider.middlewares.MetricsSpiderMiddleware': 950,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#    'blog_spider.middlewares.BlogSpiderDownloaderMiddleware': 543,
-# }
+DOWNLOADER_MIDDLEWARES = {
+   'blog_spider.middlewares.BlogSpiderDownloaderMiddleware': 543,
+   'blog_spider.middlewares.AdaptiveConcurrencyMiddleware': 560,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
@@ -61,9 +63,10 @@ ROBOTSTXT_OBEY = True
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-# ITEM_PIPELINES = {
-#    'blog_spider.pipelines.BlogSpiderPipeline': 300,
-# }
+ITEM_PIPELINES = {
+   'blog_spider.pipelines.BlogSpiderPipeline': 300,
+   'blog_spider.pipelines.SearchIndexPipeline': 400,
+}
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -101,4 +104,55 @@ SEARCH_LIST = [
     '自动化测试 月牙天冲',
 ]
 # PROXY_API = "http://192.168.20.27:5010"
-PROXY_API = "http://127.0.0.1:5555/random"
\ No newline at end of file
+PROXY_API = "http://127.0.0.1:5555/random"
+# 截图: meta['screenshot']为True、打开失败、或按比例抽样时才截图, 在后台线程写入目录
+SCREENSHOT_DIR = join(dirname(dirname(abspath(__file__))), 'screenshots')
+SCREENSHOT_SAMPLE_RATE = 0.0
+SCREENSHOT_ON_ERROR = True
+
+# 页面就绪等待: document.readyState, 网络空闲秒数(0为不检查), 超时秒数
+WAIT_READY_STATE = 'complete'
+WAIT_NETWORK_IDLE = 0
+WAIT_TIMEOUT = 10
+
+# hexo_spider的每个url的状态(Last-Modified, ETag, 正文hash), 用于增量爬取
+HEXO_STATE_FILE = join(dirname(dirname(abspath(__file__))), '.hexo_state.json')
+
+# BlogSpiderPipeline: Hexo文章输出目录, 转换进程数(0为cpu个数), 每批写入的文章数
+HEXO_POSTS_DIR = join(dirname(dirname(abspath(__file__))), 'posts')
+HEXO_CONVERT_WORKERS = 0
+HEXO_WRITE_BATCH = 20
+
+# BlogSpiderDownloaderMiddleware的响应缓存目录(None为不缓存),
+# 新鲜期: (url正则, 秒), 第一个匹配的生效, 都不匹配时每次都带ETag/Last-Modified重新验证
+HTTP_CACHE_DIR = join(dirname(dirname(abspath(__file__))), '.httpcache')
+HTTP_CACHE_FRESHNESS = [
+    (r'(sitemap|atom|rss|feed)[^/]*\.xml$', 0),
+    (r'/\d{4}/\d{2}/\d{2}/', 24 * 3600),
+]
+
+# AdaptiveConcurrencyMiddleware: 每个host的并发数按延迟和错误率自动调整(AIMD)
+# 新host的初始并发数, 最大并发数, 目标p95延迟(秒), 目标错误率, 统计的最近响应数, 最大下载间隔(秒)
+ADAPTIVE_STATE_FILE = join(dirname(dirname(abspath(__file__))), '.host_concurrency.json')
+ADAPTIVE_START_CONCURRENCY = 2
+ADAPTIVE_MAX_CONCURRENCY = 16
+ADAPTIVE_TARGET_LATENCY = 2.0
+ADAPTIVE_TARGET_ERROR_RATE = 0.05
+ADAPTIVE_WINDOW = 20
+ADAPTIVE_MAX_DELAY = 60
+
+# BlogSpiderSpiderMiddleware的近似重复检测: SimHash相差不超过SIMHASH_DISTANCE位算重复,
+# SIMHASH_ACTION为drop时丢弃, link时保留并在duplicate_of里记下原文url; 指纹保存在SIMHASH_INDEX_FILE
+SIMHASH_DISTANCE = 3
+SIMHASH_ACTION = 'drop'
+SIMHASH_INDEX_FILE = join(dirname(dirname(abspath(__file__))), '.simhash.json')
+
+# MetricsSpiderMiddleware的回调耗时统计(METRICS_ENABLED为False时关闭): 每METRICS_INTERVAL秒追加一行json, 并重写Prometheus文本格式的文件
+METRICS_ENABLED = True
+METRICS_JSONL_FILE = join(dirname(dirname(abspath(__file__))), 'metrics', 'metrics.jsonl')
+METRICS_PROM_FILE = join(dirname(dirname(abspath(__file__))), 'metrics', 'blog_spider.prom')
+METRICS_INTERVAL = 10
+
+# SearchIndexPipeline的全文索引(SQLite), 每多少篇提交一次
+SEARCH_INDEX_FILE = join(dirname(dirname(abspath(__file__))), 'posts', 'search.db')
+SEARCH_INDEX_BATCH = 100
@@ -0,0 +1,99 @@
+"""64-bit SimHash fingerprints of post text, and an index for near-duplicates.
+
+The fingerprint is built from character 3-gram shingles, which work for
+Chinese text without a word segmenter.  Two copies of a post whose
+fingerprints differ in at most k bits share at least one of k + 1 bands
+of the fingerprint (pigeonhole), so the index only compares a new
+fingerprint with the ones that match it exactly in some band.
+"""
+import re
+from collections import Counter
+from hashlib import blake2b
+
+BITS = 64
+SHINGLE = 3
+# 文字太少时指纹不可靠, 不参与查重
+MIN_TEXT = 100
+
+noise = re.compile(r'[\W_]+', re.U)
+
+
+def normalize(text):
+    return noise.sub('', text).lower()
+
+
+def feature_hash(feature):
+    return int.from_bytes(blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def simhash(text):
+    """64-bit SimHash of the text, None if it is shorter than MIN_TEXT."""
+    text = normalize(text)
+    if len(text) < MIN_TEXT:
+        return None
+    weights = [0] * BITS
+    for feature, count in Counter(text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)).items():
+        h = feature_hash(feature)
+        for bit in range(BITS):
+            if h >> bit & 1:
+                weights[bit] += count
+            else:
+                weights[bit] -= count
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class SimHashIndex(object):
+    """Fingerprints by key (the url), looked up within ``distance`` bits."""
+
+    def __init__(self, distance=3):
+        self.distance = distance
+        bands = distance + 1
+        edges = [BITS * i // bands for i in range(bands + 1)]
+        self.bands = [(start, (1 << (end - start)) - 1) for start, end in zip(edges, edges[1:])]
+        self.tables = [{} for _ in self.bands]
+        self.fingerprints = {}
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def keys(self, fingerprint):
+        for (shift, mask), table in zip(self.bands, self.tables):
+            yield table, fingerprint >> shift & mask
+
+    def add(self, key, fingerprint):
+        self.remove(key)
+        self.fingerprints[key] = fingerprint
+        for table, band in self.keys(fingerprint):
+            table.setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        fingerprint = self.fingerprints.pop(key, None)
+        if fingerprint is None:
+            return
+        for table, band in self.keys(fingerprint):
+            keys = table[band]
+            keys.discard(key)
+            if not keys:
+                del table[band]
+
+    def near(self, fingerprint, exclude=None):
+        """(key, distance) of the closest other fingerprint within distance, or None."""
+        best = None
+        seen = set()
+        for table, band in self.keys(fingerprint):
+            for key in table.get(band, ()):
+                if key == exclude or key in seen:
+                    continue
+                seen.add(key)
+                distance = hamming(fingerprint, self.fingerprints[key])
+                if distance <= self.distance and (best is None or distance < best[1]):
+                    best = key, distance
+        return best
@@ -1,12 +1,248 @@
+import json
+import re
+import sys
+from hashlib import md5
+from os.path import abspath, dirname, exists, join
+from urllib import parse
+
 import scrapy
+from lxml import etree
+
+sys.path.insert(0, join(dirname(dirname(dirname(abspath(__file__)))), 'utils'))
+from content_extract import get_extractor
+
+from blog_spider.feeds import iter_feed, iter_sitemap, parse_timestamp
+from blog_spider.items import BlogSpiderItem
+from blog_spider.pipelines import INDEX_FILE
+from blog_spider.state import CrawlState
+
+
+def has_class(name):
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
 
 
 class HexoSpiderSpider(scrapy.Spider):
+    """
+    增量爬取Hexo博客
+    从sitemap.xml和atom.xml发现文章, lastmod/updated不比上次新的文章直接跳过,
+    都没有的话(或者 -a full=1)再遍历首页、归档页(包括分页),
+    文章用上次保存的Last-Modified/ETag做条件请求, 返回304或者正文hash没变的文章不再输出,
+    但只限于上次的内容确实已经写成了文件(HEXO_POSTS_DIR/.posts.json里hash一样、文件也还在),
+    转换或写入失败、文件被删掉的文章会重新下载和输出,
+    以前爬到过、现在404/410的文章输出deleted的item; 删掉的文章也不在sitemap/feed里了,
+    所以sitemap/feed都处理完后, 状态里有、这次没有发现的文章再做一次条件请求,
+    转换成Markdown、写入文件在BlogSpiderPipeline里做,
+    每个url的状态保存在HEXO_STATE_FILE(或者 -a state=文件)
+
+    scrapy crawl hexo_spider -a start_url=http://tding.top/ -a state=.hexo_state.json
+    """
     name = 'hexo_spider'
     allowed_domains = ['tding.top']
     start_urls = ['http://tding.top/']
+    # sitemap里哪些url是文章, 其它的是标签、分类等页面;
+    # /archives/2021/、/archives/page/2/是归档列表, /archives/后面是abbrlink之类的才是文章
+    post_pattern = re.compile(r'/(\d{4}/\d{2}/\d{2}|posts?|p|archives(?!/(?:\d{4}|page)/))/[^/]+')
+
+    post_links = ' | '.join([
+        f'//a[{has_class("post-title-link")}]/@href',
+        f'//*[{has_class("post-title")}]//a/@href',
+        '//article//header//h1/a/@href',
+        '//article//header//h2/a/@href',
+    ])
+    page_links = ' | '.join([
+        f'//nav[{has_class("pagination")}]//a/@href',
+        '//a[@rel="next"]/@href',
+    ])
+    post_body = f'//div[{has_class("post-body")}]'
+
+    def __init__(self, start_url=None, state=None, full=False, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if start_url:
+            self.start_urls = [start_url]
+            self.allowed_domains = [parse.urlsplit(start_url).hostname]
+        self.state_path = state
+        # -a full=0 传进来的是字符串'0'
+        self.full = str(full).lower() in ('1', 'true', 'yes')
+        self.state = None
+        self.posts_dir = None
+        self.posts = {}
+        self.pending_feeds = 0
+        self.feed_entries = 0
+        # sitemap/feed里发现的文章
+        self.seen = set()
+
+    def start_requests(self):
+        self.state = CrawlState(self.state_path or self.settings.get('HEXO_STATE_FILE'))
+        self.posts_dir = self.settings.get('HEXO_POSTS_DIR')
+        index = join(self.posts_dir, INDEX_FILE) if self.posts_dir else None
+        if index and exists(index):
+            with open(index, encoding='utf-8') as f:
+                self.posts = json.load(f)
+        for url in self.start_urls:
+            if self.full:
+                yield from self.listing_requests(url)
+            yield self.feed_request(parse.urljoin(url, 'sitemap.xml'), self.parse_sitemap)
+            yield self.feed_request(parse.urljoin(url, 'atom.xml'), self.parse_feed)
+
+    def listing_requests(self, url):
+        yield scrapy.Request(url, callback=self.parse)
+        yield scrapy.Request(parse.urljoin(url, 'archives/'), callback=self.parse)
+
+    def feed_request(self, url, callback):
+        self.pending_feeds += 1
+        return scrapy.Request(url, callback=callback, errback=self.feed_failed, dont_filter=True)
 
+    def feed_failed(self, failure):
+        self.logger.info(f'读取失败: {failure.request.url} {failure.value}')
+        yield from self.feed_done()
 
+    def feed_done(self):
+        """所有sitemap/feed都处理完, 一篇文章都没找到时才遍历归档页,
+        找到了的话检查状态里有、sitemap/feed里没有的文章是不是被删了"""
+        self.pending_feeds -= 1
+        if self.pending_feeds:
+            return
+        if not self.feed_entries:
+            if not self.full:
+                self.logger.info('sitemap和atom里没有文章, 遍历首页和归档页')
+                for url in self.start_urls:
+                    yield from self.listing_requests(url)
+            return
+        for url in list(self.state.urls):
+            if url not in self.seen and parse.urlsplit(url).hostname in self.allowed_domains:
+                self.crawler.stats.inc_value('hexo/recheck')
+                yield self.post_request(url)
+
+    def discovered(self, url, updated):
+        """sitemap/feed里的一篇文章: 时间不比上次处理时新就跳过"""
+        self.feed_entries += 1
+        self.seen.add(url)
+        entry = self.state.get(url)
+        if updated and self.stored(url):
+            known = parse_timestamp(entry.get('updated'))
+            if known and updated <= known:
+                self.crawler.stats.inc_value('hexo/feed_unchanged')
+                return None
+        return self.post_request(url, updated)
+
+    def stored(self, url):
+        """状态里记录的内容已经写成了文章: .posts.json里有这个url, hash一样, 文件也还在"""
+        post = self.posts.get(url)
+        return (post is not None and post.get('hash') == self.state.get(url).get('hash')
+                and exists(join(self.posts_dir, post['file'])))
+
+    def closed(self, reason):
+        if self.state is not None:
+            self.state.save()
+
+    def post_request(self, url, updated=None):
+        """带上上次的验证信息请求文章, updated是sitemap/feed里的更新时间"""
+        entry = self.state.get(url) if self.stored(url) else {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return scrapy.Request(url, callback=self.parse_post, headers=headers,
+                              meta={'handle_httpstatus_list': [304, 404, 410], 'post_url': url,
+                                    'feed_updated': updated.isoformat() if updated else None})
 
     def parse(self, response):
-        pass
+        """首页、归档页: 文章链接和分页"""
+        for href in response.xpath(self.post_links).getall():
+            yield self.post_request(response.urljoin(href))
+        for href in response.xpath(self.page_links).getall():
+            yield scrapy.Request(response.urljoin(href), callback=self.parse)
+
+    def parse_sitemap(self, response):
+        try:
+            for url, lastmod, is_index in iter_sitemap(response.body):
+                if is_index:
+                    yield self.feed_request(url, self.parse_sitemap)
+                elif self.post_pattern.search(parse.urlsplit(url).path):
+                    request = self.discovered(url, lastmod)
+                    if request:
+                        yield request
+        except etree.XMLSyntaxError as e:
+            # 比如sitemap.xml返回了200的HTML页面
+            self.logger.info(f'不是有效的XML: {response.url} {e}')
+        yield from self.feed_done()
+
+    def parse_feed(self, response):
+        try:
+            for url, updated in iter_feed(response.body):
+                request = self.discovered(response.urljoin(url), updated)
+                if request:
+                    yield request
+        except etree.XMLSyntaxError as e:
+            self.logger.info(f'不是有效的XML: {response.url} {e}')
+        yield from self.feed_done()
+
+    def parse_post(self, response):
+        stats = self.crawler.stats
+        url = response.meta.get('post_url', response.url)
+        updated = response.meta.get('feed_updated')
+        if response.status == 304:
+            stats.inc_value('hexo/not_modified')
+            self.state.update(url, updated=updated)
+            return
+        if response.status in (404, 410):
+            # 以前爬到过的文章被删了
+            if url in self.state:
+                stats.inc_value('hexo/deleted')
+                self.state.remove(url)
+                yield BlogSpiderItem(url=url, deleted=True)
+            return
+        body = response.xpath(self.post_body)
+        if body:
+            html = body[0].get()
+        else:
+            # 不是NexT主题, 自动识别正文
+            root = etree.HTML(response.body)
+            page = get_extractor().page(root, response.url)
+            if page.node is root:
+                stats.inc_value('hexo/not_a_post')
+                return
+            html = etree.tostring(page.node, encoding='unicode')
+
+        digest = md5(html.encode('utf-8')).hexdigest()
+        unchanged = self.state.get(url).get('hash') == digest and self.stored(url)
+        self.state.update(url, hash=digest, updated=updated,
+                          etag=self.header(response, 'ETag'),
+                          last_modified=self.header(response, 'Last-Modified'))
+        if unchanged:
+            stats.inc_value('hexo/unchanged')
+            return
+        stats.inc_value('hexo/changed')
+        yield BlogSpiderItem(
+            url=url,
+            title=self.post_title(response),
+            date=response.xpath('//meta[@property="article:published_time"]/@content | '
+                                '//time[contains(@itemprop, "datePublished")]/@datetime').get(),
+            tags=self.names(response.xpath(
+                f'//meta[@property="article:tag"]/@content | //div[{has_class("post-tags")}]//a//text()'
+            ).getall()),
+            categories=self.names(response.xpath(
+                '//span[@itemprop="about"]//span[@itemprop="name"]/text() | '
+                f'//span[{has_class("post-category")}]//a//text()').getall()),
+            html=html,
+        )
+
+    @staticmethod
+    def names(values):
+        """去掉空白和标签前的#, 去重并保持顺序"""
+        return list(dict.fromkeys(v.strip().lstrip('#').strip() for v in values if v.strip()))
+
+    @staticmethod
+    def header(response, name):
+        value = response.headers.get(name)
+        return value.decode('latin-1') if value else None
+
+    @staticmethod
+    def post_title(response):
+        title = ''.join(response.xpath(f'//h1[{has_class("post-title")}]//text()').getall()).strip()
+        if not title:
+            title = response.xpath('//meta[@property="og:title"]/@content').get('')
+        if not title:
+            title = response.xpath('//title/text()').get('').split('|')[0]
+        return title.strip()
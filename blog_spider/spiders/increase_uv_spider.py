@@ -8,26 +8,26 @@ from urllib import parse
 from random import randrange, random, choice
 
 import requests
-from selenium.common.exceptions import NoSuchElementException, MoveTargetOutOfBoundsException
+from selenium.common.exceptions import NoSuchElementException, MoveTargetOutOfBoundsException, WebDriverException, \
+    TimeoutException
 
 sys.path.append('../..')
 import time
-from importlib import import_module
 
 from scrapy.http import HtmlResponse
 from scrapy_selenium import SeleniumRequest
 from scrapy.utils.request import request_fingerprint
 
-from selenium.webdriver import DesiredCapabilities
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.common.action_chains import ActionChains
 from scrapy.linkextractors import LinkExtractor
 from scrapy.spiders import Rule
-from user_agent import generate_user_agent
 from blog_spider import settings
+from blog_spider.dom import CommandCounter, query_nodes, visible_nodes
+from blog_spider.driver import WINDOW_HEIGHT, WINDOW_WIDTH, create_driver
+from blog_spider.screenshots import ScreenshotPolicy
+from blog_spider.waits import WaitPolicy
 
 logging.basicConfig(handlers=[logging.FileHandler(filename="debug.log",
                                                   encoding='utf-8', mode='w')],
@@ -53,8 +53,8 @@ class CustomSeleniumSpider(object):
             )
         ),
     )
-    WIDTH = 1366
-    HEIGHT = 942
+    WIDTH = WINDOW_WIDTH
+    HEIGHT = WINDOW_HEIGHT
 
     def __init__(self, use_google=None):
         self.use_google = use_google
@@ -64,6 +64,8 @@ class CustomSeleniumSpider(object):
         browser_executable_path = getattr(settings, 'SELENIUM_BROWSER_EXECUTABLE_PATH', None)
         driver_arguments = getattr(settings, 'SELENIUM_DRIVER_ARGUMENTS', None)
         self._init_driver(driver_name, driver_executable_path, driver_arguments, browser_executable_path)
+        self.screenshots = ScreenshotPolicy.from_settings(settings)
+        self.waits = WaitPolicy.from_settings(settings)
         #
         self.queue = list()
         self.fingerprints = set()
@@ -74,66 +76,18 @@ class CustomSeleniumSpider(object):
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.driver:
+            print(f'WebDriver命令: {self.commands.total} 次, 平均每页 {self.commands.per_page():.1f} 次, '
+                  f'等待页面就绪 {self.waits.waited:.1f}s / {self.waits.calls} 次')
             self.driver.quit()
+        self.screenshots.close()
 
     def _init_driver(self, driver_name, driver_executable_path, driver_arguments,
                      browser_executable_path):
-        """Initialize the selenium webdriver
-
-        Parameters
-        ----------
-        driver_name: str
-            The selenium ``WebDriver`` to use
-        driver_executable_path: str
-            The path of the executable binary of the driver
-        driver_arguments: list
-            A list of arguments to initialize the driver
-        browser_executable_path: str
-            The path of the executable binary of the browser
-        """
-        webdriver_base_path = f'selenium.webdriver.{driver_name}'
-
-        driver_klass_module = import_module(f'{webdriver_base_path}.webdriver')
-        driver_klass = getattr(driver_klass_module, 'WebDriver')
-        if driver_name == 'phantomjs':
-            cap = DesiredCapabilities.PHANTOMJS.copy()
-
-            # for key, value in settings.SELENIUM_DRIVER_HEADERS.items():
-            #     cap['phantomjs.page.customHeaders.{}'.format(key)] = value
-            service_args = ['--web-security=no', '--ssl-protocol=any', '--ignore-ssl-errors=true']
-            driver_kwargs = {
-                'executable_path': driver_executable_path,
-                'service_args': service_args,
-                'desired_capabilities': cap
-            }
-        else:
-            driver_options_module = import_module(f'{webdriver_base_path}.options')
-            driver_options_klass = getattr(driver_options_module, 'Options')
-            driver_options = driver_options_klass()
-            if browser_executable_path:
-                driver_options.binary_location = browser_executable_path
-            for argument in driver_arguments:
-                driver_options.add_argument(argument)
-            # 随机头
-            driver_options.add_argument(
-                f"user-agent={generate_user_agent(os=('win',), device_type=('desktop',), navigator=('chrome',))}")
-            # 代理
-            proxy = self.get_proxy()
-            if proxy:
-                driver_options.add_argument(
-                    f"--proxy-server={proxy}"
-                )
-            driver_kwargs = {
-                'executable_path': driver_executable_path,
-                f'{driver_name}_options': driver_options
-            }
-
-        self.driver = driver_klass(**driver_kwargs)
-        # 隐式等待5秒，可以自己调节
-        self.driver.implicitly_wait(5)
-        self.driver.set_page_load_timeout(60)
-        # driver.maximize_window()
-        self.driver.set_window_size(self.WIDTH, self.HEIGHT)
+        """Initialize the selenium webdriver, see ``create_driver``"""
+        self.driver = create_driver(driver_name, driver_executable_path, driver_arguments,
+                                    browser_executable_path, proxy=self.get_proxy(),
+                                    width=self.WIDTH, height=self.HEIGHT)
+        self.commands = CommandCounter(self.driver)
 
     def reset(self):
         self.search_page_count = 0
@@ -158,37 +112,52 @@ class CustomSeleniumSpider(object):
             return None
         return requests.get(proxy_api, timeout=10).text.replace('http://', '')
 
-    def fetch(self, url, meta=None):
-        self.driver.get(url)
-        self.random_sleep(start=1)
-        meta = meta or dict()
+    def fetch(self, url, meta=None, wait_for=None, timeout=None):
+        """
+        打开url并返回HtmlResponse
+        等到页面就绪(readyState, wait_for的css/xpath出现, 可选的网络空闲)就返回, 最多等timeout秒,
+        等待用时在meta['wait_seconds']
+        meta['screenshot']为True时截图, 另外按SCREENSHOT_SAMPLE_RATE抽样截图, 打开失败时也会截图,
+        截图在后台线程写入SCREENSHOT_DIR, 路径在meta['screenshot_path']
+        """
+        self.commands.start_page(url)
+        try:
+            self.driver.get(url)
+        except WebDriverException:
+            path = self.screenshots.capture(self.driver, url, error=True)
+            if path:
+                logging.warning(f'打开失败: {url} 截图: {path}')
+            raise
+        meta = dict(meta or ())
+        try:
+            meta['wait_seconds'] = self.waits.wait(self.driver, wait_for, timeout)
+        except TimeoutException as e:
+            logging.warning(f'等待超时: {url} {e.msg}')
+            meta['wait_seconds'] = self.waits.timeout if timeout is None else timeout
+        return self.build_response(url, meta)
+
+    def get_response(self, meta=None):
+        return self.build_response(self.driver.current_url, meta)
+
+    def build_response(self, url, meta=None):
+        meta = dict(meta or ())
         body = str.encode(self.driver.page_source)
-        screenshot = self.driver.get_screenshot_as_base64()
+        path = self.screenshots.capture(self.driver, url, meta)
+        if path:
+            meta['screenshot_path'] = path
         return HtmlResponse(
             url,
             body=body,
             encoding='utf-8',
             request=SeleniumRequest(
                 url=url,
-                meta=dict(screenshot=screenshot, **meta),
-            )
-        )
-
-    def get_response(self):
-        body = str.encode(self.driver.page_source)
-        screenshot = self.driver.get_screenshot_as_base64()
-        return HtmlResponse(
-            self.driver.current_url,
-            body=body,
-            encoding='utf-8',
-            request=SeleniumRequest(
-                url=self.driver.current_url,
-                meta=dict(screenshot=screenshot),
+                meta=meta,
             )
         )
 
     def extract_links(self):
-        return [i for i in self.driver.find_elements_by_tag_name('a') if i.is_displayed()]
+        """Visible links of the current page as DomNode(element, href, text, visible)"""
+        return visible_nodes(self.driver, '//a')
 
     def add_request(self, request):
         fp = request_fingerprint(request, keep_fragments=True)
@@ -208,24 +177,31 @@ class CustomSeleniumSpider(object):
 
     def baidu_search(self, text):
         logging.debug(f'百度搜索: {text}')
-        self.fetch('https://baidu.com')
-        WebDriverWait(self.driver, 10, ).until(EC.presence_of_element_located((By.ID, 'kw')))
+        self.fetch('https://baidu.com', wait_for='#kw')
         ele_input = self.driver.find_element_by_id('kw')
         ele_input.send_keys(text)
         self.random_sleep()
         ele_submit = self.driver.find_element_by_id('su')
         self.perform_click(ele_submit)
-        self.random_sleep(start=3)
+        self.wait_results('#content_left')
 
     def google_search(self, text):
         logging.debug(f'谷歌搜索: {text}')
-        self.fetch('https://google.com')
-        WebDriverWait(self.driver, 10, ).until(EC.presence_of_element_located((By.NAME, 'q')))
+        self.fetch('https://google.com', wait_for='[name="q"]')
         ele_input = self.driver.find_element(by=By.NAME, value='q')
         ele_input.send_keys(text)
         self.random_sleep()
         ele_input.send_keys(Keys.ENTER)
-        self.random_sleep(start=3)
+        self.wait_results('#rso')
+
+    def wait_results(self, selector):
+        """等搜索结果出现; 超时(验证码、同意页面等)时记日志、截图, 继续往下走"""
+        try:
+            self.waits.wait(self.driver, selector)
+        except TimeoutException as e:
+            url = self.driver.current_url
+            path = self.screenshots.capture(self.driver, url, error=True)
+            logging.warning(f'等待搜索结果超时: {url} {e.msg}' + (f' 截图: {path}' if path else ''))
 
     @staticmethod
     def get_baidu_true_url(link):
@@ -255,11 +231,9 @@ class CustomSeleniumSpider(object):
         self.random_sleep(start=2)
 
     def baidu_find_domain_result(self):
-        elements = self.driver.find_elements_by_xpath('//*[@id="content_left"]/div')
-        for element in elements:
+        for a in query_nodes(self.driver, '//*[@id="content_left"]/div', './h3/a'):
             try:
-                a = element.find_element_by_xpath('./h3/a')
-                link = a.get_attribute('href')
+                link = a.href
                 title = a.text
                 link_true = self.get_baidu_true_url(link)
                 print(f"匹配: {title} {link_true}")
@@ -278,11 +252,9 @@ class CustomSeleniumSpider(object):
                 return self.baidu_find_domain_result()
 
     def google_find_domain_result(self):
-        elements = self.driver.find_elements_by_xpath('//*[@id="rso"]/div/div[@class="g"]')
-        for element in elements:
+        for a in query_nodes(self.driver, '//*[@id="rso"]/div/div[@class="g"]', './/a'):
             try:
-                a = element.find_element_by_xpath('.//a')
-                link = a.get_attribute('href')
+                link = a.href
                 title = a.text
                 print(f"匹配: {title} {link}")
                 if self.get_domain(link) in self.allowed_domains:
@@ -325,7 +297,7 @@ class CustomSeleniumSpider(object):
                 #                                                                           self.HEIGHT)
                 to_xoffset, to_yoffset = randrange(5, 30), randrange(5, 30)
                 idx += 1
-                ele = choice([i for i in self.driver.find_elements_by_tag_name('div') if i.is_displayed()])
+                ele = choice(visible_nodes(self.driver, '//div')).element
                 print(f'{idx} drag {ele.location} -> ({to_xoffset} {to_yoffset})')
                 # chains = chains.move_by_offset(xoffset, yoffset). \
                 #     click_and_hold().pause(self.random_sec()). \
@@ -348,8 +320,9 @@ class CustomSeleniumSpider(object):
                 break
             self.perform_view()
             ele_link = choice(self.extract_links())
-            print(f"选中: {ele_link.get_attribute('href')}")
-            self.perform_click(ele_link)
+            print(f"选中: {ele_link.href}")
+            self.commands.start_page(ele_link.href)
+            self.perform_click(ele_link.element)
 
             self.random_sleep(5)
 
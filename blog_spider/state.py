@@ -0,0 +1,46 @@
+"""Per-url crawl state, persisted between runs of the incremental spiders."""
+import json
+import os
+
+
+class CrawlState(object):
+    """Remembers for every url what the last crawl saw: the Last-Modified and
+    ETag validators, a hash of the post content and the timestamp the
+    feeds or sitemap listed.
+
+    Stored as one json file, written atomically by save().
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.urls = {}
+        self.changed = False
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.urls = json.load(f)
+
+    def __contains__(self, url):
+        return url in self.urls
+
+    def get(self, url):
+        return self.urls.get(url, {})
+
+    def update(self, url, **values):
+        entry = self.urls.setdefault(url, {})
+        values = {key: value for key, value in values.items() if value is not None}
+        if any(entry.get(key) != value for key, value in values.items()):
+            entry.update(values)
+            self.changed = True
+
+    def remove(self, url):
+        if self.urls.pop(url, None) is not None:
+            self.changed = True
+
+    def save(self):
+        if not self.path or not self.changed:
+            return
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.urls, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.changed = False
@@ -0,0 +1,100 @@
+"""Readiness waits for selenium page loads.
+
+Instead of a fixed sleep after ``driver.get`` (or an implicit wait that
+stretches every failed lookup), WaitPolicy polls the page with one
+``execute_script`` per round and returns as soon as it is ready.
+"""
+import threading
+import time
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+READY_STATES = ('loading', 'interactive', 'complete')
+
+PAGE_STATE_JS = """
+var selector = arguments[0];
+var found = true;
+if (selector) {
+    if (selector.charAt(0) === '/' || selector.charAt(0) === '(') {
+        found = document.evaluate(selector, document, null,
+                                  XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue !== null;
+    } else {
+        found = document.querySelector(selector) !== null;
+    }
+}
+return [document.readyState, performance.getEntriesByType('resource').length, found];
+"""
+
+
+class WaitPolicy(object):
+    """When is a page ready?
+
+    ready_state: the document.readyState to reach ('interactive' or
+        'complete'), None to not check it
+    selector: a CSS selector, or an xpath when it starts with '/' or '(',
+        that has to be present; wait() can override it per call
+    network_idle: seconds without a new finished resource request, 0 to not
+        check it.  A heuristic: requests still in flight are not visible.
+    timeout: default number of seconds before TimeoutException
+
+    Time spent in wait() is added up in ``waited`` and ``calls``.
+    """
+
+    def __init__(self, ready_state='complete', selector=None, network_idle=0, timeout=10, poll=0.1):
+        self.ready_state = ready_state
+        self.selector = selector
+        self.network_idle = network_idle
+        self.timeout = timeout
+        self.poll = poll
+        self.waited = 0.0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings, **kwargs):
+        kwargs.setdefault('ready_state', getattr(settings, 'WAIT_READY_STATE', 'complete'))
+        kwargs.setdefault('network_idle', getattr(settings, 'WAIT_NETWORK_IDLE', 0))
+        kwargs.setdefault('timeout', getattr(settings, 'WAIT_TIMEOUT', 10))
+        return cls(**kwargs)
+
+    def wait(self, driver, selector=None, timeout=None):
+        """Block until the page is ready and return the seconds waited.
+
+        Raises selenium's TimeoutException after timeout seconds.
+        """
+        selector = selector or self.selector
+        timeout = self.timeout if timeout is None else timeout
+        start = now = time.perf_counter()
+        resources = None
+        last_change = start
+        error = None
+        try:
+            while True:
+                try:
+                    state, count, found = driver.execute_script(PAGE_STATE_JS, selector)
+                except WebDriverException as e:
+                    # the page is navigating (JavascriptException and the like): not ready yet
+                    state, count, found, error = None, resources, False, e
+                now = time.perf_counter()
+                if count != resources:
+                    resources, last_change = count, now
+                if self.ready(state, found, now - last_change):
+                    return now - start
+                if now - start >= timeout:
+                    raise TimeoutException(
+                        f'page not ready after {timeout}s: readyState={state}, '
+                        f'selector {selector!r} found={found}, idle {now - last_change:.1f}s'
+                        + (f', last error {error.msg!r}' if state is None else ''))
+                time.sleep(self.poll)
+        finally:
+            with self._lock:
+                self.waited += now - start
+                self.calls += 1
+
+    def ready(self, state, found, idle):
+        if self.ready_state and (state not in READY_STATES or
+                                 READY_STATES.index(state) < READY_STATES.index(self.ready_state)):
+            return False
+        if not found:
+            return False
+        return not self.network_idle or idle >= self.network_idle
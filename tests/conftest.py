@@ -0,0 +1,8 @@
+import sys
+from os.path import abspath, dirname, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+# utils/ is a directory of scripts that import each other by module name
+for path in (ROOT, join(ROOT, 'utils')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
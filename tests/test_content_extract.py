@@ -0,0 +1,100 @@
+from lxml import etree
+
+import content_extract
+from content_extract import (LEARN_PAGES, MIN_CONTENT, ContentExtractor, Page, SiteTemplate, block_signatures,
+                             boilerplate_blocks, learn_title)
+
+PARAGRAPH = '用 Scrapy 爬取 Hexo 博客的文章，转换成 Markdown 以后按标题保存，没有变化的文章不会再下载。'
+
+
+def page(title, heading, paragraphs=4, footer='本文采用 CC BY-NC-SA 4.0 许可协议，转载请注明出处。'):
+    body = ''.join(f'<p>{heading}: {PARAGRAPH} {i}</p>' for i in range(paragraphs))
+    return etree.HTML(f'<html><head><title>{title}</title></head><body>'
+                      f'<div class="sidebar"><a href="/">首页</a><a href="/archives/">归档</a></div>'
+                      f'<div class="post"><h1 class="post-title">{heading}</h1>'
+                      f'<div class="post-body">{body}<p>{footer}</p></div></div></body></html>')
+
+
+def test_learn_title_uses_confirmed_separator():
+    root = page('Hexo 配置 | 我的博客', 'Hexo 配置')
+    assert learn_title(root, root) == ('//h1[@class="post-title"]', '|')
+
+
+def test_learn_title_does_not_cut_unconfirmed_separator():
+    root = page('Hexo - NexT 主题', 'Hexo - NexT 主题')
+    assert learn_title(root, root) == ('//h1[@class="post-title"]', None)
+    root = page('Hexo - NexT 主题', '别的标题')
+    assert learn_title(root, root) == ('//title', '|')
+
+
+def test_template_round_trip():
+    template = SiteTemplate('//div[@class="post-body"]', '//h1', None, boilerplate=['a'], learned=['x'],
+                            seen={'a': 2})
+    again = SiteTemplate.from_dict(template.to_dict())
+    assert again.to_dict() == template.to_dict()
+    assert again.seen == {'a': 2}
+
+
+def test_match_short_post_only_by_class():
+    root = page('短文', '短文', paragraphs=0, footer='很短')
+    assert SiteTemplate('//div[@class="post-body"]').match(root) is not None
+    positional = SiteTemplate(root.getroottree().getpath(root.xpath('//div[@class="post-body"]')[0]))
+    assert positional.positional
+    assert positional.match(root) is None
+    assert positional.match(page('长文', '长文')) is not None
+    assert SiteTemplate('//p').match(page('长文', '长文')) is None
+
+
+def test_extractor_learns_boilerplate_and_caches():
+    extractor = ContentExtractor()
+    first = extractor.page(page('一 | 博客', '一'), 'http://a/1')
+    assert first.title == '一'
+    assert first.full_title == '一 | 博客'
+    assert first.node.get('class') == 'post-body'
+    assert extractor.stats == {'cached': 0, 'scored': 1, 'relearned': 0}
+
+    extractor.page(page('二 | 博客', '二'), 'http://a/2')
+    third = extractor.page(page('三 | 博客', '三'), 'http://a/3')
+    assert extractor.stats['cached'] == 2
+    text = ''.join(third.node.itertext())
+    assert '许可协议' not in text
+    assert len(text) >= MIN_CONTENT
+
+
+def test_extractor_saves_templates(tmp_path):
+    path = str(tmp_path / 'templates.json')
+    ContentExtractor(path).page(page('一 | 博客', '一'), 'http://a/1')
+    templates = ContentExtractor(path).templates['a']
+    assert [t.content_xpath for t in templates] == ['//div[@class="post-body"]']
+
+
+def test_boilerplate_dropped_after_learning():
+    extractor = ContentExtractor()
+    for i, title in enumerate('一二三四五'):
+        node = extractor.page(page(f'{title} | 博客', title), f'http://a/{i}').node
+        assert '许可协议' not in ''.join(node.itertext()) or i == 0
+    template = extractor.templates['a'][0]
+    assert len(template.learned) == LEARN_PAGES
+    assert template.boilerplate_keys == {'p.'}
+
+
+def test_boilerplate_blocks_matches_block_signatures():
+    root = page('一', '一')
+    node = root.xpath('//div[@class="post-body"]')[0]
+    notice = '<div class="copyright">本文采用 CC BY-NC-SA 4.0 许可协议</div>'
+    node.append(etree.fromstring(f'<div>{notice}</div>'))
+    node.append(etree.fromstring(f'<pre>{notice}</pre>'))
+    blocks = block_signatures(node)
+    boilerplate = {sig for sig in blocks if sig.startswith('div.copyright:')}
+    assert len(boilerplate) == 1
+    keys = {sig.rsplit(':', 1)[0] for sig in boilerplate}
+    assert boilerplate_blocks(node, boilerplate, keys) == [blocks[sig] for sig in boilerplate]
+
+
+def test_no_hashing_once_learned_without_boilerplate(monkeypatch):
+    template = SiteTemplate('//div[@class="post-body"]', learned=['a', 'b', 'c'])
+    monkeypatch.setattr(content_extract, 'block_signatures', None)
+    monkeypatch.setattr(content_extract, 'boilerplate_blocks', None)
+    root = page('一', '一')
+    found = template.match(root)
+    assert template.page(root, found) == (Page('一', '一', found), False)
@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+
+from blog_spider.feeds import iter_feed, iter_sitemap, parse_timestamp
+
+SITEMAP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>http://a/2021/01/01/post/</loc><lastmod>2021-01-02T03:04:05.000Z</lastmod></url>
+  <url><loc> http://a/tags/x/ </loc></url>
+  <url><lastmod>2021-01-01</lastmod></url>
+</urlset>"""
+
+SITEMAP_INDEX = b"""<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>http://a/post-sitemap.xml</loc><lastmod>2021-01-01</lastmod></sitemap>
+</sitemapindex>"""
+
+ATOM = b"""<feed xmlns="http://www.w3.org/2005/Atom">
+  <entry><link rel="enclosure" href="http://a/x.png"/><link href="http://a/1/"/>
+    <updated>2021-01-02T03:04:05+08:00</updated></entry>
+  <entry><link href="http://a/2/"/><published>2021-01-01T00:00:00Z</published></entry>
+</feed>"""
+
+RSS = b"""<rss><channel><item><link> http://a/1/ </link><pubDate>Sat, 02 Jan 2021 03:04:05 GMT</pubDate></item>
+<item><title>no link</title></item></channel></rss>"""
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_parse_timestamp():
+    assert parse_timestamp('2021-01-02T03:04:05.000Z') == utc(2021, 1, 2, 3, 4, 5)
+    assert parse_timestamp('2021-01-02T11:04:05+08:00') == utc(2021, 1, 2, 3, 4, 5)
+    assert parse_timestamp('2021-01-02') == utc(2021, 1, 2)
+    assert parse_timestamp('Sat, 02 Jan 2021 03:04:05 GMT') == utc(2021, 1, 2, 3, 4, 5)
+    assert parse_timestamp('') is None
+    assert parse_timestamp('yesterday') is None
+
+
+def test_iter_sitemap():
+    assert list(iter_sitemap(SITEMAP)) == [('http://a/2021/01/01/post/', utc(2021, 1, 2, 3, 4, 5), False),
+                                           ('http://a/tags/x/', None, False)]
+    assert list(iter_sitemap(SITEMAP_INDEX)) == [('http://a/post-sitemap.xml', utc(2021, 1, 1), True)]
+
+
+def test_iter_feed():
+    assert list(iter_feed(ATOM)) == [('http://a/1/', utc(2021, 1, 1, 19, 4, 5)),
+                                     ('http://a/2/', utc(2021, 1, 1))]
+    assert list(iter_feed(RSS)) == [('http://a/1/', utc(2021, 1, 2, 3, 4, 5))]
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+from scrapy.http import HtmlResponse, Request, XmlResponse
+from scrapy.utils.test import get_crawler
+from twisted.python.failure import Failure
+
+from blog_spider.items import BlogSpiderItem
+from blog_spider.spiders.hexo_spider import HexoSpiderSpider
+
+SITE = 'http://blog.example.com/'
+
+
+def sitemap(*urls):
+    entries = ''.join(f'<url><loc>{SITE}{path}</loc><lastmod>{lastmod}</lastmod></url>' for path, lastmod in urls)
+    return f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</urlset>'.encode()
+
+
+ATOM = b'<feed xmlns="http://www.w3.org/2005/Atom"></feed>'
+
+
+@pytest.fixture
+def posts_dir(tmp_path):
+    posts = tmp_path / 'posts'
+    posts.mkdir()
+    return posts
+
+
+def make_spider(tmp_path, posts_dir, state=None, posts=None, **kwargs):
+    state_path = tmp_path / 'state.json'
+    if state is not None:
+        state_path.write_text(json.dumps(state), encoding='utf-8')
+    for post in (posts or {}).values():
+        (posts_dir / post['file']).write_text('---\n---\n', encoding='utf-8')
+    (posts_dir / '.posts.json').write_text(json.dumps(posts or {}), encoding='utf-8')
+    crawler = get_crawler(HexoSpiderSpider, {'HEXO_POSTS_DIR': str(posts_dir)})
+    spider = HexoSpiderSpider.from_crawler(crawler, start_url=SITE, state=str(state_path), **kwargs)
+    requests = list(spider.start_requests())
+    return spider, {request.url: request for request in requests}
+
+
+def respond(request, body, status=200, cls=XmlResponse):
+    return cls(request.url, body=body, status=status, request=request, encoding='utf-8')
+
+
+def urls(results):
+    return [result.url for result in results if isinstance(result, Request)]
+
+
+def test_sitemap_skips_listing_pages(tmp_path, posts_dir):
+    spider, requests = make_spider(tmp_path, posts_dir)
+    body = sitemap(('2021/01/01/post/', '2021-01-01'), ('archives/2021/', '2021-01-01'),
+                   ('archives/page/2/', '2021-01-01'), ('archives/1a2b3c/', '2021-01-01'), ('tags/x/', ''))
+    results = list(spider.parse_sitemap(respond(requests[SITE + 'sitemap.xml'], body)))
+    assert urls(results) == [SITE + '2021/01/01/post/', SITE + 'archives/1a2b3c/']
+
+
+def test_unchanged_posts_skipped_and_missing_ones_rechecked(tmp_path, posts_dir):
+    state = {SITE + 'p/old/': {'hash': 'a', 'updated': '2021-01-01T00:00:00+00:00', 'etag': '"o"'},
+             SITE + 'p/gone/': {'hash': 'b', 'updated': '2021-01-01T00:00:00+00:00', 'etag': '"g"'},
+             'http://other.example.com/p/x/': {'hash': 'c'}}
+    posts = {SITE + 'p/old/': {'file': 'old.md', 'hash': 'a'}, SITE + 'p/gone/': {'file': 'gone.md', 'hash': 'b'}}
+    spider, requests = make_spider(tmp_path, posts_dir, state, posts)
+
+    results = list(spider.parse_sitemap(respond(requests[SITE + 'sitemap.xml'], sitemap(
+        ('p/old/', '2021-01-01T00:00:00Z'), ('p/new/', '2021-02-01T00:00:00Z')))))
+    assert urls(results) == [SITE + 'p/new/']
+    assert spider.crawler.stats.get_value('hexo/feed_unchanged') == 1
+
+    # 最后一个feed处理完才检查sitemap/feed里没有的文章
+    rechecks = list(spider.parse_feed(respond(requests[SITE + 'atom.xml'], ATOM)))
+    assert urls(rechecks) == [SITE + 'p/gone/']
+    assert rechecks[0].headers['If-None-Match'] == b'"g"'
+    assert spider.crawler.stats.get_value('hexo/recheck') == 1
+
+    deleted = list(spider.parse_post(respond(rechecks[0], b'', status=404, cls=HtmlResponse)))
+    assert deleted == [BlogSpiderItem(url=SITE + 'p/gone/', deleted=True)]
+    assert SITE + 'p/gone/' not in spider.state
+
+
+def test_no_entries_falls_back_to_listing(tmp_path, posts_dir):
+    spider, requests = make_spider(tmp_path, posts_dir)
+    assert list(spider.parse_sitemap(respond(requests[SITE + 'sitemap.xml'], b'<html><p>not xml'))) == []
+    failure = Failure(TimeoutError('timeout'))
+    failure.request = requests[SITE + 'atom.xml']
+    results = list(spider.feed_failed(failure))
+    assert urls(results) == [SITE, SITE + 'archives/']
+
+
+def test_full_parses_flag(tmp_path, posts_dir):
+    assert not make_spider(tmp_path, posts_dir, full='0')[0].full
+    spider, requests = make_spider(tmp_path, posts_dir, full='1')
+    assert spider.full
+    assert SITE + 'archives/' in requests
@@ -0,0 +1,149 @@
+import pytest
+
+import html2text
+from benchmark import (CORPUS, TextRecorder, corpus_pages, legacy_escape, legacy_optwrap, load_corpus, make_ascii_text,
+                       make_converter)
+
+
+def test_optwrap_matches_legacy_on_ascii():
+    text = make_ascii_text(20000)
+    h = html2text.HTML2Text()
+    assert h.optwrap(text) == legacy_optwrap(text, h.body_width)
+
+
+def test_cjk_wraps_by_display_width():
+    markdown = html2text.html2text('<p>' + '配置' * 50 + '</p>')
+    lines = markdown.rstrip('\n').split('\n')
+    assert len(lines) > 1
+    assert all(html2text.text_width(line) <= html2text.BODY_WIDTH for line in lines)
+    assert ''.join(lines) == '配置' * 50
+
+
+@pytest.mark.parametrize('html, link', [
+    ('<p>' + '字' * 24 + 'x <a href="/t/中文标签路径很长很长/">a</a> b</p>', '[a](/t/中文标签路径很长很长/)'),
+    ('<p>' + '字' * 35 + '<a href="http://x.com/a">配置说明</a>字</p>', '[配置说明](http://x.com/a)'),
+    ('<p>' + '字' * 35 + '<img src="/图片.png" alt="配置图"/>字</p>', '![配置图](/图片.png)'),
+    ('<p>' + '字' * 35 + ' https://例子.com/路径/很长。后面</p>', 'https://例子.com/路径/很长'),
+])
+def test_cjk_wrapping_keeps_links_whole(html, link):
+    markdown = html2text.html2text(html)
+    assert link in markdown.split('\n')[1]
+
+
+def test_cjk_long_link_gets_own_line():
+    link = '[配置](http://x.com/' + '很长' * 40 + ')'
+    markdown = html2text.html2text('<p>' + '字' * 10 + '<a href="http://x.com/' + '很长' * 40 + '">配置</a>字字</p>')
+    assert markdown == '字' * 10 + '\n' + link + '\n字字\n\n'
+
+
+@pytest.mark.parametrize('size', [1, 7, 1024, html2text.CHUNK_SIZE])
+def test_iter_markdown_matches_handle(size):
+    for name, data, options in load_corpus(CORPUS):
+        expected = make_converter(html2text, options).handle(data)
+        h = make_converter(html2text, options)
+        assert ''.join(h.iter_markdown(html2text.iter_chunks(data, size))) == expected, name
+
+
+def test_iter_markdown_flushes_long_text(monkeypatch):
+    monkeypatch.setattr(html2text, 'PENDING_LIMIT', 100)
+    html = '<p>' + ' '.join(['word'] * 500) + '</p>'
+    h = html2text.HTML2Text()
+    fed = []
+    feed = h.feed
+    monkeypatch.setattr(h, 'feed', lambda data: fed.append(len(data)) or feed(data))
+    markdown = ''.join(h.iter_markdown(html2text.iter_chunks(html, 64)))
+    assert max(fed) <= 100 + 64
+    assert markdown == html2text.HTML2Text().handle(html)
+
+
+def test_tag_dispatch_names_handlers():
+    h = html2text.HTML2Text()
+    assert set(h.tag_handlers) == set(h.tag_dispatch)
+    for tag, (method, late) in h.tag_handlers.items():
+        assert method == getattr(h, h.tag_dispatch[tag][0])
+        assert isinstance(late, bool)
+
+
+def test_tag_dispatch_output():
+    html = ('<h2>T</h2><ul><li>a</li><li>b</li></ul><p><em>e</em> <strong>s</strong> <code>c</code><br>n</p>'
+            '<pre>code\n  x</pre><blockquote>q</blockquote><hr><span>sp</span>')
+    assert html2text.html2text(html) == ('## T\n\n  * a\n  * b\n\n_e_ **s** `c`  \nn\n\n'
+                                         '    code\n      x\n\n> q\n\n* * *\n\nsp\n\n')
+
+
+def test_unknown_tag_ends_list_run():
+    h = html2text.HTML2Text()
+    h.lastWasList = True
+    h.handle_starttag('span', [])
+    assert not h.lastWasList
+
+
+
+def reference_converter(each=0):
+    h = html2text.HTML2Text()
+    h.inline_links = False
+    h.links_each_paragraph = each
+    return h
+
+
+def test_reference_links_are_reused():
+    h = reference_converter()
+    markdown = h.handle('<p><a href="http://a/x">x</a> and <a href="http://a/y">y</a> '
+                        '<a href="http://a/x">again</a></p><p>z <a href="http://a/x">x</a></p>')
+    assert markdown == ('[x][1] and [y][2] [again][1]\n\nz [x][1]\n\n'
+                        '   [1]: http://a/x\n\n   [2]: http://a/y\n\n')
+    assert not h.a and not h.a_index
+
+
+def test_reference_links_each_paragraph():
+    h = reference_converter(each=1)
+    markdown = h.handle('<p><a href="http://a/x">x</a> <a href="http://a/x">x2</a></p>'
+                        '<p><a href="http://a/x">x</a></p>')
+    assert markdown == '[x][1] [x2][1]\n\n   [1]: http://a/x\n\n[x][2]\n\n   [2]: http://a/x\n\n'
+
+
+def test_reference_links_title_is_part_of_key():
+    h = reference_converter()
+    markdown = h.handle('<a href="http://a/x" title="one">a</a> <a href="http://a/x" title="two">b</a>')
+    assert '[a][1] [b][2]' in markdown
+
+
+def corpus_texts():
+    recorder = TextRecorder()
+    for name, data in corpus_pages(CORPUS):
+        recorder.feed(data)
+    recorder.close()
+    return recorder.texts
+
+
+@pytest.mark.parametrize('snob', [False, True])
+def test_escaper_matches_legacy_escape_on_corpus(snob):
+    escaper = html2text.md_section_escapers[snob, True]
+    texts = corpus_texts()
+    assert texts
+    for text in texts:
+        assert escaper.escape(text) == legacy_escape(text, snob), text
+
+
+@pytest.mark.parametrize('text', ['1. item', '  + plus', '- dash', '--- rule', 'a\n2. b', 'a\\*b', 'plain'])
+def test_escape_md_section_without_collapse(text):
+    legacy = html2text.md_backslash_matcher.sub(r"\\\1", text)
+    for matcher in (html2text.md_dot_matcher, html2text.md_plus_matcher, html2text.md_dash_matcher):
+        legacy = matcher.sub(r"\1\\\2", legacy)
+    assert html2text.escape_md_section(text) == legacy
+
+
+def test_reset_restores_options():
+    pool = html2text.HTML2TextPool(size=1)
+    h = pool.acquire()
+    h.inline_links = False
+    pool.release(h)
+    again = pool.acquire()
+    assert again is h
+    assert again.inline_links == html2text.INLINE_LINKS
+
+
+def test_pool_shares_options():
+    options = html2text.default_options(body_width=0)
+    assert html2text.get_pool(options) is html2text.get_pool(html2text.default_options(body_width=0))
+    assert html2text.get_pool(options).convert('<p>' + 'word ' * 40 + '</p>').count('\n') == 1
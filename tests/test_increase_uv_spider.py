@@ -0,0 +1,54 @@
+import pytest
+from selenium.common.exceptions import JavascriptException, TimeoutException
+
+from blog_spider.screenshots import ScreenshotPolicy
+from blog_spider.spiders.increase_uv_spider import CustomSeleniumSpider
+from blog_spider.waits import WaitPolicy
+
+
+class FakeDriver(object):
+    """A page that never gets the awaited selector, like a captcha page."""
+    current_url = 'https://www.baidu.com/s?wd=hexo'
+
+    def __init__(self, found=False, errors=0):
+        self.found = found
+        self.errors = errors
+        self.screenshots = 0
+
+    def execute_script(self, script, selector):
+        if self.errors:
+            self.errors -= 1
+            raise JavascriptException('navigating')
+        return ['complete', 3, self.found]
+
+    def get_screenshot_as_png(self):
+        self.screenshots += 1
+        return b'png'
+
+
+class FakeSpider(object):
+    wait_results = CustomSeleniumSpider.wait_results
+
+    def __init__(self, driver, tmp_path):
+        self.driver = driver
+        self.waits = WaitPolicy(timeout=0.05, poll=0.01)
+        self.screenshots = ScreenshotPolicy(str(tmp_path))
+
+
+def test_wait_results_timeout_is_not_fatal(tmp_path, caplog):
+    spider = FakeSpider(FakeDriver(), tmp_path)
+    spider.wait_results('#content_left')
+    spider.screenshots.close()
+    assert spider.driver.screenshots == 1
+    assert '等待搜索结果超时' in caplog.text
+
+
+def test_wait_results_found(tmp_path):
+    spider = FakeSpider(FakeDriver(found=True, errors=2), tmp_path)
+    spider.wait_results('#rso')
+    assert spider.driver.screenshots == 0
+
+
+def test_wait_raises_timeout():
+    with pytest.raises(TimeoutException):
+        WaitPolicy(timeout=0.05, poll=0.01).wait(FakeDriver(), '#rso')
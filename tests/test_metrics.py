@@ -0,0 +1,105 @@
+import gc
+import json
+import weakref
+
+import pytest
+from scrapy import Spider, signals
+from scrapy.core import spidermw
+from scrapy.core.spidermw import SpiderMiddlewareManager
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+from blog_spider.items import BlogSpiderItem
+from blog_spider.metrics import Histogram
+from blog_spider.middlewares import MetricsSpiderMiddleware
+
+
+@pytest.fixture
+def spider(tmp_path, monkeypatch):
+    # scrape_response() calls the callback 0.1s later from the reactor; here it is called right away
+    monkeypatch.setattr(spidermw, 'mustbe_deferred', defer.maybeDeferred)
+    crawler = get_crawler(Spider, {'METRICS_JSONL_FILE': str(tmp_path / 'metrics.jsonl'),
+                                   'METRICS_PROM_FILE': str(tmp_path / 'metrics.prom')})
+    return Spider.from_crawler(crawler, 'test')
+
+
+def scrape(spider, callback):
+    """Run callback on a response through scrapy's spider middleware
+    manager, with only MetricsSpiderMiddleware installed."""
+    middleware = MetricsSpiderMiddleware.from_crawler(spider.crawler)
+    request = Request('http://a.com/', callback=callback)
+    response = HtmlResponse(request.url, body=b'<p>x</p>', request=request)
+    output = []
+    d = SpiderMiddlewareManager(middleware).scrape_response(
+        lambda response, request, spider: request.callback(response), response, request, spider)
+    d.addCallback(output.extend)
+    d.addErrback(lambda failure: output.append(failure.value))
+    return middleware.metrics, output
+
+
+def parse_post(response):
+    yield Request('http://a.com/next/')
+    yield BlogSpiderItem(url=response.url)
+
+
+def broken_post(response):
+    yield BlogSpiderItem(url=response.url)
+    raise ValueError('broken')
+
+
+def broken_call(response):
+    raise ValueError('broken')
+
+
+def test_callback_counted_once(spider):
+    metrics, output = scrape(spider, parse_post)
+    assert len(output) == 2
+    stats = metrics.callbacks['parse_post']
+    assert (stats.calls, stats.requests, stats.items, stats.errors) == (1, 1, 1, 0)
+    assert stats.wall.count == stats.cpu.count == 1
+
+
+@pytest.mark.parametrize('callback', [broken_post, broken_call])
+def test_error_counted_once(spider, callback):
+    metrics, output = scrape(spider, callback)
+    assert isinstance(output[-1], ValueError)
+    stats = metrics.callbacks[callback.__name__]
+    assert (stats.calls, stats.errors) == (1, 1)
+
+
+def test_item_followed_until_scraped(spider):
+    metrics, output = scrape(spider, parse_post)
+    item = weakref.ref(output.pop())
+    gc.collect()
+    # 还在pipeline里的item不会被回收, 它的id不会给别的item用
+    assert item() is not None
+    item = item()
+    assert len(metrics.in_pipeline) == 1
+    # 内容一样的另一个item不算
+    spider.crawler.signals.send_catch_log(signals.item_scraped, item=BlogSpiderItem(item), spider=spider)
+    assert len(metrics.in_pipeline) == 1
+    spider.crawler.signals.send_catch_log(signals.item_dropped, item=item, spider=spider, exception=None)
+    assert metrics.in_pipeline == {}
+    assert metrics.callbacks['parse_post'].pipeline.count == 1
+
+
+def test_flush_writes_snapshot_and_prometheus(spider, tmp_path):
+    metrics, output = scrape(spider, parse_post)
+    metrics.flush(spider.name)
+    with open(tmp_path / 'metrics.jsonl', encoding='utf-8') as f:
+        snapshot = json.loads(f.readline())
+    assert snapshot['spider'] == 'test' and snapshot['callbacks']['parse_post']['calls'] == 1
+    prom = (tmp_path / 'metrics.prom').read_text(encoding='utf-8')
+    assert 'blog_spider_callback_items_total{spider="test",callback="parse_post"} 1' in prom
+    assert 'blog_spider_callback_seconds_count{spider="test",callback="parse_post"} 1' in prom
+    assert any('限制吞吐' in line or '没有饱和' in line for line in metrics.summary())
+
+
+def test_histogram():
+    histogram = Histogram((1, 2, float('inf')))
+    for value in (0.5, 1.5, 1.5, 10):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1]
+    assert histogram.quantile(0.5) == 2 and histogram.quantile(1) == 10
+    assert histogram.mean() == 3.375
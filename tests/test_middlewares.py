@@ -0,0 +1,221 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from scrapy import Spider, signals
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.utils.request import request_fingerprint
+from scrapy.utils.test import get_crawler
+from twisted.internet.error import TCPTimedOutError
+
+from blog_spider.items import BlogSpiderItem
+from blog_spider.middlewares import (AdaptiveConcurrencyMiddleware, BlogSpiderDownloaderMiddleware,
+                                     BlogSpiderSpiderMiddleware)
+
+
+@pytest.fixture
+def spider():
+    return Spider.from_crawler(get_crawler(Spider), 'test')
+
+
+def fetched(request, body=b'<p>post</p>', status=200, **headers):
+    headers.setdefault('Content-Type', 'text/html; charset=utf-8')
+    return HtmlResponse(request.url, body=body, status=status, headers=headers, request=request)
+
+
+def test_cache_serves_fresh_responses(tmp_path, spider):
+    cache = BlogSpiderDownloaderMiddleware(str(tmp_path), [(r'/tags/', 3600)])
+    request = Request('http://a.com/tags/x/')
+    assert cache.process_request(request, spider) is None
+    cache.process_response(request, fetched(request, ETag='"1"'), spider)
+    cached = cache.process_request(Request('http://a.com/tags/x/'), spider)
+    assert 'cached' in cached.flags
+    assert cached.body == b'<p>post</p>' and cached.headers['ETag'] == b'"1"'
+    assert isinstance(cached, HtmlResponse)
+    assert cache.stats['hits'] == 1 and cache.stats['misses'] == 1
+
+
+def test_cache_revalidates_stale_responses(tmp_path, spider):
+    cache = BlogSpiderDownloaderMiddleware(str(tmp_path))
+    request = Request('http://a.com/p/1/')
+    cache.process_response(request, fetched(request, ETag='"1"', **{'Last-Modified': 'x'}), spider)
+
+    request = Request('http://a.com/p/1/')
+    assert cache.process_request(request, spider) is None
+    assert request.headers['If-None-Match'] == b'"1"' and request.headers['If-Modified-Since'] == b'x'
+    assert request.meta['http_cache_entry'] == request_fingerprint(request)
+    response = cache.process_response(request, Response(request.url, status=304, request=request), spider)
+    assert response.status == 200 and response.body == b'<p>post</p>'
+    assert cache.stats['revalidated'] == 1
+
+
+def test_cache_leaves_own_conditional_requests_alone(tmp_path, spider):
+    cache = BlogSpiderDownloaderMiddleware(str(tmp_path))
+    request = Request('http://a.com/p/1/')
+    cache.process_response(request, fetched(request, ETag='"1"'), spider)
+
+    request = Request('http://a.com/p/1/', headers={'If-None-Match': '"0"'})
+    assert cache.process_request(request, spider) is None
+    assert request.headers['If-None-Match'] == b'"0"' and 'http_cache_entry' not in request.meta
+    not_modified = Response(request.url, status=304, request=request)
+    assert cache.process_response(request, not_modified, spider) is not_modified
+
+
+def test_cache_strips_validators_after_redirect(tmp_path, spider):
+    cache = BlogSpiderDownloaderMiddleware(str(tmp_path))
+    original = Request('http://a.com/p/1/')
+    redirected = original.replace(url='http://a.com/p/one/', headers={'If-None-Match': '"1"'},
+                                  meta={'http_cache_entry': request_fingerprint(original)})
+    assert cache.process_request(redirected, spider) is None
+    assert 'http_cache_entry' not in redirected.meta and 'If-None-Match' not in redirected.headers
+    cache.process_response(redirected, fetched(redirected), spider)
+    assert request_fingerprint(redirected) in cache.index and request_fingerprint(original) not in cache.index
+
+
+def test_cache_skips_dont_cache_and_post(tmp_path, spider):
+    cache = BlogSpiderDownloaderMiddleware(str(tmp_path))
+    for request in (Request('http://a.com/', meta={'dont_cache': True}), Request('http://a.com/', method='POST')):
+        cache.process_response(request, fetched(request), spider)
+        assert cache.process_request(request, spider) is None
+    assert cache.index == {} and cache.stats['lookups'] == 0
+
+
+def test_cache_deduplicates_bodies_and_persists(tmp_path, spider):
+    cache = BlogSpiderDownloaderMiddleware(str(tmp_path), [('.', 3600)])
+    for url in ('http://a.com/1', 'http://mirror.com/1'):
+        request = Request(url)
+        cache.process_request(request, spider)
+        cache.process_response(request, fetched(request), spider)
+    assert cache.stats['stored'] == 2 and cache.stats['deduplicated'] == 1
+    cache.spider_closed(spider)
+    assert spider.crawler.stats.get_value('httpcache/stored') == 2
+    with open(tmp_path / 'index.json', encoding='utf-8') as f:
+        assert len(json.load(f)) == 2
+
+    again = BlogSpiderDownloaderMiddleware(str(tmp_path), [('.', 3600)])
+    assert again.process_request(Request('http://mirror.com/1'), spider).body == b'<p>post</p>'
+
+
+POST = '<p>' + '用 Scrapy 爬取 Hexo 博客的文章, 转换成 Markdown 以后按标题保存。' * 3 + '</p>'
+
+
+def near_duplicates(spider, action, path=None):
+    middleware = BlogSpiderSpiderMiddleware(spider.crawler, path, action=action)
+    items = [BlogSpiderItem(url='http://a.com/1', html=POST), BlogSpiderItem(url='http://mirror.com/1', html=POST + '!'),
+             Request('http://a.com/2')]
+    return middleware, list(middleware.process_spider_output(None, items, spider))
+
+
+def test_simhash_drops_near_duplicates(tmp_path, spider):
+    dropped = []
+
+    def item_dropped(item, **kwargs):
+        dropped.append(item['url'])
+
+    spider.crawler.signals.connect(item_dropped, signal=signals.item_dropped)
+    path = str(tmp_path / 'simhash.json')
+    middleware, output = near_duplicates(spider, 'drop', path)
+    assert [result.url if isinstance(result, Request) else result['url'] for result in output] == [
+        'http://a.com/1', 'http://a.com/2']
+    assert dropped == ['http://mirror.com/1']
+    middleware.spider_closed(spider)
+    assert spider.crawler.stats.get_value('simhash/duplicate_rate') == 0.5
+    # 下次运行还认得先出现的文章
+    again = BlogSpiderSpiderMiddleware(spider.crawler, path)
+    assert again.duplicate(BlogSpiderItem(url='http://mirror.com/2', html=POST), spider)
+
+
+def test_simhash_links_near_duplicates(spider):
+    middleware, output = near_duplicates(spider, 'link')
+    assert len(output) == 3
+    assert output[1]['duplicate_of'] == 'http://a.com/1' and 'duplicate_of' not in output[0]
+
+
+class FakeDownloader(object):
+    """Download slots by host, like scrapy's Downloader._get_slot()."""
+
+    def __init__(self):
+        self.slots = {}
+
+    def _get_slot(self, request, spider):
+        key = request.url.split('/')[2]
+        return key, self.slots.setdefault(key, SimpleNamespace(concurrency=8, delay=0.0))
+
+
+def adaptive(**kwargs):
+    crawler = SimpleNamespace(engine=SimpleNamespace(downloader=FakeDownloader()))
+    return AdaptiveConcurrencyMiddleware(crawler, **kwargs)
+
+
+def download(middleware, spider, status=200, latency=0.1, headers=None, url='http://a.com/'):
+    request = Request(url, meta={'download_latency': latency})
+    middleware.process_request(request, spider)
+    middleware.process_response(request, Response(url, status=status, headers=headers, request=request), spider)
+    return middleware.crawler.engine.downloader.slots[url.split('/')[2]]
+
+
+def test_adaptive_grows_after_a_good_round(spider):
+    middleware = adaptive(start=2)
+    for _ in range(4):
+        slot = download(middleware, spider)
+    assert slot.concurrency == 2
+    slot = download(middleware, spider)
+    assert slot.concurrency == 3 and middleware.host('a.com').increases == 1
+
+
+def test_adaptive_shrinks_on_slow_responses(spider):
+    middleware = adaptive(start=4, target_latency=1.0)
+    for _ in range(5):
+        slot = download(middleware, spider, latency=3.0)
+    assert slot.concurrency == 3
+
+
+def test_adaptive_halves_once_per_round_on_errors(spider):
+    middleware = adaptive(start=8)
+    assert download(middleware, spider, status=503).concurrency == 4
+    # 退避前就发出的请求不再减半
+    assert download(middleware, spider, status=500).concurrency == 4
+    assert middleware.host('a.com').decreases == 1
+
+
+def test_adaptive_slows_down_at_one(spider):
+    middleware = adaptive(start=1)
+    slot = download(middleware, spider, status=503)
+    assert slot.concurrency == 1 and slot.delay == 0.5
+
+
+def test_adaptive_honours_retry_after(spider):
+    middleware = adaptive(start=4, max_delay=30)
+    slot = download(middleware, spider, status=429, headers={'Retry-After': '120'})
+    assert slot.concurrency == 2 and 29 < slot.delay <= 30
+    assert middleware.host('a.com').delay == 0.0
+
+
+def test_adaptive_backs_off_only_on_network_errors(spider):
+    middleware = adaptive(start=8)
+    request = Request('http://a.com/')
+    middleware.process_request(request, spider)
+    middleware.process_exception(request, IgnoreRequest(), spider)
+    assert middleware.host('a.com').concurrency == 8
+    middleware.process_exception(request, TCPTimedOutError(), spider)
+    assert middleware.host('a.com').concurrency == 4
+
+
+def test_adaptive_ignores_cached_responses(spider):
+    middleware = adaptive(start=8)
+    request = Request('http://a.com/')
+    middleware.process_request(request, spider)
+    cached = Response(request.url, status=503, flags=['cached'], request=request)
+    assert middleware.process_response(request, cached, spider) is cached
+    assert middleware.host('a.com').concurrency == 8
+
+
+def test_adaptive_state_is_saved(tmp_path, spider):
+    path = str(tmp_path / 'adaptive.json')
+    middleware = adaptive(path=path, start=4)
+    download(middleware, spider, status=503, url='http://b.com/')
+    middleware.spider_closed(spider)
+    assert adaptive(path=path, start=4).host('b.com').concurrency == 2
+    assert adaptive(path=path, start=4, maximum=1).host('b.com').concurrency == 1
+    assert adaptive(path=path, start=4).host('a.com').concurrency == 4
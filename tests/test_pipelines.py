@@ -0,0 +1,89 @@
+import os
+import stat
+
+import pytest
+
+from blog_spider.pipelines import BlogSpiderPipeline, hexo_date, post_filename, render_post, write_atomic
+from blog_spider.search import post_text, read_post
+
+
+def test_post_filename():
+    assert post_filename('Hexo: 配置 / NexT?', 'http://a/1') == 'Hexo配置NexT.md'
+    assert len(post_filename('', 'http://a/1')) == len('0123456789ab.md')
+    taken = {'Hexo.md': 'http://a/1'}
+    assert post_filename('Hexo', 'http://a/1', taken) == 'Hexo.md'
+    other = post_filename('Hexo', 'http://a/2', taken)
+    assert other.startswith('Hexo-') and other != 'Hexo.md'
+    assert post_filename('Hexo', 'http://a/2', taken) == other
+
+
+def test_hexo_date():
+    assert hexo_date('2020-01-20T23:00:00.000Z') == '2020-01-20 23:00:00'
+    assert hexo_date('2020年') == '2020年'
+    assert hexo_date(None) == ''
+
+
+def test_write_atomic(tmp_path):
+    umask = os.umask(0o022)
+    os.umask(umask)
+    path = str(tmp_path / 'post.md')
+    write_atomic(path, '旧')
+    write_atomic(path, '新')
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == '新'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o666 & ~umask
+    assert os.listdir(tmp_path) == ['post.md']
+
+
+def test_render_post_text():
+    item = {'title': 'Hexo', 'url': 'http://a/1', 'tags': ['x'], 'date': '2020-01-20T23:00:00.000Z',
+            'markdown': '正文 [链接](http://b/)'}
+    content = render_post(item)
+    assert content.startswith('---\ntitle: "Hexo"\ntags:\n- "x"\ndate: 2020-01-20 23:00:00\n')
+    assert post_text(content) == '\n转自[Hexo]\n\n\n正文 [链接]'
+
+
+def test_render_post_front_matter_is_yaml(tmp_path):
+    yaml = pytest.importorskip('yaml')
+    item = {'title': 'Post 1: 标题 #1 "引号"', 'url': 'http://a/1', 'tags': ['[x]', '- y', 'a: b'],
+            'categories': ['#分类'], 'date': '2020-01-20T23:00:00.000Z', 'markdown': '正文'}
+    content = render_post(item)
+    header = yaml.safe_load(content.split('---\n')[1])
+    assert header['title'] == header['description'] == item['title']
+    assert header['tags'] == item['tags']
+    assert header['categories'] == item['categories']
+    path = tmp_path / 'post.md'
+    path.write_text(content, encoding='utf-8')
+    assert read_post(str(path))[:2] == (item['title'], '2020-01-20 23:00:00')
+
+
+def buffered_pipeline(tmp_path, url):
+    pipeline = BlogSpiderPipeline(str(tmp_path))
+    item = {'url': url, 'title': 'Hexo', 'html': '<p>正文</p>'}
+    pipeline.converted(('正文', 0.0), item, 'digest')
+    return pipeline, item
+
+
+def test_delete_cancels_buffered_write(tmp_path):
+    pipeline, item = buffered_pipeline(tmp_path, 'http://a/1')
+    assert pipeline.buffer and pipeline.files == {'Hexo.md': 'http://a/1'}
+    pipeline.process_item({'url': 'http://a/1', 'deleted': True}, None)
+    assert pipeline.buffer == [] and pipeline.files == {}
+    pipeline.flush()
+    assert not pipeline.flushing and os.listdir(tmp_path) == []
+
+
+def test_delete_during_write_removes_file(tmp_path):
+    pipeline, item = buffered_pipeline(tmp_path, 'http://a/1')
+    batch, pipeline.buffer = pipeline.buffer, []
+    result = pipeline.write_batch(batch)
+    pipeline.process_item({'url': 'http://a/1', 'deleted': True}, None)
+    pipeline.written(result, batch)
+    assert pipeline.index == {} and pipeline.files == {}
+    assert os.listdir(tmp_path) == []
+    # 删掉以后又抓到了, 照常写
+    pipeline.converted(('正文', 0.0), item, 'digest')
+    batch, pipeline.buffer = pipeline.buffer, []
+    pipeline.written(pipeline.write_batch(batch), batch)
+    assert pipeline.index == {'http://a/1': {'file': 'Hexo.md', 'hash': 'digest'}}
+    assert os.listdir(tmp_path) == ['Hexo.md']
@@ -0,0 +1,139 @@
+import pytest
+
+from blog_spider.search import SearchIndex, backfill, index_tokens, match_query, post_text, read_post, tokens
+
+POST = """---
+title: Hexo 自动化测试
+tags:
+- hexo
+date: 2021-01-02 03:04:05
+categories:
+description: Hexo 自动化测试
+---
+
+转自[Hexo 自动化测试](http://example.com/post/)
+
+用 Selenium 做自动化测试 ![图](http://example.com/a.png "图")
+"""
+
+
+def test_tokens():
+    assert tokens('Hexo 自动化测试, NexT_主题 爬') == ['hexo', '自动', '动化', '化测', '测试', 'next', '主题', '爬']
+    assert tokens('') == []
+
+
+def test_index_tokens():
+    assert index_tokens('自动化测试 配置hexo 爬') == '自动 动化 化测 测试 配置 hexo 爬 试 置'
+    assert index_tokens('') == ''
+
+
+def test_match_query():
+    assert match_query('自动化 Hexo') == '"自动 动化" AND "hexo"'
+    assert match_query('爬') == '"爬"*'
+    assert match_query('NexT主题') == '"next 主题"'
+    assert match_query(' ,, ') == ''
+
+
+def test_post_text_and_read_post(tmp_path):
+    path = tmp_path / 'post.md'
+    path.write_text(POST, encoding='utf-8')
+    title, date, text = read_post(str(path))
+    assert (title, date) == ('Hexo 自动化测试', '2021-01-02 03:04:05')
+    assert text == post_text(POST)
+    assert 'tags:' not in text and 'http://example.com' not in text
+    assert '[Hexo 自动化测试]' in text and '![图]' in text
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'), batch=2)
+    yield index
+    index.close()
+
+
+def urls(results):
+    return [result[0] for result in results]
+
+
+def test_add_update_delete(index):
+    assert index.add('http://a/1', 'Hexo 主题', '配置 NexT 主题', file='1.md', date='2021-01-01') == 'added'
+    assert index.add('http://a/2', 'Scrapy', '用 scrapy 写爬虫') == 'added'
+    assert index.add('http://a/1', 'Hexo 主题', '配置 NexT 主题', file='1.md') == 'unchanged'
+    assert len(index) == 2
+    assert urls(index.search('主题')) == ['http://a/1']
+    assert index.search('next')[0][:4] == ('http://a/1', 'Hexo 主题', '1.md', '2021-01-01')
+
+    assert index.add('http://a/1', 'Hexo 部署', '部署到 GitHub Pages') == 'updated'
+    assert index.search('主题') == []
+    assert urls(index.search('部署')) == ['http://a/1']
+
+    assert index.delete('http://a/1')
+    assert not index.delete('http://a/1')
+    assert index.search('部署') == []
+    assert index.urls() == {'http://a/2'}
+    assert urls(index.search('爬')) == ['http://a/2']
+
+
+def test_single_character_anywhere_in_a_run(index):
+    index.add('http://a/1', 'Hexo', '自动化')
+    index.add('http://a/2', 'Scrapy', '化学 配置hexo')
+    assert sorted(urls(index.search('化'))) == ['http://a/1', 'http://a/2']
+    assert urls(index.search('动')) == ['http://a/1']
+    # 单独索引的字在正文后面, 不会插在短语中间
+    assert urls(index.search('配置hexo')) == ['http://a/2']
+    assert index.search('置化') == []
+
+
+def test_old_index_is_tokenized_again(tmp_path):
+    path = str(tmp_path / 'search.db')
+    index = SearchIndex(path)
+    index.add('http://a/1', 'Hexo', '自动化')
+    index.add('http://a/2', 'Scrapy', '测试')
+    # 旧版本的索引: 没有单独的词尾
+    index.db.execute("INSERT INTO posts_fts(posts_fts) VALUES('delete-all')")
+    for rowid, title, text in (1, 'Hexo', '自动化'), (2, 'Scrapy', '测试'):
+        index.db.execute('INSERT INTO posts_fts (rowid, title, body) VALUES (?, ?, ?)',
+                         (rowid, ' '.join(tokens(title)), ' '.join(tokens(text))))
+    index.db.execute('PRAGMA user_version=1')
+    index.close()
+    index = SearchIndex(path)
+    assert urls(index.search('化')) == ['http://a/1']
+    assert index.delete('http://a/1')
+    assert index.search('化') == [] and urls(index.search('试')) == ['http://a/2']
+    index.close()
+
+
+def test_changes_survive_reopening(tmp_path):
+    path = str(tmp_path / 'search.db')
+    index = SearchIndex(path)
+    index.add('http://a/1', 'Hexo', 'text')
+    index.close()
+    index = SearchIndex(path)
+    assert urls(index.search('hexo')) == ['http://a/1']
+    index.close()
+
+
+def test_title_ranks_higher(index):
+    index.add('http://a/body', 'Other', 'selenium selenium')
+    index.add('http://a/title', 'Selenium', 'other')
+    assert urls(index.search('selenium')) == ['http://a/title', 'http://a/body']
+
+
+def test_old_title_match_ranked_past_max_ranked(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'), max_ranked=3)
+    index.add('http://a/old', 'Selenium', 'selenium')
+    for i in range(10):
+        index.add(f'http://a/{i}', f'Post {i}', 'selenium in the text')
+    assert urls(index.search('selenium', limit=1)) == ['http://a/old']
+    assert len(index.search('selenium', limit=20)) == 4
+    index.close()
+
+
+def test_backfill(index, tmp_path):
+    (tmp_path / 'post.md').write_text(POST, encoding='utf-8')
+    posts = {'http://example.com/post/': {'file': 'post.md'}, 'http://example.com/gone/': {'file': 'gone.md'}}
+    assert backfill(index, str(tmp_path), posts) == 1
+    assert backfill(index, str(tmp_path), posts) == 0
+    assert backfill(index, str(tmp_path), posts, missing_only=False) == 0
+    assert urls(index.search('selenium')) == ['http://example.com/post/']
+    assert index.search('selenium')[0][2:4] == ('post.md', '2021-01-02 03:04:05')
@@ -0,0 +1,53 @@
+from blog_spider.simhash import BITS, MIN_TEXT, SimHashIndex, hamming, simhash
+
+TEXT = '用 Scrapy 爬取 Hexo 博客的文章, 转换成 Markdown 以后按标题保存, 没有变化的文章不会再下载。' * 3
+
+
+def test_simhash():
+    assert simhash('太短') is None
+    assert simhash('a' * MIN_TEXT) is not None
+    assert simhash(TEXT) == simhash(TEXT.upper() + ' !!!')
+    assert 0 <= simhash(TEXT) < 1 << BITS
+
+
+def test_bands_cover_all_bits():
+    index = SimHashIndex(distance=3)
+    assert len(index.bands) == 4
+    mask = 0
+    for shift, band_mask in index.bands:
+        mask |= band_mask << shift
+    assert mask == (1 << BITS) - 1
+
+
+def test_near_within_distance():
+    index = SimHashIndex(distance=3)
+    fingerprint = 0x0123456789abcdef
+    index.add('a', fingerprint)
+    # 差的3位分在不同的段里, 只有一个段完全一样
+    close = fingerprint ^ (1 | 1 << 20 | 1 << 40)
+    assert index.near(close) == ('a', 3)
+    assert index.near(fingerprint ^ (1 | 1 << 20 | 1 << 40 | 1 << 60)) is None
+    assert index.near(fingerprint, exclude='a') is None
+
+
+def test_near_prefers_closest():
+    index = SimHashIndex(distance=3)
+    index.add('far', 0b111)
+    index.add('close', 0b1)
+    assert index.near(0) == ('close', 1)
+
+
+def test_add_replaces_and_remove_cleans_bands():
+    index = SimHashIndex(distance=3)
+    index.add('a', 0)
+    index.add('a', (1 << BITS) - 1)
+    assert len(index) == 1
+    assert index.near(0) is None
+    index.remove('a')
+    index.remove('a')
+    assert len(index) == 0
+    assert all(not table for table in index.tables)
+
+
+def test_hamming():
+    assert hamming(0b1010, 0b0110) == 2
@@ -0,0 +1,41 @@
+import json
+
+from blog_spider.state import CrawlState
+
+
+def test_update_only_marks_real_changes(tmp_path):
+    state = CrawlState(str(tmp_path / 'state.json'))
+    assert 'http://a/1' not in state
+    assert state.get('http://a/1') == {}
+    state.update('http://a/1', etag='"x"', last_modified=None)
+    assert state.changed
+    assert state.get('http://a/1') == {'etag': '"x"'}
+    state.save()
+    assert not state.changed
+    state.update('http://a/1', etag='"x"', hash=None)
+    assert not state.changed
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'state.json')
+    state = CrawlState(path)
+    state.update('http://a/1', hash='abc', updated='2021-01-01T00:00:00+00:00')
+    state.update('http://a/2', hash='def')
+    state.save()
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f)['http://a/2'] == {'hash': 'def'}
+    assert not [name for name in tmp_path.iterdir() if name.suffix == '.tmp']
+
+    state = CrawlState(path)
+    assert state.get('http://a/1')['hash'] == 'abc'
+    state.remove('http://a/2')
+    state.remove('http://a/3')
+    state.save()
+    assert set(CrawlState(path).urls) == {'http://a/1'}
+
+
+def test_without_path():
+    state = CrawlState()
+    state.update('http://a/1', hash='abc')
+    state.save()
+    assert state.changed
@@ -0,0 +1,588 @@
+#!/usr/bin/env python
+"""Micro benchmarks for html2text and content_extract.
+
+    python benchmark.py wrap [--size N] [--repeat N]
+    python benchmark.py tags [--size N] [--repeat N] [--baseline old/html2text.py]
+    python benchmark.py links [--size N] [--repeat N] [--baseline old/html2text.py]
+    python benchmark.py backends --corpus DIR [--xpath XPATH] [--repeat N]
+    python benchmark.py escape [--corpus DIR] [--size N] [--repeat N]
+    python benchmark.py suite [--corpus DIR] [--repeat N] [--save FILE]
+                              [--compare FILE | --baseline old/html2text.py] [--threshold 0.1]
+    python benchmark.py extract [--corpus DIR] [--xpath XPATH] [--repeat N]
+
+--baseline loads another copy of html2text.py (e.g. one exported with
+``git show HEAD~1:utils/html2text.py``) and measures it side by side.
+
+suite runs HTML2Text.handle over the checked-in bench_corpus (or --corpus)
+and reports docs/s, MB/s, peak memory and the time split between parsing,
+emitting, escaping and wrapping.  With --compare (results saved earlier
+with --save) or --baseline it exits with status 1 when any document got
+slower, or used more memory, by more than --threshold.
+
+extract compares content_extract with the expected content of every page
+(the "content" xpath in corpus.json, or --xpath) by token overlap, and
+times scoring against the per-domain cached xpath.
+"""
+import importlib.util
+import json
+import optparse
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from textwrap import wrap
+
+import content_extract
+import html2text
+
+
+def legacy_optwrap(text, body_width=html2text.BODY_WIDTH):
+    """The original string-concatenating HTML2Text.optwrap, kept as a baseline."""
+    result = ''
+    newlines = 0
+    for para in text.split("\n"):
+        if len(para) > 0:
+            if not html2text.skipwrap(para):
+                result += "\n".join(wrap(para, body_width))
+                if para.endswith('  '):
+                    result += "  \n"
+                    newlines = 1
+                else:
+                    result += "\n\n"
+                    newlines = 2
+            else:
+                if not html2text.onlywhite(para):
+                    result += para + "\n"
+                    newlines = 1
+        else:
+            if newlines < 2:
+                result += "\n"
+                newlines += 1
+    return result
+
+
+def legacy_escape(text, snob=False):
+    """escape_md_section() as five substitutions followed by o()'s whitespace collapse."""
+    text = html2text.md_backslash_matcher.sub(r"\\\1", text)
+    if snob:
+        text = html2text.md_chars_matcher_all.sub(r"\\\1", text)
+    text = html2text.md_dot_matcher.sub(r"\1\\\2", text)
+    text = html2text.md_plus_matcher.sub(r"\1\\\2", text)
+    text = html2text.md_dash_matcher.sub(r"\1\\\2", text)
+    return re.sub(r'\s+', ' ', text)
+
+
+def make_ascii_text(size, seed=0):
+    """Build a markdown-like document of roughly size characters with many short lines."""
+    rnd = random.Random(seed)
+    words = ['scrapy', 'hexo', 'next', 'theme', 'markdown', 'spider', 'the', 'a', 'of',
+             'configuration', 'post-body', 'selenium', 'x', 'pipeline', '--', 'e.g.']
+    parts = []
+    total = 0
+    while total < size:
+        kind = rnd.random()
+        if kind < 0.1:
+            line = '    ' + ' '.join(rnd.choice(words) for _ in range(rnd.randrange(2, 8)))
+        elif kind < 0.2:
+            line = '* ' + ' '.join(rnd.choice(words) for _ in range(rnd.randrange(2, 12)))
+        elif kind < 0.3:
+            line = ''
+        elif kind < 0.4:
+            line = ' '.join(rnd.choice(words) for _ in range(rnd.randrange(3, 10))) + '  '
+        else:
+            line = ' '.join(rnd.choice(words) for _ in range(rnd.randrange(2, 40)))
+        parts.append(line)
+        total += len(line) + 1
+    return '\n'.join(parts)
+
+
+def make_tag_soup(size, seed=0):
+    """Build a tag-dense page of roughly size characters, mostly short inline tags."""
+    rnd = random.Random(seed)
+    snippets = ['<span>%s</span>', '<a href="http://example.com/%d">%s</a>', '<em>%s</em>',
+                '<strong>%s</strong>', '<code>%s</code>', '<li>%s</li>', '<p>%s</p>',
+                '<div class="post-body">%s</div>', '<i class="fa fa-tag"></i>%s', '<br/>%s']
+    words = ['hexo', 'next', 'theme', 'scrapy', 'spider', u'配置', u'美化']
+    parts = ['<html><head><title>bench</title></head><body><ul>']
+    total = 0
+    while total < size:
+        snippet = rnd.choice(snippets)
+        if '%d' in snippet:
+            snippet = snippet % (rnd.randrange(1000), rnd.choice(words))
+        else:
+            snippet = snippet % rnd.choice(words)
+        parts.append(snippet)
+        total += len(snippet)
+    parts.append('</ul></body></html>')
+    return ''.join(parts)
+
+
+def load_baseline(path):
+    """Import the html2text.py at path under a private module name."""
+    spec = importlib.util.spec_from_file_location('html2text_baseline', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_cjk_text(size, seed=0):
+    rnd = random.Random(seed)
+    words = [u'爬虫', u'配置', u'主题', u'美化', u'自动化测试', u'，', u'。', u'Hexo', u'NexT']
+    parts = []
+    total = 0
+    while total < size:
+        line = ''.join(rnd.choice(words) for _ in range(rnd.randrange(5, 120)))
+        parts.append(line)
+        parts.append('')
+        total += len(line) + 1
+    return '\n'.join(parts)
+
+
+def timeit(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_wrap(options):
+    text = make_ascii_text(options.size)
+    h = html2text.HTML2Text()
+    legacy = legacy_optwrap(text, h.body_width)
+    current = h.optwrap(text)
+    if legacy != current:
+        sys.exit('optwrap output differs from the legacy implementation')
+
+    legacy_time = timeit(lambda: legacy_optwrap(text, h.body_width), options.repeat)
+    current_time = timeit(lambda: h.optwrap(text), options.repeat)
+    print(f'ascii {len(text)} chars, {text.count(chr(10))} lines (output identical)')
+    print(f'  legacy optwrap: {legacy_time * 1000:.1f} ms')
+    print(f'  optwrap:        {current_time * 1000:.1f} ms ({legacy_time / current_time:.2f}x)')
+
+    text = make_cjk_text(options.size)
+    legacy_time = timeit(lambda: legacy_optwrap(text, h.body_width), options.repeat)
+    current_time = timeit(lambda: h.optwrap(text), options.repeat)
+    widest = max(html2text.text_width(line) for line in h.optwrap(text).split('\n'))
+    print(f'cjk {len(text)} chars (widest wrapped line: {widest} columns)')
+    print(f'  legacy optwrap: {legacy_time * 1000:.1f} ms')
+    print(f'  optwrap:        {current_time * 1000:.1f} ms')
+
+
+class TagRecorder(html2text.HTMLParser.HTMLParser):
+    """Collects the (tag, attrs, start) events handle_tag sees for a page."""
+
+    def __init__(self):
+        html2text.HTMLParser.HTMLParser.__init__(self)
+        self.events = []
+
+    def handle_starttag(self, tag, attrs):
+        self.events.append((tag, attrs, 1))
+
+    def handle_endtag(self, tag):
+        self.events.append((tag, None, 0))
+
+
+def convert_unwrapped(module, html):
+    h = module.HTML2Text()
+    h.body_width = 0
+    return h.handle(html)
+
+
+def bench_tags(options):
+    html = make_tag_soup(options.size)
+    recorder = TagRecorder()
+    recorder.feed(html)
+    recorder.close()
+    events = recorder.events
+
+    modules = [('handle_tag', html2text)]
+    if options.baseline:
+        baseline = load_baseline(options.baseline)
+        modules.insert(0, ('baseline handle_tag', baseline))
+        # compared unwrapped: the CJK-aware wrapper breaks the tag soup's
+        # Chinese words differently from the original textwrap
+        if convert_unwrapped(baseline, html) != convert_unwrapped(html2text, html):
+            sys.exit('output differs from the baseline')
+        print('output identical to the baseline (without line wrapping)')
+
+    print(f'{len(events)} tags, {len(html)} chars')
+    for name, module in modules:
+        def run():
+            h = module.HTML2Text()
+            handle_tag = h.handle_tag
+            for tag, attrs, start in events:
+                handle_tag(tag, attrs, start)
+
+        best = timeit(run, options.repeat)
+        full = timeit(lambda: module.html2text(html), options.repeat)
+        print(f'  {name:20s} {len(events) / best:12,.0f} tags/s'
+              f'   handle(): {full * 1000:.1f} ms')
+
+
+def bench_links(options):
+    """Reference-style (INLINE_LINKS = False) conversion of a tag-cloud archive."""
+    count = max(options.size // 40, 1)
+    html = '<ul>' + ''.join('<li><a href="/tags/t%d/">tag %d</a></li>' % (i % (count // 5 + 1), i)
+                            for i in range(count)) + '</ul>'
+    modules = [('html2text', html2text)]
+    if options.baseline:
+        modules.insert(0, ('baseline', load_baseline(options.baseline)))
+
+    print(f'{count} links, {len(html)} chars')
+    outputs = {0: set(), 1: set()}
+    for name, module in modules:
+        for each in (0, 1):
+            def run():
+                h = module.HTML2Text()
+                h.inline_links = False
+                h.links_each_paragraph = each
+                outputs[each].add(h.handle(html))
+
+            best = timeit(run, options.repeat)
+            print(f'  {name:12s} links_each_paragraph={each}: {best * 1000:.1f} ms')
+    if len(outputs[0]) != 1 or len(outputs[1]) != 1:
+        sys.exit('output differs from the baseline')
+
+
+def corpus_pages(path):
+    """Yield (name, html) for every saved .html page in the corpus directory."""
+    for name in sorted(os.listdir(path)):
+        if name.endswith(('.html', '.htm')):
+            with open(os.path.join(path, name), 'rb') as f:
+                yield name, f.read().decode('utf-8', 'replace')
+
+
+def bench_backends(options):
+    """Check the lxml tree backend against the HTMLParser backend on saved pages."""
+    if not options.corpus:
+        sys.exit('backends needs --corpus')
+    parser_time = tree_time = 0
+    pages = mismatched = 0
+    for name, data in corpus_pages(options.corpus):
+        root = html2text.etree.HTML(data)
+        if root is None:
+            continue
+        nodes = root.xpath(options.xpath) if options.xpath else []
+        node = nodes[0] if nodes else root
+        pages += 1
+
+        def parser():
+            return html2text.HTML2Text().handle(html2text.etree.tostring(node).decode('utf-8'))
+
+        def tree():
+            return html2text.HTML2Text().handle_tree(node)
+
+        expected, got = parser(), tree()
+        if expected != got:
+            mismatched += 1
+            for i, (a, b) in enumerate(zip(expected.splitlines(), got.splitlines())):
+                if a != b:
+                    break
+            else:
+                i, a, b = min(len(expected), len(got)), '<end>', '<end>'
+            print(f'{name}: differs at line {i + 1}\n  parser: {a!r}\n  tree:   {b!r}')
+        parser_time += timeit(parser, options.repeat)
+        tree_time += timeit(tree, options.repeat)
+
+    print(f'{pages} pages, {pages - mismatched} identical')
+    print(f'  parser backend (tostring + HTMLParser): {parser_time * 1000:.1f} ms')
+    print(f'  tree backend (lxml walk):               {tree_time * 1000:.1f} ms'
+          f' ({parser_time / tree_time if tree_time else 0:.2f}x)')
+
+
+class TextRecorder(html2text.HTMLParser.HTMLParser):
+    """Collects the text nodes handle_data sees for a page."""
+
+    def __init__(self):
+        html2text.HTMLParser.HTMLParser.__init__(self)
+        self.texts = []
+
+    def handle_data(self, data):
+        self.texts.append(data)
+
+
+def bench_escape(options):
+    recorder = TextRecorder()
+    if options.corpus:
+        for name, data in corpus_pages(options.corpus):
+            recorder.feed(data)
+    else:
+        recorder.feed(make_tag_soup(options.size))
+        recorder.feed('<p>' + make_ascii_text(options.size) + '</p>')
+    recorder.close()
+    texts = recorder.texts
+
+    print(f'{len(texts)} text nodes, {sum(map(len, texts))} chars')
+    for snob in (False, True):
+        escaper = html2text.md_section_escapers[snob, True]
+        for text in texts:
+            if escaper.escape(text) != legacy_escape(text, snob):
+                sys.exit(f'escaped text differs for {text!r}')
+
+        legacy_time = timeit(lambda: [legacy_escape(text, snob) for text in texts], options.repeat)
+        fused_time = timeit(lambda: [escaper.escape(text) for text in texts], options.repeat)
+        print(f'  escape_snob={int(snob)}: 5 passes + collapse {legacy_time * 1000:.1f} ms,'
+              f' fused {fused_time * 1000:.1f} ms ({legacy_time / fused_time:.2f}x)')
+
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_corpus')
+
+
+def load_manifest(path):
+    """The parsed corpus.json of a corpus directory, or None if it has none."""
+    manifest = os.path.join(path, 'corpus.json')
+    if not os.path.exists(manifest):
+        return None
+    with open(manifest, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_corpus(path):
+    """Return [(name, html, options)] for a corpus directory.
+
+    corpus.json, when present, lists the pages and the HTML2Text options to
+    convert each one with; otherwise every .html page uses the defaults.
+    """
+    specs = load_manifest(path)
+    if specs is None:
+        return [(name, data, {}) for name, data in corpus_pages(path)]
+    docs = []
+    for name in sorted(specs):
+        with open(os.path.join(path, name), 'rb') as f:
+            docs.append((name, f.read().decode('utf-8'), specs[name].get('options', {})))
+    return docs
+
+
+def make_converter(module, options):
+    h = module.HTML2Text()
+    for name, value in options.items():
+        setattr(h, name, value)
+    return h
+
+
+class PhaseTimer(object):
+    """Splits the time of one HTML2Text.handle call into phases by timing
+    the parser callbacks, the escaper and optwrap.
+
+    parse is what remains of the total: HTMLParser tokenizing and close().
+    """
+
+    def __init__(self, module, h):
+        self.module = module
+        self.h = h
+        self.callbacks = self.escape = self.wrap = 0.0
+
+    def timed(self, func, attr):
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                setattr(self, attr, getattr(self, attr) + time.perf_counter() - start)
+        return wrapper
+
+    def run(self, data):
+        h = self.h
+        for name in ('handle_starttag', 'handle_endtag', 'handle_data'):
+            setattr(h, name, self.timed(getattr(h, name), 'callbacks'))
+        h.optwrap = self.timed(h.optwrap, 'wrap')
+        escapers = list(getattr(self.module, 'md_section_escapers', {}).values())
+        for escaper in escapers:
+            escaper.escape = self.timed(escaper.escape, 'escape')
+        try:
+            start = time.perf_counter()
+            h.handle(data)
+            total = time.perf_counter() - start
+        finally:
+            for escaper in escapers:
+                del escaper.escape
+        return {
+            'parse': total - self.callbacks - self.wrap,
+            'emit': self.callbacks - self.escape,
+            'escape': self.escape,
+            'wrap': self.wrap,
+        }
+
+
+def measure_corpus(module, docs, repeat, phases=True):
+    """Benchmark module.HTML2Text.handle on every document of the corpus."""
+    results = {}
+    total_time = total_bytes = 0
+    for name, data, options in docs:
+        size = len(data.encode('utf-8'))
+        best = timeit(lambda: make_converter(module, options).handle(data), repeat)
+
+        tracemalloc.start()
+        make_converter(module, options).handle(data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        result = {
+            'seconds': best,
+            'docs_per_s': 1 / best,
+            'mb_per_s': size / best / 1e6,
+            'peak_kb': peak / 1024,
+        }
+        if phases:
+            result['phases'] = PhaseTimer(module, make_converter(module, options)).run(data)
+        results[name] = result
+        total_time += best
+        total_bytes += size
+    results['TOTAL'] = {
+        'seconds': total_time,
+        'docs_per_s': len(docs) / total_time,
+        'mb_per_s': total_bytes / total_time / 1e6,
+        'peak_kb': max(r['peak_kb'] for r in results.values()),
+    }
+    return results
+
+
+def print_results(title, results):
+    print(title)
+    print(f'  {"document":28s} {"docs/s":>9s} {"MB/s":>7s} {"peak KB":>9s}   parse  emit escape  wrap')
+    for name, r in results.items():
+        line = f'  {name:28s} {r["docs_per_s"]:9.1f} {r["mb_per_s"]:7.2f} {r["peak_kb"]:9.0f}'
+        phases = r.get('phases')
+        if phases:
+            total = sum(phases.values()) or 1
+            line += '   ' + ' '.join(f'{phases[k] / total:5.0%}' for k in ('parse', 'emit', 'escape', 'wrap'))
+        print(line)
+
+
+def find_regressions(results, baseline, threshold):
+    """Return messages for documents slower, or hungrier, than baseline by more than threshold."""
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            continue
+        if r['docs_per_s'] < b['docs_per_s'] * (1 - threshold):
+            regressions.append(f'{name}: {r["docs_per_s"]:.1f} docs/s, baseline {b["docs_per_s"]:.1f}'
+                               f' ({r["docs_per_s"] / b["docs_per_s"] - 1:+.0%})')
+        if r['peak_kb'] > b['peak_kb'] * (1 + threshold):
+            regressions.append(f'{name}: peak {r["peak_kb"]:.0f} KB, baseline {b["peak_kb"]:.0f} KB'
+                               f' ({r["peak_kb"] / b["peak_kb"] - 1:+.0%})')
+    return regressions
+
+
+def bench_suite(options):
+    docs = load_corpus(options.corpus or CORPUS)
+    baseline = None
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    elif options.baseline:
+        baseline = measure_corpus(load_baseline(options.baseline), docs, options.repeat, phases=False)
+        print_results(f'baseline {options.baseline}', baseline)
+
+    results = measure_corpus(html2text, docs, options.repeat)
+    print_results(f'html2text {html2text.__version__}', results)
+
+    if options.save:
+        with open(options.save, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results}, f, indent=2)
+
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, options.threshold)
+        if regressions:
+            print(f'regressions beyond {options.threshold:.0%}:')
+            for message in regressions:
+                print('  ' + message)
+            sys.exit(1)
+        print(f'no regressions beyond {options.threshold:.0%}')
+
+
+token_matcher = re.compile(r'[\u3400-\u9fff]|\w+')
+
+
+def overlap(found, expected):
+    """(precision, recall, f1) of the tokens of found against expected text;
+    CJK characters count as one token each."""
+    found = Counter(token_matcher.findall(found))
+    expected = Counter(token_matcher.findall(expected))
+    common = sum((found & expected).values())
+    if not common:
+        return 0.0, 0.0, 0.0
+    precision = common / sum(found.values())
+    recall = common / sum(expected.values())
+    return precision, recall, 2 * precision * recall / (precision + recall)
+
+
+def bench_extract(options):
+    path = options.corpus or CORPUS
+    specs = load_manifest(path) or {}
+    etree = html2text.etree
+    print(f'  {"document":28s} {"P":>5s} {"R":>5s} {"F1":>5s} {"parse":>8s} {"score":>8s} {"cached":>8s}  xpath')
+    f1s = []
+    parse_time = score_time = cached_time = 0
+    for name, data in corpus_pages(path):
+        root = etree.HTML(data)
+        parse = timeit(lambda: etree.HTML(data), options.repeat)
+        score = timeit(lambda: content_extract.best_node(root), options.repeat)
+        extractor = content_extract.ContentExtractor()
+        url = f'http://{name}/'
+        node = extractor.extract(root, url)
+        cached = timeit(lambda: extractor.extract(root, url), options.repeat)
+        parse_time += parse
+        score_time += score
+        cached_time += cached
+        line = f'  {name:28s}'
+        expected_xpath = specs.get(name, {}).get('content') or options.xpath
+        expected = root.xpath(expected_xpath) if expected_xpath else None
+        if expected:
+            precision, recall, f1 = overlap(' '.join(node.itertext()), ' '.join(expected[0].itertext()))
+            f1s.append(f1)
+            line += f' {precision:5.2f} {recall:5.2f} {f1:5.2f}'
+        else:
+            line += f' {"-":>5s} {"-":>5s} {"-":>5s}'
+        line += f' {parse * 1000:6.1f}ms {score * 1000:6.1f}ms {cached * 1000:6.2f}ms  '
+        print(line + (content_extract.node_xpath(node) if node is not root else '(whole page)'))
+    if f1s:
+        print(f'mean F1 {sum(f1s) / len(f1s):.3f} over {len(f1s)} pages')
+    print(f'parse {parse_time:.3f}s, score {score_time:.3f}s, cached xpath {cached_time:.3f}s')
+
+
+BENCHMARKS = {
+    'wrap': bench_wrap,
+    'tags': bench_tags,
+    'links': bench_links,
+    'backends': bench_backends,
+    'escape': bench_escape,
+    'suite': bench_suite,
+    'extract': bench_extract,
+}
+
+
+def main():
+    p = optparse.OptionParser('%prog [options] (' + '|'.join(sorted(BENCHMARKS)) + ')')
+    p.add_option("--size", dest="size", action="store", type="int", default=200000,
+                 help="approximate size of the generated document in characters")
+    p.add_option("--repeat", dest="repeat", action="store", type="int", default=5,
+                 help="number of timed runs, the best one is reported")
+    p.add_option("--baseline", dest="baseline", action="store", type="string",
+                 help="path of another html2text.py to compare against")
+    p.add_option("--corpus", dest="corpus", action="store", type="string",
+                 help="directory of saved .html pages")
+    p.add_option("--xpath", dest="xpath", action="store", type="string",
+                 help="content xpath, the whole page if it does not match")
+    p.add_option("--save", dest="save", action="store", type="string",
+                 help="write the suite results to this json file")
+    p.add_option("--compare", dest="compare", action="store", type="string",
+                 help="suite results saved with --save to check for regressions against")
+    p.add_option("--threshold", dest="threshold", action="store", type="float", default=0.1,
+                 help="allowed slowdown or memory growth before the suite fails, 0.1 = 10%")
+    (options, args) = p.parse_args()
+    if len(args) != 1 or args[0] not in BENCHMARKS:
+        p.error('Choose one benchmark: ' + ', '.join(sorted(BENCHMARKS)))
+    BENCHMARKS[args[0]](options)
+
+
+if __name__ == "__main__":
+    main()
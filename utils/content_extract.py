@@ -1 +1,431 @@
-from html2text import html2text
\ No newline at end of file
+"""Readability-style main content extraction for lxml trees.
+
+best_node() scores the whole tree in one bottom-up pass: every
+paragraph-like node adds a score, based on its length and punctuation,
+to its parent and half of it to its grandparent.  Those candidates are
+then weighted by tag and class/id hints and by how little of their text
+is link text.
+
+ContentExtractor learns a SiteTemplate per domain from the first pages of
+a site: the content xpath, where the title is and how to split the site
+name off it, and the boilerplate blocks (copyright notes, share buttons)
+that repeat inside the content.  Later pages of the same blog go straight
+to the precompiled xpaths; when they stop matching the site is re-learned.
+Templates can be persisted to a json file.
+"""
+import json
+import os
+import re
+import threading
+from collections import Counter, namedtuple
+from hashlib import md5
+from urllib import parse
+
+from lxml import etree
+
+SKIP_TAGS = {'script', 'style', 'noscript', 'iframe', 'form', 'button', 'input', 'select',
+             'textarea', 'svg', 'head', 'title', 'meta', 'link'}
+PARAGRAPH_TAGS = {'p', 'pre', 'td', 'blockquote', 'figure', 'li', 'h2', 'h3', 'h4'}
+TAG_WEIGHTS = {
+    'article': 10, 'main': 5, 'section': 3, 'div': 5, 'pre': 3, 'td': 3, 'blockquote': 3,
+    'body': -5, 'ol': -3, 'ul': -3, 'li': -3, 'dl': -3, 'dd': -3, 'dt': -3, 'th': -5,
+    'address': -3, 'form': -3, 'h1': -5, 'h2': -5, 'h3': -5, 'h4': -5, 'header': -10,
+    'footer': -10, 'nav': -10, 'aside': -10,
+}
+positive_matcher = re.compile(
+    r'article|body|content|entry|hentry|main|page|post|text|blog|story', re.I)
+negative_matcher = re.compile(
+    r'comment|com-|contact|foot|masthead|media|meta|promo|related|scroll|shoutbox|sidebar|'
+    r'sponsor|shopping|tags|tool|widget|nav|menu|header|copyright|share|reward|banner', re.I)
+punctuation_matcher = re.compile(r'[,，。、；;！？]')
+
+# a paragraph needs this many characters to count at all
+MIN_PARAGRAPH = 25
+# a cached template with a positional content xpath has to select at least
+# this much text to be trusted; one selecting by id or class only some text
+MIN_CONTENT = 140
+# pages of a site compared to learn its boilerplate
+LEARN_PAGES = 3
+# shorter blocks (empty anchors, <br>, a lone word) are never boilerplate
+MIN_BLOCK = 10
+VERBATIM_TAGS = {'pre', 'code', 'figure', 'table'}
+TITLE_SEPARATORS = ('|', ' - ', ' – ', ' — ', '·')
+page_title = etree.XPath('string(//title)')
+
+
+def class_weight(element):
+    weight = 0
+    for hint in (element.get('class'), element.get('id')):
+        if hint:
+            if negative_matcher.search(hint):
+                weight -= 25
+            if positive_matcher.search(hint):
+                weight += 25
+    return weight
+
+
+def best_node(root):
+    """Return (element, score) of the main content of the tree under root,
+    or (None, 0) if nothing looks like content."""
+    nodes = [element for element in root.iter() if isinstance(element.tag, str)]
+    text_len = {}
+    link_len = {}
+    punctuation = {}
+    scores = {}
+    # reversed document order visits every child before its parent
+    for element in reversed(nodes):
+        tag = element.tag
+        if tag in SKIP_TAGS:
+            continue
+        text = element.text or ''
+        direct = len(text.strip())
+        punct = len(punctuation_matcher.findall(text))
+        total = links = 0
+        for child in element:
+            tail = child.tail
+            if tail:
+                direct += len(tail.strip())
+                punct += len(punctuation_matcher.findall(tail))
+            if child in text_len:
+                total += text_len[child]
+                links += link_len[child]
+                punct += punctuation[child]
+        total += direct
+        if tag == 'a':
+            links = total
+        text_len[element] = total
+        link_len[element] = links
+        punctuation[element] = punct
+
+        if total < MIN_PARAGRAPH:
+            continue
+        if tag in PARAGRAPH_TAGS or (tag == 'div' and direct >= MIN_PARAGRAPH):
+            score = 1 + punct + min(total // 100, 3)
+            parent = element.getparent()
+            if parent is not None:
+                scores[parent] = scores.get(parent, 0) + score
+                grandparent = parent.getparent()
+                if grandparent is not None:
+                    scores[grandparent] = scores.get(grandparent, 0) + score / 2
+
+    best, best_score = None, 0
+    for element, score in scores.items():
+        total = text_len.get(element, 0)
+        if not total:
+            continue
+        score += TAG_WEIGHTS.get(element.tag, 0) + class_weight(element)
+        score *= 1 - link_len[element] / total
+        if score > best_score:
+            best, best_score = element, score
+    return best, best_score
+
+
+def node_xpath(element):
+    """An xpath selecting element that is likely to hold on other pages of
+    the same site: by id or class when that is unique, else by position."""
+    root = element.getroottree()
+    for attr in ('id', 'class', 'itemprop'):
+        value = element.get(attr)
+        if value and '"' not in value:
+            xpath = f'//{element.tag}[@{attr}="{value}"]'
+            if root.xpath(xpath) == [element]:
+                return xpath
+    return root.getpath(element)
+
+
+def text_length(element):
+    return sum(len(text.strip()) for text in element.itertext())
+
+
+def has_text(element, minimum=1):
+    """text_length(element) >= minimum, without walking past the point
+    where it is reached."""
+    length = 0
+    for text in element.itertext():
+        length += len(text.strip())
+        if length >= minimum:
+            return True
+    return False
+
+
+def block_key(element):
+    return f'{element.tag}.{element.get("class", "")}'
+
+
+def block_signatures(node):
+    """Signatures (tag, class and a digest of the text) of the blocks inside
+    node that could be boilerplate: its children, and anything whose class or
+    id looks like boilerplate, holding at least MIN_BLOCK characters.
+    Code and tables are never looked into."""
+    blocks = {}
+    stack = [child for child in node if isinstance(child.tag, str)]
+    while stack:
+        element = stack.pop()
+        if element.getparent() is node or negative_matcher.search(
+                f'{element.get("class", "")} {element.get("id", "")}'):
+            text = ''.join(element.itertext()).strip()
+            if len(text) >= MIN_BLOCK:
+                digest = md5(text.encode('utf-8')).hexdigest()[:12]
+                blocks[f'{block_key(element)}:{digest}'] = element
+        if element.tag not in VERBATIM_TAGS:
+            stack.extend(child for child in element if isinstance(child.tag, str))
+    return blocks
+
+
+def inside_verbatim(element, node):
+    """Whether element is inside code or a table below node, where
+    block_signatures() does not look."""
+    for ancestor in element.iterancestors():
+        if ancestor is node:
+            return False
+        if ancestor.tag in VERBATIM_TAGS:
+            return True
+    return False
+
+
+def boilerplate_blocks(node, boilerplate, keys):
+    """The blocks of node whose signature is in boilerplate, the same ones
+    block_signatures() would find, but only elements whose tag and class
+    (keys) occur in boilerplate are hashed."""
+    found = []
+    for element in node.iterdescendants():
+        if not isinstance(element.tag, str) or block_key(element) not in keys:
+            continue
+        if element.getparent() is not node and not negative_matcher.search(
+                f'{element.get("class", "")} {element.get("id", "")}'):
+            continue
+        if inside_verbatim(element, node):
+            continue
+        text = ''.join(element.itertext()).strip()
+        if len(text) >= MIN_BLOCK:
+            digest = md5(text.encode('utf-8')).hexdigest()[:12]
+            if f'{block_key(element)}:{digest}' in boilerplate:
+                found.append(element)
+    return found
+
+
+def drop(element):
+    """Remove element from the tree, keeping its tail text."""
+    parent = element.getparent()
+    if parent is None:
+        return
+    if element.tail:
+        previous = element.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or '') + element.tail
+        else:
+            parent.text = (parent.text or '') + element.tail
+    parent.remove(element)
+
+
+def learn_title(root, node):
+    """Return (title xpath, separator) for a page: the heading holding the
+    title without the site name if there is one, else //title split on the
+    legacy default '|'.  A separator is only learned when a heading holds
+    the part of <title> before it, so a title that merely contains ' - '
+    is not cut."""
+    full = page_title(root).strip()
+    headings = [heading for heading in root.xpath('//h1|//h2') if heading.xpath('string()').strip()]
+    for separator in TITLE_SEPARATORS:
+        if separator not in full:
+            continue
+        head = full.split(separator)[0].strip()
+        for heading in headings:
+            if heading.xpath('string()').strip() == head:
+                return node_xpath(heading), separator
+    for heading in headings:
+        if heading.xpath('string()').strip() == full:
+            return node_xpath(heading), None
+    return '//title', '|'
+
+
+Page = namedtuple('Page', ['title', 'full_title', 'node'])
+
+
+class SiteTemplate(object):
+    """What the pages of one site have in common, with the xpaths compiled.
+
+    seen counts block signatures over the first LEARN_PAGES distinct pages
+    (learned holds digests of their text); blocks found on at least two of
+    them become boilerplate.
+    """
+
+    def __init__(self, content_xpath, title_xpath='//title', title_separator='|',
+                 boilerplate=(), learned=(), seen=None):
+        self.content_xpath = content_xpath
+        self.title_xpath = title_xpath
+        self.title_separator = title_separator
+        self.set_boilerplate(boilerplate)
+        self.learned = list(learned)
+        self.seen = Counter(seen or {})
+        self.content = etree.XPath(content_xpath)
+        # node_xpath() falls back to a /html/body/... path
+        self.positional = not content_xpath.startswith('//')
+        self.title = etree.XPath(f'string({title_xpath})')
+
+    def set_boilerplate(self, boilerplate):
+        self.boilerplate = set(boilerplate)
+        # tag.class of the boilerplate blocks: only those are hashed on later pages
+        self.boilerplate_keys = {sig.rsplit(':', 1)[0] for sig in self.boilerplate}
+
+    def to_dict(self):
+        d = {
+            'content_xpath': self.content_xpath,
+            'title_xpath': self.title_xpath,
+            'title_separator': self.title_separator,
+            'boilerplate': sorted(self.boilerplate),
+            'learned': self.learned,
+        }
+        if len(self.learned) < LEARN_PAGES:
+            d['seen'] = dict(self.seen)
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def match(self, root):
+        """The content element of root, or None if this template does not fit.
+        Short posts are accepted when the xpath selects by id or class."""
+        found = self.content(root)
+        if len(found) != 1:
+            return None
+        if has_text(found[0], MIN_CONTENT if self.positional else 1):
+            return found[0]
+        return None
+
+    def page(self, root, node):
+        """Page for root and its content node, learning boilerplate from the
+        first pages and removing it.  Returns (page, learned)."""
+        full_title = page_title(root).strip()
+        title = self.title(root).strip()
+        if self.title_xpath == '//title' and self.title_separator and self.title_separator in title:
+            title = title.split(self.title_separator)[0].strip()
+        if len(self.learned) < LEARN_PAGES:
+            digest = md5(''.join(node.itertext()).encode('utf-8')).hexdigest()[:12]
+            if digest not in self.learned:
+                blocks = block_signatures(node)
+                self.learned.append(digest)
+                self.seen.update(blocks.keys())
+                self.set_boilerplate(sig for sig, count in self.seen.items() if count >= 2)
+                if len(self.learned) == LEARN_PAGES:
+                    self.seen = Counter()
+                for sig, element in blocks.items():
+                    if sig in self.boilerplate:
+                        drop(element)
+                return Page(title, full_title, node), True
+        # nothing to learn from this page: only blocks that can be boilerplate are hashed
+        if self.boilerplate:
+            for element in boilerplate_blocks(node, self.boilerplate, self.boilerplate_keys):
+                drop(element)
+        return Page(title, full_title, node), False
+
+
+class ContentExtractor(object):
+    """Finds the title and main content of pages, keeping up to
+    max_templates SiteTemplates per domain (most recent first).
+
+    With a path the templates are loaded from and saved to that json file
+    whenever they change; concurrent processes overwrite each other's
+    updates, never the file itself.
+    """
+
+    def __init__(self, path=None, max_templates=4):
+        self.path = path
+        self.max_templates = max_templates
+        self.templates = {}
+        self.stats = {'cached': 0, 'scored': 0, 'relearned': 0}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for domain, templates in json.load(f).items():
+                    self.templates[domain] = [SiteTemplate.from_dict(d) for d in templates]
+
+    def learn(self, root, domain, xpath=None):
+        """Learn a template for root from scratch; None if nothing scores."""
+        if xpath:
+            found = root.xpath(xpath)
+            node = found[0] if found else None
+        else:
+            node, score = best_node(root)
+        if node is None:
+            return None
+        content_xpath = xpath or node_xpath(node)
+        templates = self.templates.get(domain, [])
+        # the same content xpath again keeps the boilerplate learned so far
+        same = [t for t in templates if t.content_xpath == content_xpath]
+        template = same[0] if same else SiteTemplate(content_xpath, *learn_title(root, node))
+        templates = [t for t in templates if t is not template]
+        self.templates[domain] = [template] + templates[:self.max_templates - 1]
+        return template
+
+    def page(self, root, url='', xpath=None):
+        """Return Page(title, full title, content element) for the tree root of
+        a page from url.  xpath, if given, is the content xpath to learn with
+        instead of scoring.  The content is root itself if nothing scores.
+        """
+        domain = parse.urlsplit(url).netloc
+        with self._lock:
+            templates = self.templates.get(domain, [])
+            for template in templates:
+                if xpath and template.content_xpath != xpath:
+                    continue
+                node = template.match(root)
+                if node is not None:
+                    self.stats['cached'] += 1
+                    break
+            else:
+                self.stats['scored'] += 1
+                known = list(templates)
+                template = self.learn(root, domain, xpath)
+                if template is None:
+                    full_title = page_title(root).strip()
+                    return Page(full_title.split('|')[0].strip(), full_title, root)
+                if known and template not in known:
+                    # the site changed its layout, or this is a new kind of page
+                    self.stats['relearned'] += 1
+                node = template.content(root)[0]
+            page, learned = template.page(root, node)
+            if learned and self.path and domain:
+                self.save()
+            return page
+
+    def extract(self, root, url=''):
+        """The content element of the tree root for a page from url."""
+        return self.page(root, url).node
+
+    def save(self):
+        data = {domain: [t.to_dict() for t in templates]
+                for domain, templates in self.templates.items() if domain}
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+
+extractors = {}
+extractors_lock = threading.Lock()
+
+
+def get_extractor(path=None):
+    """The shared ContentExtractor for a template file (in memory only if None)."""
+    extractor = extractors.get(path)
+    if extractor is None:
+        with extractors_lock:
+            extractor = extractors.setdefault(path, ContentExtractor(path))
+    return extractor
+
+
+def extract_content(root, url=''):
+    """Content element of root with the shared in-memory ContentExtractor."""
+    return get_extractor().extract(root, url)
+
+
+if __name__ == '__main__':
+    import sys
+    with open(sys.argv[1], 'rb') as f:
+        page = etree.HTML(f.read())
+    title, full_title, content = get_extractor().page(page)
+    print(title)
+    print(node_xpath(content))
+    print(etree.tostring(content, encoding='unicode', method='text'))
@@ -0,0 +1,132 @@
+"""Pooled, cached HTTP fetching for the html2text importer."""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib import parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.90 Safari/537.36'
+
+
+class HttpCache(object):
+    """On-disk response cache keyed by url.
+
+    Each entry is a ``<sha1>.json`` file holding the validators (ETag,
+    Last-Modified) and response headers, next to a ``<sha1>.body`` file with
+    the raw content.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _key(self, url):
+        return os.path.join(self.path, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def get(self, url):
+        """Return (meta, body) for url, or None if it is not cached."""
+        key = self._key(url)
+        try:
+            with open(key + '.json', encoding='utf8') as f:
+                meta = json.load(f)
+            with open(key + '.body', 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return meta, body
+
+    def set(self, url, response):
+        key = self._key(url)
+        meta = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'headers': dict(response.headers),
+            'fetched_at': time.time(),
+        }
+        # body first, so a meta file never points at a missing body
+        self._write(key + '.body', response.content)
+        self._write(key + '.json', json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    @staticmethod
+    def _write(path, data):
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+class Fetcher(object):
+    """Downloads pages through one pooled requests session.
+
+    With a cache directory, cached pages are revalidated with
+    If-None-Match / If-Modified-Since and a 304 is answered from disk.
+    """
+
+    def __init__(self, cache_dir=None, timeout=30, pool_size=16, per_host=2):
+        self.timeout = timeout
+        self.per_host = per_host
+        self.cache = HttpCache(cache_dir) if cache_dir else None
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._host_locks = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'not_modified': 0, 'bytes': 0}
+
+    def _host_lock(self, url):
+        with self._lock:
+            return self._host_locks[parse.urlsplit(url).netloc]
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def fetch(self, url):
+        """Return (content, headers) for url, raising for HTTP errors."""
+        cached = self.cache.get(url) if self.cache else None
+        headers = {}
+        if cached:
+            meta = cached[0]
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        with self._host_lock(url):
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        self._count('requests')
+        if response.status_code == 304 and cached:
+            self._count('not_modified')
+            return cached[1], cached[0]['headers']
+        response.raise_for_status()
+        self._count('bytes', len(response.content))
+        if self.cache:
+            self.cache.set(url, response)
+        return response.content, response.headers
+
+    def fetch_many(self, urls, max_workers=8):
+        """Fetch urls concurrently, yielding (url, content, headers, error) as
+        each download finishes.  At most per_host requests run against any
+        one host at a time."""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.fetch, url): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    content, headers = future.result()
+                except Exception as e:
+                    yield url, None, None, e
+                else:
+                    yield url, content, headers, None
+
+    def close(self):
+        self.session.close()
@@ -34,15 +34,21 @@ try:  # Python3
     import urllib.request as urllib
 except:
     import urllib
-import optparse, re, sys, codecs, types
-from os.path import join
+import optparse, re, sys, codecs, types, os, time, queue, threading
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from os.path import abspath, dirname, join
 
-try:
-    from textwrap import wrap
-except:
-    pass
+from textwrap import TextWrapper
 from lxml import etree
 
+# The helper modules sit next to this file, which is also imported by path
+# from blog_spider, not only run from utils/.
+if dirname(abspath(__file__)) not in sys.path:
+    sys.path.insert(0, dirname(abspath(__file__)))
+from content_extract import get_extractor
+from fetcher import Fetcher
+
 # Use Unicode characters instead of their ascii psuedo-replacements
 UNICODE_SNOB = 0
 
@@ -69,6 +75,12 @@ IGNORE_ANCHORS = False
 IGNORE_IMAGES = False
 IGNORE_EMPHASIS = False
 
+# Characters of HTML write_post() hands to iter_markdown() at a time.
+CHUNK_SIZE = 16 * 1024
+
+# Text without a tag that iter_markdown() holds back before converting it anyway.
+PENDING_LIMIT = 64 * 1024
+
 
 ### Entity Nonsense ###
 
@@ -97,6 +109,11 @@ unifiable_n = {}
 for k in unifiable.keys():
     unifiable_n[name2cp(k)] = unifiable[k]
 
+# HTML2Text keeps &nbsp; as a placeholder until the output is complete,
+# so it is neither unified nor collapsed as whitespace on the way.
+del unifiable_n[name2cp('nbsp')]
+unifiable['nbsp'] = '&nbsp_place_holder;'
+
 
 ### End Entity Nonsense ###
 
@@ -154,6 +171,11 @@ def element_style(attrs, style_def, parent_style):
     return style
 
 
+def link_key(attrs):
+    """hashable identity of a link: its href and, if present, its title"""
+    return attrs['href'], has_key(attrs, 'title'), attrs.get('title')
+
+
 def google_list_style(style):
     """finds out whether this is an ordered or unordered list"""
     if 'list-style-type' in style:
@@ -200,31 +222,67 @@ def list_numbering_start(attrs):
         return 0
 
 
+class HTML2TextOptions(namedtuple('HTML2TextOptions', [
+        'unicode_snob', 'escape_snob', 'links_each_paragraph', 'body_width',
+        'skip_internal_links', 'inline_links', 'google_list_indent', 'ignore_links',
+        'ignore_images', 'ignore_emphasis', 'google_doc', 'ul_item_mark',
+        'emphasis_mark', 'strong_mark', 'hide_strikethrough'])):
+    """Immutable HTML2Text configuration.  Hashable, and safe to share
+    between threads; derive variants with _replace()."""
+    __slots__ = ()
+
+
+def default_options(**kwargs):
+    """HTML2TextOptions built from the module-level defaults, overridden by kwargs."""
+    options = HTML2TextOptions(
+        unicode_snob=UNICODE_SNOB,
+        escape_snob=ESCAPE_SNOB,
+        links_each_paragraph=LINKS_EACH_PARAGRAPH,
+        body_width=BODY_WIDTH,
+        skip_internal_links=SKIP_INTERNAL_LINKS,
+        inline_links=INLINE_LINKS,
+        google_list_indent=GOOGLE_LIST_INDENT,
+        ignore_links=IGNORE_ANCHORS,
+        ignore_images=IGNORE_IMAGES,
+        ignore_emphasis=IGNORE_EMPHASIS,
+        google_doc=False,
+        ul_item_mark='*',
+        emphasis_mark='_',
+        strong_mark='**',
+        hide_strikethrough=False)
+    return options._replace(**kwargs)
+
+
 class HTML2Text(HTMLParser.HTMLParser):
-    def __init__(self, out=None, baseurl=''):
-        HTMLParser.HTMLParser.__init__(self)
+    absolute_url_matcher = re.compile(r'^[a-zA-Z+]+://')
 
+    def __init__(self, out=None, baseurl='', options=None):
         # Config options
-        self.unicode_snob = UNICODE_SNOB
-        self.escape_snob = ESCAPE_SNOB
-        self.links_each_paragraph = LINKS_EACH_PARAGRAPH
-        self.body_width = BODY_WIDTH
-        self.skip_internal_links = SKIP_INTERNAL_LINKS
-        self.inline_links = INLINE_LINKS
-        self.google_list_indent = GOOGLE_LIST_INDENT
-        self.ignore_links = IGNORE_ANCHORS
-        self.ignore_images = IGNORE_IMAGES
-        self.ignore_emphasis = IGNORE_EMPHASIS
-        self.google_doc = False
-        self.ul_item_mark = '*'
-        self.emphasis_mark = '_'
-        self.strong_mark = '**'
+        if options is None:
+            options = default_options()
+        self.options = options
 
         if out is None:
             self.out = self.outtextf
         else:
             self.out = out
 
+        self.baseurl = baseurl
+        self.para_wrapper = None  # reused by optwrap() while body_width is unchanged
+        self.tag_handlers = self.build_tag_handlers()
+
+        HTMLParser.HTMLParser.__init__(self)  # calls reset()
+
+    def reset(self, baseurl=None):
+        """Forget the current document so the instance can convert another
+        one.  The configuration is restored from self.options, undoing any
+        attribute a previous user changed on the instance."""
+        HTMLParser.HTMLParser.reset(self)
+        if baseurl is not None:
+            self.baseurl = baseurl
+        for name, value in zip(self.options._fields, self.options):
+            setattr(self, name, value)
+
         self.outtextlist = []  # empty list to store output characters before they are "joined"
 
         try:
@@ -237,10 +295,10 @@ class HTML2Text(HTMLParser.HTMLParser):
         self.outcount = 0
         self.start = 1
         self.space = 0
-        self.a = []
+        self.a = deque()  # reference links waiting to be written, ordered by outcount
+        self.a_index = {}  # link_key() -> entry of self.a, for reusing reference numbers
         self.astack = []
         self.maybe_automatic_link = None
-        self.absolute_url_matcher = re.compile(r'^[a-zA-Z+]+://')
         self.acount = 0
         self.list = []
         self.blockquote = 0
@@ -259,13 +317,6 @@ class HTML2Text(HTMLParser.HTMLParser):
         self.abbr_title = None  # current abbreviation definition
         self.abbr_data = None  # last inner HTML (for abbr being defined)
         self.abbr_list = {}  # stack of abbreviations to write later
-        self.baseurl = baseurl
-
-        try:
-            del unifiable_n[name2cp('nbsp')]
-        except KeyError:
-            pass
-        unifiable['nbsp'] = '&nbsp_place_holder;'
 
     def feed(self, data):
         data = data.replace("</' + 'script>", "</ignore>")
@@ -276,22 +327,105 @@ class HTML2Text(HTMLParser.HTMLParser):
         self.feed("")
         return self.optwrap(self.close())
 
+    def handle_tree(self, element, with_tail=True):
+        """Convert an lxml element directly, without serializing it to HTML
+        and parsing it again."""
+        self.feed_tree(element, with_tail)
+        return self.optwrap(self.close())
+
+    def feed_tree(self, element, with_tail=True):
+        """Drive the parser callbacks from an lxml element tree.
+
+        Every element gets a start and an end tag, like the self-closing tags
+        etree.tostring() writes for empty elements.  Comments and processing
+        instructions are skipped but their tail text is kept.  The tail of
+        element itself is included when with_tail is true, as tostring() does.
+        """
+        self.handle_starttag(element.tag, element.items())
+        if element.text: self.handle_data(element.text)
+        stack = [(element, iter(element))]
+        while stack:
+            el, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                self.handle_endtag(el.tag)
+                if el.tail and (stack or with_tail): self.handle_data(el.tail)
+            elif isinstance(child.tag, str):
+                self.handle_starttag(child.tag, child.items())
+                if child.text: self.handle_data(child.text)
+                stack.append((child, iter(child)))
+            elif child.tail:
+                self.handle_data(child.tail)
+
+    def iter_markdown(self, chunks):
+        """Convert HTML arriving in pieces, yielding Markdown as soon as it is final.
+
+        Output is released a whole line at a time, with nbsp substitution and
+        wrapping applied as it goes, so only the current paragraph is held in
+        memory.  The yielded strings concatenate to handle(''.join(chunks)).
+        """
+        wrapper = self.get_para_wrapper()
+        if wrapper is not None:
+            wrapper.newlines = 0
+        pending = tail = ''
+        for chunk in chunks:
+            # Only feed up to the last tag so text nodes reach handle_data whole.
+            pending += chunk
+            cut = pending.rfind('<')
+            if cut <= 0 and len(pending) > PENDING_LIMIT:
+                # No tag for a while: release the text up to the last space
+                # rather than buffering it all, at the cost of one more text node.
+                cut = max(pending.rfind(' '), pending.rfind('\n')) + 1 or len(pending)
+            if cut <= 0:
+                continue
+            self.feed(pending[:cut])
+            pending = pending[cut:]
+            text = tail + self.pop_output()
+            cut = text.rfind('\n') + 1
+            if not cut:
+                tail = text
+                continue
+            text, tail = text[:cut], text[cut:]
+            if wrapper is not None:
+                text = ''.join([wrapper.wrap_para(para) for para in text[:-1].split('\n')])
+            if text:
+                yield text
+
+        self.feed(pending)
+        self.feed("")
+        self.finish()
+        text = tail + self.pop_output()
+        if wrapper is not None:
+            text = ''.join([wrapper.wrap_para(para) for para in text.split('\n')])
+        if text:
+            yield text
+
     def outtextf(self, s):
         self.outtextlist.append(s)
         if s: self.lastWasNL = s[-1] == '\n'
 
-    def close(self):
+    def finish(self):
+        """Flush the parser and emit trailing link and abbreviation lists."""
         HTMLParser.HTMLParser.close(self)
 
         self.pbr()
         self.o('', 0, 'end')
 
-        self.outtext = self.outtext.join(self.outtextlist)
+    def pop_output(self):
+        """Return the text emitted since the last call, with nbsp substituted."""
+        text = ''.join(self.outtextlist)
+        del self.outtextlist[:]
         if self.unicode_snob:
             nbsp = chr(name2cp('nbsp'))
         else:
             nbsp = u' '
-        self.outtext = self.outtext.replace(u'&nbsp_place_holder;', nbsp)
+        return text.replace(u'&nbsp_place_holder;', nbsp)
+
+    def close(self):
+        self.finish()
+
+        self.outtext = self.outtext + self.pop_output()
 
         return self.outtext
 
@@ -313,22 +447,30 @@ class HTML2Text(HTMLParser.HTMLParser):
 
             If the set of attributes is not found, returns None
         """
-        if not has_key(attrs, 'href'): return None
-
-        i = -1
-        for a in self.a:
-            i += 1
-            match = 0
+        link = self.previous_link(attrs)
+        if link is None: return None
+        return list(self.a).index(link)
 
-            if has_key(a, 'href') and a['href'] == attrs['href']:
-                if has_key(a, 'title') or has_key(attrs, 'title'):
-                    if (has_key(a, 'title') and has_key(attrs, 'title') and
-                            a['title'] == attrs['title']):
-                        match = True
-                else:
-                    match = True
+    def previous_link(self, attrs):
+        """ returns the pending link in self.a with the same href and title as
+            attrs, or None
+        """
+        if not has_key(attrs, 'href'): return None
+        return self.a_index.get(link_key(attrs))
 
-            if match: return i
+    def add_link(self, attrs):
+        """ returns the numbered reference link for attrs, reusing a pending
+            one with the same href and title
+        """
+        link = self.previous_link(attrs)
+        if link is None:
+            link = attrs
+            self.acount += 1
+            link['count'] = self.acount
+            link['outcount'] = self.outcount
+            self.a.append(link)
+            self.a_index[link_key(link)] = link
+        return link
 
     def drop_last(self, nLetters):
         if not self.quiet:
@@ -397,13 +539,54 @@ class HTML2Text(HTMLParser.HTMLParser):
             if strikethrough:
                 self.quiet -= 1
 
+    # tag name -> (handler method, runs after Google Doc emphasis handling)
+    tag_dispatch = dict(
+        [('h%d' % n, ('tag_header', False)) for n in range(1, 10)] +
+        [(tag, ('tag_p', False)) for tag in ('p', 'div')] +
+        [('br', ('tag_br', False)),
+         ('hr', ('tag_hr', False)),
+         ('head', ('tag_quiet', False)),
+         ('script', ('tag_quiet', False)),
+         ('style', ('tag_stylesheet', False)),
+         ('body', ('tag_body', False)),
+         ('blockquote', ('tag_blockquote', False))] +
+        [(tag, ('tag_em', False)) for tag in ('em', 'i', 'u')] +
+        [(tag, ('tag_strong', False)) for tag in ('strong', 'b')] +
+        [(tag, ('tag_del', False)) for tag in ('del', 'strike', 's')] +
+        [(tag, ('tag_code', True)) for tag in ('code', 'tt')] +
+        [('abbr', ('tag_abbr', True)),
+         ('a', ('tag_a', True)),
+         ('img', ('tag_img', True)),
+         ('dl', ('tag_dl', True)),
+         ('dt', ('tag_dt', True)),
+         ('dd', ('tag_dd', True)),
+         ('ol', ('tag_list', True)),
+         ('ul', ('tag_list', True)),
+         ('li', ('tag_li', True)),
+         ('table', ('tag_table', True)),
+         ('tr', ('tag_table', True)),
+         ('td', ('tag_td', True)),
+         ('pre', ('tag_pre', True))])
+
+    def build_tag_handlers(self):
+        """Bind the tag_dispatch table to this instance."""
+        return dict((tag, (getattr(self, name), late))
+                    for tag, (name, late) in self.tag_dispatch.items())
+
     def handle_tag(self, tag, attrs, start):
+        handler = self.tag_handlers.get(tag)
+        if handler is None and not self.google_doc:
+            # unknown tags (span, ...) only interrupt a run of lists
+            self.lastWasList = False
+            return
+
         # attrs = fixattrs(attrs)
         if attrs is None:
             attrs = {}
         else:
             attrs = dict(attrs)
 
+        tag_style = parent_style = None
         if self.google_doc:
             # the attrs parameter is empty for a closing tag. in addition, we
             # need the attributes of the parent nodes in order to get a
@@ -420,109 +603,129 @@ class HTML2Text(HTMLParser.HTMLParser):
                 if self.tag_stack:
                     parent_style = self.tag_stack[-1][2]
 
-        if hn(tag):
-            self.p()
-            if start:
-                self.inheader = True
-                self.o(hn(tag) * "#" + ' ')
-            else:
-                self.inheader = False
-                return  # prevent redundant emphasis marks on headers
+        if handler is None:
+            method = late = None
+        else:
+            method, late = handler
+            if not late and method(tag, attrs, start, tag_style):
+                return
 
-        if tag in ['p', 'div']:
-            if self.google_doc:
-                if start and google_has_height(tag_style):
-                    self.p()
-                else:
-                    self.soft_br()
-            else:
+        if self.google_doc:
+            if not self.inheader:
+                # handle some font attributes, but leave headers clean
+                self.handle_emphasis(start, tag_style, parent_style)
+
+        if late:
+            method(tag, attrs, start, tag_style)
+        if tag != 'ol' and tag != 'ul':
+            self.lastWasList = False
+
+    # Per-tag handlers called through tag_dispatch.  A true return value
+    # stops any further processing of the tag.
+
+    def tag_header(self, tag, attrs, start, tag_style):
+        self.p()
+        if start:
+            self.inheader = True
+            self.o(int(tag[1]) * "#" + ' ')
+        else:
+            self.inheader = False
+            return True  # prevent redundant emphasis marks on headers
+
+    def tag_p(self, tag, attrs, start, tag_style):
+        if self.google_doc:
+            if start and google_has_height(tag_style):
                 self.p()
+            else:
+                self.soft_br()
+        else:
+            self.p()
 
-        if tag == "br" and start: self.o("  \n")
+    def tag_br(self, tag, attrs, start, tag_style):
+        if start: self.o("  \n")
 
-        if tag == "hr" and start:
+    def tag_hr(self, tag, attrs, start, tag_style):
+        if start:
             self.p()
             self.o("* * *")
             self.p()
 
-        if tag in ["head", "style", 'script']:
-            if start:
-                self.quiet += 1
-            else:
-                self.quiet -= 1
+    def tag_quiet(self, tag, attrs, start, tag_style):
+        if start:
+            self.quiet += 1
+        else:
+            self.quiet -= 1
 
-        if tag == "style":
-            if start:
-                self.style += 1
-            else:
-                self.style -= 1
+    def tag_stylesheet(self, tag, attrs, start, tag_style):
+        self.tag_quiet(tag, attrs, start, tag_style)
+        if start:
+            self.style += 1
+        else:
+            self.style -= 1
 
-        if tag in ["body"]:
-            self.quiet = 0  # sites like 9rules.com never close <head>
+    def tag_body(self, tag, attrs, start, tag_style):
+        self.quiet = 0  # sites like 9rules.com never close <head>
 
-        if tag == "blockquote":
-            if start:
-                self.p();
-                self.o('> ', 0, 1);
-                self.start = 1
-                self.blockquote += 1
-            else:
-                self.blockquote -= 1
-                self.p()
+    def tag_blockquote(self, tag, attrs, start, tag_style):
+        if start:
+            self.p();
+            self.o('> ', 0, 1);
+            self.start = 1
+            self.blockquote += 1
+        else:
+            self.blockquote -= 1
+            self.p()
 
-        if tag in ['em', 'i', 'u'] and not self.ignore_emphasis: self.o(self.emphasis_mark)
-        if tag in ['strong', 'b'] and not self.ignore_emphasis: self.o(self.strong_mark)
-        if tag in ['del', 'strike', 's']:
-            if start:
-                self.o("<" + tag + ">")
-            else:
-                self.o("</" + tag + ">")
+    def tag_em(self, tag, attrs, start, tag_style):
+        if not self.ignore_emphasis: self.o(self.emphasis_mark)
 
-        if self.google_doc:
-            if not self.inheader:
-                # handle some font attributes, but leave headers clean
-                self.handle_emphasis(start, tag_style, parent_style)
+    def tag_strong(self, tag, attrs, start, tag_style):
+        if not self.ignore_emphasis: self.o(self.strong_mark)
 
-        if tag in ["code", "tt"] and not self.pre: self.o('`')  # TODO: `` `this` ``
-        if tag == "abbr":
-            if start:
+    def tag_del(self, tag, attrs, start, tag_style):
+        if start:
+            self.o("<" + tag + ">")
+        else:
+            self.o("</" + tag + ">")
+
+    def tag_code(self, tag, attrs, start, tag_style):
+        if not self.pre: self.o('`')  # TODO: `` `this` ``
+
+    def tag_abbr(self, tag, attrs, start, tag_style):
+        if start:
+            self.abbr_title = None
+            self.abbr_data = ''
+            if has_key(attrs, 'title'):
+                self.abbr_title = attrs['title']
+        else:
+            if self.abbr_title != None:
+                self.abbr_list[self.abbr_data] = self.abbr_title
                 self.abbr_title = None
-                self.abbr_data = ''
-                if has_key(attrs, 'title'):
-                    self.abbr_title = attrs['title']
-            else:
-                if self.abbr_title != None:
-                    self.abbr_list[self.abbr_data] = self.abbr_title
-                    self.abbr_title = None
-                self.abbr_data = ''
+            self.abbr_data = ''
 
-        if tag == "a" and not self.ignore_links:
-            if start:
-                if has_key(attrs, 'href') and not (self.skip_internal_links and attrs['href'].startswith('#')):
-                    self.astack.append(attrs)
-                    self.maybe_automatic_link = attrs['href']
-                else:
-                    self.astack.append(None)
+    def tag_a(self, tag, attrs, start, tag_style):
+        if self.ignore_links:
+            return
+        if start:
+            if has_key(attrs, 'href') and not (self.skip_internal_links and attrs['href'].startswith('#')):
+                self.astack.append(attrs)
+                self.maybe_automatic_link = attrs['href']
             else:
-                if self.astack:
-                    a = self.astack.pop()
-                    if self.maybe_automatic_link:
-                        self.maybe_automatic_link = None
-                    elif a:
-                        if self.inline_links:
-                            self.o("](" + escape_md(a['href']) + ")")
-                        else:
-                            i = self.previousIndex(a)
-                            if i is not None:
-                                a = self.a[i]
-                            else:
-                                self.acount += 1
-                                a['count'] = self.acount
-                                a['outcount'] = self.outcount
-                                self.a.append(a)
-                            self.o("][" + str(a['count']) + "]")
-
-        if tag == "img" and start and not self.ignore_images:
+                self.astack.append(None)
+        else:
+            if self.astack:
+                a = self.astack.pop()
+                if self.maybe_automatic_link:
+                    self.maybe_automatic_link = None
+                elif a:
+                    if self.inline_links:
+                        self.o("](" + escape_md(a['href']) + ")")
+                    else:
+                        a = self.add_link(a)
+                        self.o("][" + str(a['count']) + "]")
+
+    def tag_img(self, tag, attrs, start, tag_style):
+        if start and not self.ignore_images:
             if has_key(attrs, 'src'):
                 attrs['href'] = attrs['src']
                 alt = attrs.get('alt', '')
@@ -531,67 +734,68 @@ class HTML2Text(HTMLParser.HTMLParser):
                 if self.inline_links:
                     self.o("(" + escape_md(attrs['href']) + ")")
                 else:
-                    i = self.previousIndex(attrs)
-                    if i is not None:
-                        attrs = self.a[i]
-                    else:
-                        self.acount += 1
-                        attrs['count'] = self.acount
-                        attrs['outcount'] = self.outcount
-                        self.a.append(attrs)
+                    attrs = self.add_link(attrs)
                     self.o("[" + str(attrs['count']) + "]")
 
-        if tag == 'dl' and start: self.p()
-        if tag == 'dt' and not start: self.pbr()
-        if tag == 'dd' and start: self.o('    ')
-        if tag == 'dd' and not start: self.pbr()
+    def tag_dl(self, tag, attrs, start, tag_style):
+        if start: self.p()
 
-        if tag in ["ol", "ul"]:
-            # Google Docs create sub lists as top level lists
-            if (not self.list) and (not self.lastWasList):
-                self.p()
-            if start:
-                if self.google_doc:
-                    list_style = google_list_style(tag_style)
-                else:
-                    list_style = tag
-                numbering_start = list_numbering_start(attrs)
-                self.list.append({'name': list_style, 'num': numbering_start})
+    def tag_dt(self, tag, attrs, start, tag_style):
+        if not start: self.pbr()
+
+    def tag_dd(self, tag, attrs, start, tag_style):
+        if start:
+            self.o('    ')
+        else:
+            self.pbr()
+
+    def tag_list(self, tag, attrs, start, tag_style):
+        # Google Docs create sub lists as top level lists
+        if (not self.list) and (not self.lastWasList):
+            self.p()
+        if start:
+            if self.google_doc:
+                list_style = google_list_style(tag_style)
             else:
-                if self.list: self.list.pop()
-            self.lastWasList = True
+                list_style = tag
+            numbering_start = list_numbering_start(attrs)
+            self.list.append({'name': list_style, 'num': numbering_start})
         else:
-            self.lastWasList = False
+            if self.list: self.list.pop()
+        self.lastWasList = True
 
-        if tag == 'li':
-            self.pbr()
-            if start:
-                if self.list:
-                    li = self.list[-1]
-                else:
-                    li = {'name': 'ul', 'num': 0}
-                if self.google_doc:
-                    nest_count = self.google_nest_count(tag_style)
-                else:
-                    nest_count = len(self.list)
-                self.o("  " * nest_count)  # TODO: line up <ol><li>s > 9 correctly.
-                if li['name'] == "ul":
-                    self.o(self.ul_item_mark + " ")
-                elif li['name'] == "ol":
-                    li['num'] += 1
-                    self.o(str(li['num']) + ". ")
-                self.start = 1
-
-        if tag in ["table", "tr"] and start: self.p()
-        if tag == 'td': self.pbr()
-
-        if tag == "pre":
-            if start:
-                self.startpre = 1
-                self.pre = 1
+    def tag_li(self, tag, attrs, start, tag_style):
+        self.pbr()
+        if start:
+            if self.list:
+                li = self.list[-1]
             else:
-                self.pre = 0
-            self.p()
+                li = {'name': 'ul', 'num': 0}
+            if self.google_doc:
+                nest_count = self.google_nest_count(tag_style)
+            else:
+                nest_count = len(self.list)
+            self.o("  " * nest_count)  # TODO: line up <ol><li>s > 9 correctly.
+            if li['name'] == "ul":
+                self.o(self.ul_item_mark + " ")
+            elif li['name'] == "ol":
+                li['num'] += 1
+                self.o(str(li['num']) + ". ")
+            self.start = 1
+
+    def tag_table(self, tag, attrs, start, tag_style):
+        if start: self.p()
+
+    def tag_td(self, tag, attrs, start, tag_style):
+        self.pbr()
+
+    def tag_pre(self, tag, attrs, start, tag_style):
+        if start:
+            self.startpre = 1
+            self.pre = 1
+        else:
+            self.pre = 0
+        self.p()
 
     def pbr(self):
         if self.p_p == 0:
@@ -604,7 +808,7 @@ class HTML2Text(HTMLParser.HTMLParser):
         self.pbr()
         self.br_toggle = '  '
 
-    def o(self, data, puredata=0, force=0):
+    def o(self, data, puredata=0, force=0, collapsed=False):
         if self.abbr_data is not None:
             self.abbr_data += data
 
@@ -618,7 +822,8 @@ class HTML2Text(HTMLParser.HTMLParser):
                     self.drop_white_space = 0
 
             if puredata and not self.pre:
-                data = re.sub('\s+', ' ', data)
+                if not collapsed:
+                    data = whitespace_matcher.sub(' ', data)
                 if data and data[0] == ' ':
                     self.space = 1
                     data = data[1:]
@@ -668,18 +873,17 @@ class HTML2Text(HTMLParser.HTMLParser):
             if self.a and ((self.p_p == 2 and self.links_each_paragraph) or force == "end"):
                 if force == "end": self.out("\n")
 
-                newa = []
-                for link in self.a:
-                    if self.outcount > link['outcount']:
-                        self.out("   [" + str(link['count']) + "]: " + urlparse.urljoin(self.baseurl, link['href']))
-                        if has_key(link, 'title'): self.out(" (" + link['title'] + ")")
-                        self.out("\n")
-                    else:
-                        newa.append(link)
-
-                if self.a != newa: self.out("\n")  # Don't need an extra line when nothing was done.
+                # self.a is ordered by outcount, so the links to write are a prefix
+                flushed = False
+                while self.a and self.outcount > self.a[0]['outcount']:
+                    link = self.a.popleft()
+                    del self.a_index[link_key(link)]
+                    self.out("   [" + str(link['count']) + "]: " + urlparse.urljoin(self.baseurl, link['href']))
+                    if has_key(link, 'title'): self.out(" (" + link['title'] + ")")
+                    self.out("\n")
+                    flushed = True
 
-                self.a = newa
+                if flushed: self.out("\n")  # Don't need an extra line when nothing was done.
 
             if self.abbr_list and force == "end":
                 for abbr, definition in self.abbr_list.items():
@@ -704,9 +908,19 @@ class HTML2Text(HTMLParser.HTMLParser):
                 self.o("[")
                 self.maybe_automatic_link = None
 
-        if not self.code and not self.pre:
-            data = escape_md_section(data, snob=self.escape_snob)
-        self.o(data, 1)
+        if self.pre:
+            self.o(data, 1)
+        elif self.abbr_data is not None:
+            # abbreviations are recorded before whitespace is collapsed
+            if not self.code:
+                data = escape_md_section(data, snob=self.escape_snob)
+            self.o(data, 1)
+        else:
+            if self.code:
+                data = whitespace_matcher.sub(' ', data)
+            else:
+                data = md_section_escapers[bool(self.escape_snob), True].escape(data)
+            self.o(data, 1, collapsed=True)
 
     def unknown_decl(self, data):
         pass
@@ -755,36 +969,23 @@ class HTML2Text(HTMLParser.HTMLParser):
         """calculate the nesting count of google doc lists"""
         nest_count = 0
         if 'margin-left' in style:
-            nest_count = int(style['margin-left'][:-2]) / self.google_list_indent
+            nest_count = int(style['margin-left'][:-2]) // self.google_list_indent
         return nest_count
 
     def optwrap(self, text):
         """Wrap all paragraphs in the provided text."""
-        if not self.body_width:
+        wrapper = self.get_para_wrapper()
+        if wrapper is None:
             return text
+        return wrapper.wrap(text)
 
-        assert wrap, "Requires Python 2.3."
-        result = ''
-        newlines = 0
-        for para in text.split("\n"):
-            if len(para) > 0:
-                if not skipwrap(para):
-                    result += "\n".join(wrap(para, self.body_width))
-                    if para.endswith('  '):
-                        result += "  \n"
-                        newlines = 1
-                    else:
-                        result += "\n\n"
-                        newlines = 2
-                else:
-                    if not onlywhite(para):
-                        result += para + "\n"
-                        newlines = 1
-            else:
-                if newlines < 2:
-                    result += "\n"
-                    newlines += 1
-        return result
+    def get_para_wrapper(self):
+        """Return the ParagraphWrapper for body_width, or None when not wrapping."""
+        if not self.body_width:
+            return None
+        if self.para_wrapper is None or self.para_wrapper.width != self.body_width:
+            self.para_wrapper = ParagraphWrapper(self.body_width)
+        return self.para_wrapper
 
 
 ordered_list_matcher = re.compile(r'\d+\.\s')
@@ -816,6 +1017,64 @@ md_backslash_matcher = re.compile(r'''
     (?=[%s])      # followed by a char that requires escaping
     ''' % re.escape(slash_chars),
                                   flags=re.VERBOSE)
+whitespace_matcher = re.compile(r'\s+')
+
+
+class MarkdownEscaper(object):
+    """Does the work of escape_md_section() in one compiled regex pass,
+    optionally collapsing whitespace runs to a single space on the way
+    (what o() does to pure data), with the result unchanged.
+
+    Matches are limited to what needs rewriting: an escapable backslash,
+    (snob) a markdown character, a list marker at the start of a line, and
+    with collapse a whitespace run that is not a lone space.  Text where
+    none of these can occur is returned without running the substitution.
+    """
+    # line-start markers escaped by md_dot_matcher, md_plus_matcher and md_dash_matcher
+    lead = r'\d+\.(?=\s)|\+(?=\s)|-(?=\s|\-)'
+
+    def __init__(self, snob=False, collapse=False):
+        self.collapse = collapse
+        chars = r'\\'
+        patterns = [r'\A(?P<ws0>\s*)(?P<lead0>%s)' % self.lead,
+                    r'(?P<slash>\\)(?=[%s])' % re.escape(slash_chars)]
+        if snob:
+            chars += r'`\*_{}\[\]\(\)#!'
+            patterns.append(r'[`\*_{}\[\]\(\)#!]')
+        if collapse:
+            patterns.append(r'(?P<ws>\s*\n\s*|\s{2,}|[^\S ])(?P<lead>%s)?' % self.lead)
+            trigger = r'[%s]|[^\S ]|  |\A\s*[\d+-]' % chars
+        else:
+            patterns.append(r'(?P<ws>\s*\n\s*)(?P<lead>%s)' % self.lead)
+            trigger = r'[%s]|\n|\A\s*[\d+-]' % chars
+        self.matcher = re.compile('|'.join(patterns))
+        self.trigger = re.compile(trigger)
+
+    def replace(self, m):
+        ws = m.group('ws')
+        if ws is not None:
+            lead = m.group('lead')
+            if self.collapse:
+                ws = ' '
+            if lead is None or '\n' not in m.group('ws'):
+                return ws + (lead or '')
+        else:
+            ws = m.group('ws0')
+            if ws is None:
+                return '\\' + m.group(0)
+            lead = m.group('lead0')
+            if ws and self.collapse:
+                ws = ' '
+        return ws + lead[:-1] + '\\' + lead[-1]
+
+    def escape(self, text):
+        if not self.trigger.search(text):
+            return text
+        return self.matcher.sub(self.replace, text)
+
+
+md_section_escapers = dict(((snob, collapse), MarkdownEscaper(snob, collapse))
+                           for snob in (False, True) for collapse in (False, True))
 
 
 def skipwrap(para):
@@ -839,6 +1098,136 @@ def skipwrap(para):
     return False
 
 
+# East Asian wide/fullwidth ranges: Hangul Jamo, CJK radicals to Yi, Hangul
+# syllables, compatibility ideographs, vertical forms, fullwidth forms and the
+# supplementary ideograph planes.
+wide_chars = (u'\u1100-\u115f\u2e80-\ua4cf\uac00-\ud7a3\uf900-\ufaff'
+              u'\ufe30-\ufe4f\uff00-\uff60\uffe0-\uffe6\U00020000-\U0003fffd')
+wide_char_matcher = re.compile(u'[%s]' % wide_chars)
+wide_chunk_matcher = re.compile(u'[%s]|[^%s]+' % (wide_chars, wide_chars))
+# inline links and images, and bare urls: never split, the link would break
+link_chunk_matcher = re.compile(r'!?\[[^\[\]]*\]\([^()\s]*(?:\s+"[^"]*")?\)'
+                                r'|<?[a-zA-Z+]+://[^\s<>\u3000-\u303f\uff01-\uff60]+>?')
+
+
+def text_width(text):
+    """Return the number of terminal columns text occupies."""
+    return len(text) + len(wide_char_matcher.findall(text))
+
+
+class CJKTextWrapper(TextWrapper):
+    """TextWrapper that measures display columns and may break between
+    any two wide characters, since CJK text has no spaces to break on.
+    Markdown links and bare urls are kept whole, on a line of their own
+    if they are longer than the width."""
+
+    def _split(self, text):
+        chunks = []
+        start = 0
+        for m in link_chunk_matcher.finditer(text):
+            chunks.extend(self._split_text(text[start:m.start()]))
+            chunks.append(m.group())
+            start = m.end()
+        chunks.extend(self._split_text(text[start:]))
+        return chunks
+
+    def _split_text(self, text):
+        chunks = []
+        if not text:
+            return chunks
+        for chunk in TextWrapper._split(self, text):
+            if wide_char_matcher.search(chunk):
+                chunks.extend(wide_chunk_matcher.findall(chunk))
+            else:
+                chunks.append(chunk)
+        return chunks
+
+    def _handle_long_word(self, reversed_chunks, cur_line, cur_len, width):
+        if link_chunk_matcher.fullmatch(reversed_chunks[-1]):
+            if not cur_line:
+                cur_line.append(reversed_chunks.pop())
+            return
+        TextWrapper._handle_long_word(self, reversed_chunks, cur_line, cur_len, width)
+
+    def _wrap_chunks(self, chunks):
+        widths = {}
+        lines = []
+        chunks.reverse()
+        while chunks:
+            cur_line = []
+            cur_len = 0
+            indent = self.subsequent_indent if lines else self.initial_indent
+            width = self.width - text_width(indent)
+
+            if self.drop_whitespace and chunks[-1].strip() == '' and lines:
+                del chunks[-1]
+
+            while chunks:
+                n = widths.get(chunks[-1])
+                if n is None:
+                    n = widths[chunks[-1]] = text_width(chunks[-1])
+                if cur_len + n <= width:
+                    cur_line.append(chunks.pop())
+                    cur_len += n
+                else:
+                    break
+
+            if chunks and text_width(chunks[-1]) > width:
+                self._handle_long_word(chunks, cur_line, cur_len, width)
+
+            if self.drop_whitespace and cur_line and cur_line[-1].strip() == '':
+                del cur_line[-1]
+
+            if cur_line:
+                lines.append(indent + ''.join(cur_line))
+        return lines
+
+
+class ParagraphWrapper(object):
+    """Wraps text paragraph by paragraph with preconfigured TextWrappers.
+
+    Output is collected in a list and joined once, so the cost is linear in
+    the size of the document.  Paragraphs containing CJK characters are
+    wrapped by display width instead of being treated as one long word.
+    """
+
+    def __init__(self, width):
+        self.width = width
+        self.wrapper = TextWrapper(width)
+        self.cjk_wrapper = CJKTextWrapper(width)
+        self.newlines = 0
+
+    def wrap_para(self, para):
+        """Wrap a single line of text, returning the string to emit for it."""
+        if para:
+            if not skipwrap(para):
+                if wide_char_matcher.search(para):
+                    lines = self.cjk_wrapper.wrap(para)
+                elif len(para) <= self.width and para[-1] != ' ' and para.isprintable():
+                    # Fits on one line and has nothing TextWrapper would
+                    # expand, replace or drop: it comes back unchanged.
+                    lines = [para]
+                else:
+                    lines = self.wrapper.wrap(para)
+                if para.endswith('  '):
+                    self.newlines = 1
+                    return "\n".join(lines) + "  \n"
+                self.newlines = 2
+                return "\n".join(lines) + "\n\n"
+            if not onlywhite(para):
+                self.newlines = 1
+                return para + "\n"
+        elif self.newlines < 2:
+            self.newlines += 1
+            return "\n"
+        return ''
+
+    def wrap(self, text):
+        """Wrap all paragraphs in the provided text."""
+        self.newlines = 0
+        return ''.join([self.wrap_para(para) for para in text.split("\n")])
+
+
 def wrapwrite(text):
     text = text.encode('utf-8')
     try:  # Python3
@@ -847,9 +1236,71 @@ def wrapwrite(text):
         sys.stdout.write(text)
 
 
+class HTML2TextPool(object):
+    """Thread-safe pool of HTML2Text instances sharing one HTML2TextOptions.
+
+    Threads take a converter with acquire(), which resets it for a new
+    document, and hand it back with release(); convert() does both around
+    handle().  Instances are created on demand and at most size idle ones
+    are kept.
+    """
+
+    def __init__(self, options=None, size=8):
+        if options is None:
+            options = default_options()
+        self.options = options
+        self.idle = queue.LifoQueue(size)
+
+    def acquire(self, baseurl=''):
+        try:
+            h = self.idle.get_nowait()
+        except queue.Empty:
+            return HTML2Text(baseurl=baseurl, options=self.options)
+        h.reset(baseurl)
+        return h
+
+    def release(self, h):
+        try:
+            self.idle.put_nowait(h)
+        except queue.Full:
+            pass
+
+    def convert(self, html, baseurl=''):
+        h = self.acquire(baseurl)
+        try:
+            return h.handle(html)
+        finally:
+            self.release(h)
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(options=None):
+    """Return the shared HTML2TextPool for options (the module defaults if None)."""
+    if options is None:
+        options = default_options()
+    pool = pools.get(options)
+    if pool is None:
+        with pools_lock:
+            pool = pools.setdefault(options, HTML2TextPool(options))
+    return pool
+
+
 def html2text(html, baseurl=''):
-    h = HTML2Text(baseurl=baseurl)
-    return h.handle(html)
+    return get_pool().convert(html, baseurl)
+
+
+def html2text_stream(chunks, out, baseurl=''):
+    """Convert an iterable of HTML chunks, writing Markdown to the file-like out."""
+    pool = get_pool()
+    h = pool.acquire(baseurl)
+    try:
+        for text in h.iter_markdown(chunks):
+            out.write(text)
+    finally:
+        pool.release(h)
 
 
 def unescape(s, unicode_snob=False):
@@ -865,18 +1316,212 @@ def escape_md(text):
 
 def escape_md_section(text, snob=False):
     """Escapes markdown-sensitive characters across whole document sections."""
-    text = md_backslash_matcher.sub(r"\\\1", text)
-    if snob:
-        text = md_chars_matcher_all.sub(r"\\\1", text)
-    text = md_dot_matcher.sub(r"\1\\\2", text)
-    text = md_plus_matcher.sub(r"\1\\\2", text)
-    text = md_dash_matcher.sub(r"\1\\\2", text)
-    return text
+    return md_section_escapers[bool(snob), False].escape(text)
 
 
-def main():
+def load_source(file_, encoding="utf-8", fetcher=None, fetched=None):
+    """Read a file or download a url, returning (decoded html, baseurl).
+
+    Urls are downloaded through fetcher (a one-off fetcher.Fetcher if not
+    given) unless fetched already holds their (content, headers).
+    """
     baseurl = ''
+    if file_.startswith('http://') or file_.startswith('https://'):
+        baseurl = file_
+        if fetched is None:
+            fetched = (fetcher or Fetcher()).fetch(baseurl)
+        data, headers = fetched
+        if encoding is None:
+            try:
+                from feedparser import _getCharacterEncoding as enc
+            except ImportError:
+                enc = lambda x, y: ('utf-8', 1)
+            encoding = enc(headers, data)[0]
+            if encoding == 'us-ascii':
+                encoding = 'utf-8'
+    else:
+        data = open(file_, 'rb').read()
+        if encoding is None:
+            try:
+                from chardet import detect
+            except ImportError:
+                detect = lambda x: {'encoding': 'utf-8'}
+            encoding = detect(data)['encoding']
+    return data.decode(encoding), baseurl
+
+
+def cli_options(options):
+    """HTML2TextOptions for the parsed command line options."""
+    h_options = default_options(
+        body_width=options.body_width,
+        google_list_indent=options.list_indent,
+        ignore_emphasis=options.ignore_emphasis,
+        ignore_links=options.ignore_links,
+        ignore_images=options.ignore_images,
+        google_doc=options.google_doc,
+        hide_strikethrough=options.hide_strikethrough,
+        escape_snob=options.escape_snob)
+    if options.ul_style_dash:
+        h_options = h_options._replace(ul_item_mark='-')
+    if options.em_style_asterisk:
+        h_options = h_options._replace(emphasis_mark='*', strong_mark='__')
+    return h_options
+
 
+def iter_chunks(data, size=CHUNK_SIZE):
+    """Split a decoded page into the pieces iter_markdown() is fed with."""
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def write_post(data, baseurl, options):
+    """Convert a page and write it out as a Hexo post, returning the file name."""
+    root = etree.HTML(data)
+    if options.extract or options.template_cache:
+        title, origin_title, node = get_extractor(options.template_cache).page(root, baseurl, options.xpath)
+    else:
+        title = root.xpath('//title/text()')
+        title = title[0] if title else ''
+        node = root
+        if options.xpath:
+            node = root.xpath(options.xpath)[0]
+        origin_title = title
+        if '|' in title:
+            title = title.split('|')[0]
+    if node is not root and options.backend != 'tree':
+        data = etree.tostring(node)
+        data = data.decode('utf-8')
+    # wrapwrite()
+    output = title.replace(' ', '') + '.md'
+    if options.out:
+        output = join(options.out, output)
+    with open(output, 'w', encoding='utf8') as f:
+        header = f"""---
+title: {title}
+tags:
+date: 2020-01-20 23:00:00
+categories: 教育
+description: {title}
+---
+
+转自[{origin_title}]({baseurl})
+
+
+"""
+        f.write(header)
+        # handle options
+        pool = get_pool(cli_options(options))
+        h = pool.acquire(baseurl)
+        try:
+            if options.backend == 'tree':
+                f.write(h.handle_tree(node))
+            else:
+                for text in h.iter_markdown(iter_chunks(data)):
+                    f.write(text)
+        finally:
+            pool.release(h)
+    return output
+
+
+def convert_source(job):
+    """Batch worker: convert one (source, encoding, options, fetched) job.
+
+    fetched is the (content, headers) of a url downloaded by the parent
+    process, or None for local files.
+    Returns (source, output file or None, error or None, seconds, input size).
+    """
+    file_, encoding, options, fetched = job
+    start = time.perf_counter()
+    size = 0
+    try:
+        data, baseurl = load_source(file_, encoding, fetched=fetched)
+        size = len(data)
+        output = write_post(data, baseurl, options)
+    except Exception as e:
+        return file_, None, f'{type(e).__name__}: {e}', time.perf_counter() - start, size
+    return file_, output, None, time.perf_counter() - start, size
+
+
+def batch_sources(path):
+    """List the inputs of --batch: the .html files of a directory, or the
+    non-empty, non-comment lines of a list file."""
+    if os.path.isdir(path):
+        return sorted(join(path, name) for name in os.listdir(path)
+                      if name.endswith(('.html', '.htm')))
+    with open(path, encoding='utf8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def batch_jobs(sources, encoding, options, fetcher, failures):
+    """Yield conversion jobs: local files right away, then urls as soon as
+    their concurrent downloads finish.  Urls that could not be downloaded
+    get no job; their (url, error) is appended to failures instead, since
+    not every exception survives the trip to a worker process."""
+    urls = []
+    for source in sources:
+        if source.startswith('http://') or source.startswith('https://'):
+            urls.append(source)
+        else:
+            yield source, encoding, options, None
+    for url, content, headers, error in fetcher.fetch_many(urls, options.fetch_workers):
+        if error:
+            failures.append((url, f'{type(error).__name__}: {error}'))
+            continue
+        headers = dict(headers) if headers is not None else None
+        yield url, encoding, options, (content, headers)
+
+
+def make_fetcher(options):
+    """A Fetcher for the download options, or with --render a
+    renderer.RenderPool that loads the pages in headless browsers."""
+    if options.render:
+        from renderer import RenderPool
+        return RenderPool(size=options.render_drivers, max_pages=options.render_max_pages,
+                          timeout=options.timeout, xpath=options.xpath)
+    return Fetcher(cache_dir=options.cache_dir, timeout=options.timeout,
+                   pool_size=options.fetch_workers, per_host=options.per_host)
+
+
+def run_batch(options, encoding):
+    """Convert every input of --batch in one process pool and report throughput.
+
+    Urls are downloaded on threads in this process while the pool converts
+    whatever has already arrived.
+    """
+    sources = batch_sources(options.batch)
+    fetcher = make_fetcher(options)
+    failures = []
+    jobs = batch_jobs(sources, encoding, options, fetcher, failures)
+    done = failed = total_size = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=options.workers) as executor:
+        for file_, output, error, elapsed, size in executor.map(convert_source, jobs,
+                                                                chunksize=options.chunksize):
+            if error:
+                failed += 1
+                print(f'失败 {file_} ({elapsed:.3f}s): {error}')
+            else:
+                done += 1
+                total_size += size
+                print(f'{file_} -> {output} ({elapsed:.3f}s, {size} 字符)')
+    fetcher.close()
+    for file_, error in failures:
+        failed += 1
+        print(f'下载失败 {file_}: {error}')
+    elapsed = time.perf_counter() - start
+    stats = fetcher.stats
+    print(f'完成 {done} 篇, 失败 {failed} 篇, 用时 {elapsed:.2f}s, '
+          f'{done / elapsed if elapsed else 0:.2f} 篇/s, '
+          f'{total_size / 1024 / 1024 / elapsed if elapsed else 0:.2f} M字符/s')
+    if options.render:
+        print('\n'.join(fetcher.report()))
+        return failed
+    print(f'请求 {stats["requests"]} 次, 缓存命中(304) {stats["not_modified"]} 次, '
+          f'下载 {stats["bytes"] / 1024 / 1024:.2f} MB')
+    return failed
+
+
+def main():
     p = optparse.OptionParser('%prog [(filename|url) [encoding]]',
                               version='%prog ' + __version__)
     p.add_option("--ignore-emphasis", dest="ignore_emphasis", action="store_true",
@@ -902,89 +1547,61 @@ def main():
                  help="Escape all special characters.  Output is less readable, but avoids corner case formatting issues.")
     p.add_option("--xpath", action="store", type="string", dest="xpath",
                  help="内容部分的xpath.")
+    p.add_option("--extract", action="store_true", dest="extract", default=False,
+                 help="没有--xpath时自动识别正文, 同一域名会复用识别出的xpath")
+    p.add_option("--template-cache", action="store", type="string", dest="template_cache",
+                 help="保存每个域名学到的模板(正文xpath, 标题位置和分隔符, 重复的版权声明等)的json文件, 隐含--extract")
     p.add_option("--out", action="store", type="string", dest="out",
                  help="输出路径")
+    p.add_option("--backend", action="store", type="choice", dest="backend",
+                 choices=['parser', 'tree'], default='parser',
+                 help="parser: 把xpath结果序列化后用HTMLParser重新解析; tree: 直接遍历lxml的元素树")
+    p.add_option("--batch", action="store", type="string", dest="batch",
+                 help="批量转换: 每行一个文件或url的列表文件, 或保存html的目录")
+    p.add_option("--workers", action="store", type="int", dest="workers", default=None,
+                 help="批量转换的进程数, 默认为cpu核数")
+    p.add_option("--chunksize", action="store", type="int", dest="chunksize", default=1,
+                 help="批量转换时每个进程一次领取的任务数")
+    p.add_option("--cache-dir", action="store", type="string", dest="cache_dir",
+                 help="http缓存目录, 用ETag/Last-Modified做条件请求")
+    p.add_option("--timeout", action="store", type="float", dest="timeout", default=30,
+                 help="下载超时秒数")
+    p.add_option("--fetch-workers", action="store", type="int", dest="fetch_workers", default=8,
+                 help="批量转换时并发下载的线程数")
+    p.add_option("--per-host", action="store", type="int", dest="per_host", default=2,
+                 help="同一域名的最大并发请求数")
+    p.add_option("--render", action="store_true", dest="render", default=False,
+                 help="用无头浏览器渲染url, 适用于js生成正文的博客, 会等待--xpath出现")
+    p.add_option("--render-drivers", action="store", type="int", dest="render_drivers", default=2,
+                 help="同时打开的浏览器数")
+    p.add_option("--render-max-pages", action="store", type="int", dest="render_max_pages", default=50,
+                 help="每个浏览器渲染多少页后重启")
     (options, args) = p.parse_args()
 
     # process input
     encoding = "utf-8"
+    if options.batch:
+        if len(args) > 1:
+            p.error('Too many arguments')
+        if args:
+            encoding = args[0]
+        sys.exit(1 if run_batch(options, encoding) else 0)
+
     if len(args) > 0:
         file_ = args[0]
         if len(args) == 2:
             encoding = args[1]
         if len(args) > 2:
             p.error('Too many arguments')
-
-        if file_.startswith('http://') or file_.startswith('https://'):
-            baseurl = file_
-            # j = urllib.urlopen(baseurl)
-            import requests
-            j = requests.get(baseurl, headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.90 Safari/537.36'})
-            # data = j.read()
-            data = j.content
-            if encoding is None:
-                try:
-                    from feedparser import _getCharacterEncoding as enc
-                except ImportError:
-                    enc = lambda x, y: ('utf-8', 1)
-                encoding = enc(j.headers, data)[0]
-                if encoding == 'us-ascii':
-                    encoding = 'utf-8'
-        else:
-            data = open(file_, 'rb').read()
-            if encoding is None:
-                try:
-                    from chardet import detect
-                except ImportError:
-                    detect = lambda x: {'encoding': 'utf-8'}
-                encoding = detect(data)['encoding']
+        fetcher = make_fetcher(options)
+        try:
+            data, baseurl = load_source(file_, encoding, fetcher=fetcher)
+        finally:
+            fetcher.close()
     else:
-        data = sys.stdin.read()
-
-    data = data.decode(encoding)
-    root = etree.HTML(data)
-    title = root.xpath('//title/text()')
-    title = title[0] if title else ''
-    if options.xpath:
-        data = etree.tostring(root.xpath(options.xpath)[0])
-        data = data.decode(encoding)
-    h = HTML2Text(baseurl=baseurl)
-    # handle options
-    if options.ul_style_dash: h.ul_item_mark = '-'
-    if options.em_style_asterisk:
-        h.emphasis_mark = '*'
-        h.strong_mark = '__'
-
-    h.body_width = options.body_width
-    h.list_indent = options.list_indent
-    h.ignore_emphasis = options.ignore_emphasis
-    h.ignore_links = options.ignore_links
-    h.ignore_images = options.ignore_images
-    h.google_doc = options.google_doc
-    h.hide_strikethrough = options.hide_strikethrough
-    h.escape_snob = options.escape_snob
-
-    # wrapwrite()
-    origin_title = title
-    if '|' in title:
-        title = title.split('|')[0]
-    output = title.replace(' ', '') + '.md'
-    if options.out:
-        output = join(options.out, output)
-    with open(output, 'w', encoding='utf8') as f:
-        header = f"""---
-title: {title}
-tags:
-date: 2020-01-20 23:00:00
-categories: 教育
-description: {title}
----
+        data, baseurl = sys.stdin.read(), ''
 
-转自[{origin_title}]({baseurl})
-
-
-"""
-        f.write(header + h.handle(data))
+    write_post(data, baseurl, options)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,293 @@
+"""Offline benchmark of the browser fetch path.
+
+Serves the pages of bench_corpus (or --corpus) from a local http server
+and loads them headless, so driver pooling and wait strategies can be
+compared on one machine without the network:
+
+    python render_bench.py [--mode fresh|reuse|pool] [--wait sleep|ready|selector|idle]
+                           [--pages N] [--drivers N] [--variant js|static|mixed]
+                           [--js-delay MS] [--asset-delay MS] [--corpus DIR]
+
+Each page comes in two variants.  /static/<name> is the recorded page;
+/js/<name> has an empty body that a script fills from /content/<name>
+after --js-delay ms, the way JavaScript-rendered blogs do.  Both reference
+an image that takes --asset-delay ms, which holds back the load event.
+Once a page is really rendered its body carries data-rendered="1", so the
+report can tell how many fetches returned the page before it was ready.
+
+Modes: fresh starts a new CustomSeleniumSpider (browser) per page, as
+run_direct does; reuse fetches every page with one spider; pool renders
+with renderer.RenderPool and --drivers browsers.
+
+Waits: sleep is the old fixed random_sleep(start=1); ready waits for
+readyState complete; selector waits for the rendered body; idle waits for
+readyState complete plus 0.5s without a finished resource.
+"""
+import optparse
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import abspath, dirname
+from urllib import parse
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+from benchmark import CORPUS, corpus_pages
+from renderer import RenderPool, driver_rss
+from blog_spider.spiders.increase_uv_spider import CustomSeleniumSpider
+from blog_spider.waits import WaitPolicy
+
+RENDERED_SELECTOR = 'body[data-rendered]'
+
+JS_PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="UTF-8"><title>{title}</title></head>
+<body>
+<img src="/slow/cover.png?delay={asset_delay}">
+<script>
+setTimeout(function () {{
+    var xhr = new XMLHttpRequest();
+    xhr.open('GET', '/content/{name}');
+    xhr.onload = function () {{
+        document.body.innerHTML = xhr.responseText;
+        document.body.setAttribute('data-rendered', '1');
+    }};
+    xhr.send();
+}}, {js_delay});
+</script>
+</body>
+</html>
+"""
+
+body_matcher = re.compile(r'<body[^>]*>(.*)</body>', re.I | re.S)
+title_matcher = re.compile(r'<title>(.*?)</title>', re.I | re.S)
+
+
+class StandInSite(object):
+    """Local http server for the recorded pages, on a background thread."""
+
+    def __init__(self, pages, js_delay=300, asset_delay=500):
+        self.pages = dict(pages)
+        self.js_delay = js_delay
+        self.asset_delay = asset_delay
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def root(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def urls(self, variant):
+        for name in sorted(self.pages):
+            if variant in ('static', 'mixed'):
+                yield f'{self.root}/static/{name}'
+            if variant in ('js', 'mixed'):
+                yield f'{self.root}/js/{name}'
+
+    def render(self, path):
+        """Return (status, content type, body) for a request path."""
+        split = parse.urlsplit(path)
+        kind, _, name = split.path.lstrip('/').partition('/')
+        if kind == 'slow':
+            delay = int(parse.parse_qs(split.query).get('delay', ['0'])[0])
+            time.sleep(delay / 1000)
+            return 200, 'image/png', b''
+        html = self.pages.get(name)
+        if html is None:
+            return 404, 'text/plain', b'not found'
+        if kind == 'static':
+            slow_image = f'<img src="/slow/cover.png?delay={self.asset_delay}">'
+            html = re.sub(r'<body([^>]*)>', lambda m: f'<body{m.group(1)} data-rendered="1">' + slow_image,
+                          html, count=1, flags=re.I)
+        elif kind == 'js':
+            title = title_matcher.search(html)
+            html = JS_PAGE.format(title=title.group(1) if title else name, name=name,
+                                  js_delay=self.js_delay, asset_delay=self.asset_delay)
+        elif kind == 'content':
+            body = body_matcher.search(html)
+            html = body.group(1) if body else html
+        else:
+            return 404, 'text/plain', b'not found'
+        return 200, 'text/html; charset=utf-8', html.encode('utf-8')
+
+    def handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, content_type, body = site.render(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SleepWait(WaitPolicy):
+    """The wait before WaitPolicy: a fixed random_sleep(start=1)."""
+
+    def wait(self, driver, selector=None, timeout=None):
+        seconds = CustomSeleniumSpider.random_sec(start=1)
+        time.sleep(seconds)
+        with self._lock:
+            self.waited += seconds
+            self.calls += 1
+        return seconds
+
+
+def make_wait(name, timeout):
+    if name == 'sleep':
+        return SleepWait(timeout=timeout)
+    if name == 'ready':
+        return WaitPolicy(ready_state='complete', timeout=timeout)
+    if name == 'selector':
+        return WaitPolicy(ready_state='interactive', selector=RENDERED_SELECTOR, timeout=timeout)
+    return WaitPolicy(ready_state='complete', network_idle=0.5, timeout=timeout)
+
+
+class LocalSpider(CustomSeleniumSpider):
+    """CustomSeleniumSpider without the PROXY_API lookup."""
+
+    def get_proxy(self):
+        return None
+
+
+def is_rendered(html):
+    return 'data-rendered="1"' in html
+
+
+class Result(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.rendered = 0
+        self.failed = 0
+        self.rss = []
+        self.commands = []
+
+
+def run_spider(urls, mode, waits, result):
+    spider = None
+    try:
+        for url in urls:
+            start = time.perf_counter()
+            if spider is None:
+                spider = LocalSpider()
+                spider.waits = waits
+            try:
+                response = spider.fetch(url)
+            except Exception as e:
+                result.failed += 1
+                print(f'失败 {url}: {type(e).__name__}: {e}')
+            else:
+                result.rendered += is_rendered(response.text)
+            result.latencies.append(time.perf_counter() - start)
+            if mode == 'fresh':
+                result.rss.append(driver_rss(spider.driver))
+                result.commands.append(spider.commands.per_page())
+                spider.__exit__(None, None, None)
+                spider = None
+    finally:
+        if spider is not None:
+            result.rss.append(driver_rss(spider.driver))
+            result.commands.append(spider.commands.per_page())
+            spider.__exit__(None, None, None)
+
+
+def run_pool(urls, drivers, waits, timeout, result):
+    pool = RenderPool(size=drivers, timeout=timeout)
+    pool.waits = waits
+
+    def fetch(url):
+        start = time.perf_counter()
+        try:
+            content, headers = pool.fetch(url)
+        except Exception as e:
+            print(f'失败 {url}: {type(e).__name__}: {e}')
+            return time.perf_counter() - start, None
+        return time.perf_counter() - start, content.decode('utf-8')
+
+    try:
+        with ThreadPoolExecutor(max_workers=drivers) as executor:
+            for elapsed, html in executor.map(fetch, urls):
+                result.latencies.append(elapsed)
+                if html is None:
+                    result.failed += 1
+                else:
+                    result.rendered += is_rendered(html)
+        for pooled in pool.started:
+            result.rss.append(driver_rss(pooled.driver) or pooled.rss)
+            result.commands.append(pooled.commands.per_page())
+    finally:
+        pool.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main():
+    p = optparse.OptionParser('%prog [options]')
+    p.add_option("--mode", dest="mode", type="choice", choices=['fresh', 'reuse', 'pool'], default='reuse')
+    p.add_option("--wait", dest="wait", type="choice", choices=['sleep', 'ready', 'selector', 'idle'],
+                 default='selector')
+    p.add_option("--pages", dest="pages", type="int", default=20, help="number of fetches")
+    p.add_option("--drivers", dest="drivers", type="int", default=2, help="browsers in pool mode")
+    p.add_option("--variant", dest="variant", type="choice", choices=['js', 'static', 'mixed'],
+                 default='mixed')
+    p.add_option("--js-delay", dest="js_delay", type="int", default=300,
+                 help="ms before the script of a js page fetches its body")
+    p.add_option("--asset-delay", dest="asset_delay", type="int", default=500,
+                 help="ms the slow image of every page takes")
+    p.add_option("--timeout", dest="timeout", type="float", default=10)
+    p.add_option("--corpus", dest="corpus", default=CORPUS)
+    options, args = p.parse_args()
+
+    waits = make_wait(options.wait, options.timeout)
+    result = Result()
+    with StandInSite(corpus_pages(options.corpus), options.js_delay, options.asset_delay) as site:
+        urls = list(site.urls(options.variant))
+        urls = [urls[i % len(urls)] for i in range(options.pages)]
+        start = time.perf_counter()
+        if options.mode == 'pool':
+            run_pool(urls, options.drivers, waits, options.timeout, result)
+        else:
+            run_spider(urls, options.mode, waits, result)
+        elapsed = time.perf_counter() - start
+
+    pages = len(result.latencies)
+    print(f'{options.mode}/{options.wait}: {pages} 页, 失败 {result.failed}, '
+          f'渲染完整 {result.rendered}/{pages}')
+    print(f'  {pages * 60 / elapsed:.1f} 页/分钟, p50 {percentile(result.latencies, 50):.2f}s, '
+          f'p95 {percentile(result.latencies, 95):.2f}s, 等待 {waits.waited:.1f}s')
+    rss = [r for r in result.rss if r]
+    if rss:
+        print(f'  浏览器内存 平均 {sum(rss) / len(rss) / 1024 / 1024:.0f} MB, '
+              f'最大 {max(rss) / 1024 / 1024:.0f} MB')
+    else:
+        print('  浏览器内存: 未知(需要psutil)')
+    if result.commands:
+        print(f'  每页WebDriver命令 {sum(result.commands) / len(result.commands):.1f} 次')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Headless browser rendering for the html2text importer.
+
+Pages whose post body is filled in by JavaScript come back empty from a
+plain http download.  RenderPool keeps a few warm drivers, made with
+``blog_spider.driver.create_driver``, and hands out ``page_source`` with
+the same fetch / fetch_many interface as fetcher.Fetcher.
+"""
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os.path import abspath, dirname
+
+from selenium.common.exceptions import WebDriverException
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+from blog_spider import settings
+from blog_spider.dom import CommandCounter
+from blog_spider.driver import create_driver
+from blog_spider.waits import WaitPolicy
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def driver_rss(driver):
+    """Resident memory in bytes of the driver and the browser it started,
+    or None when psutil is not installed or the process is gone."""
+    service = getattr(driver, 'service', None)
+    process = getattr(service, 'process', None)
+    if psutil is None or process is None:
+        return None
+    try:
+        root = psutil.Process(process.pid)
+        return sum(p.memory_info().rss for p in [root] + root.children(recursive=True))
+    except psutil.Error:
+        return None
+
+
+class PooledDriver(object):
+    """A webdriver plus the bookkeeping the pool needs to recycle it."""
+
+    def __init__(self, number, driver):
+        self.number = number
+        self.driver = driver
+        self.commands = CommandCounter(driver)
+        self.pages = 0
+        self.rss = None
+
+    def healthy(self):
+        try:
+            return self.driver.execute_script('return 1') == 1
+        except WebDriverException:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except WebDriverException:
+            pass
+
+
+class RenderPool(object):
+    """Pool of at most size headless drivers.
+
+    fetch() renders one url on an idle driver and returns once the page is
+    ready (see blog_spider.waits.WaitPolicy) and xpath, if given, is
+    present.  A driver is quit and replaced after max_pages pages, or when
+    it fails the health check done each time it is taken from the pool.
+    """
+
+    def __init__(self, size=2, max_pages=50, timeout=30, xpath=None):
+        self.size = size
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.xpath = xpath
+        self.waits = WaitPolicy.from_settings(settings, selector=xpath, timeout=timeout)
+        self.idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        self.started = []
+        self.start = time.perf_counter()
+        self.stats = {'pages': 0, 'failed': 0, 'recycled': 0, 'seconds': 0.0}
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _create(self):
+        arguments = list(getattr(settings, 'SELENIUM_DRIVER_ARGUMENTS', None) or [])
+        if '--headless' not in arguments:
+            arguments.append('--headless')
+        driver = create_driver(getattr(settings, 'SELENIUM_DRIVER_NAME', 'chrome'),
+                               getattr(settings, 'SELENIUM_DRIVER_EXECUTABLE_PATH', None),
+                               arguments,
+                               getattr(settings, 'SELENIUM_BROWSER_EXECUTABLE_PATH', None),
+                               page_load_timeout=self.timeout)
+        with self._lock:
+            pooled = PooledDriver(len(self.started) + 1, driver)
+            self.started.append(pooled)
+        return pooled
+
+    def _retire(self, pooled):
+        pooled.rss = driver_rss(pooled.driver) or pooled.rss
+        pooled.quit()
+
+    def acquire(self):
+        """Take a healthy idle driver, or start one if none is idle.
+
+        Blocks while size drivers are in use.
+        """
+        self.slots.acquire()
+        try:
+            while True:
+                try:
+                    pooled = self.idle.get_nowait()
+                except queue.Empty:
+                    return self._create()
+                if pooled.healthy():
+                    return pooled
+                self._count('recycled')
+                self._retire(pooled)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, pooled):
+        pooled.rss = driver_rss(pooled.driver)
+        if pooled.pages >= self.max_pages:
+            self._count('recycled')
+            self._retire(pooled)
+        else:
+            self.idle.put(pooled)
+        self.slots.release()
+
+    def fetch(self, url):
+        """Return (content, headers) of url after the browser has rendered it."""
+        pooled = self.acquire()
+        start = time.perf_counter()
+        pooled.commands.start_page(url)
+        try:
+            pooled.driver.get(url)
+            self.waits.wait(pooled.driver)
+            content = pooled.driver.page_source.encode('utf-8')
+        except Exception:
+            self._count('failed')
+            raise
+        finally:
+            pooled.pages += 1
+            self._count('seconds', time.perf_counter() - start)
+            self.release(pooled)
+        self._count('pages')
+        return content, {'Content-Type': 'text/html; charset=utf-8'}
+
+    def fetch_many(self, urls, max_workers=8):
+        """Render urls on up to size drivers at once, yielding
+        (url, content, headers, error) as each page finishes."""
+        with ThreadPoolExecutor(max_workers=min(max_workers, self.size)) as executor:
+            futures = {executor.submit(self.fetch, url): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    content, headers = future.result()
+                except Exception as e:
+                    yield url, None, None, e
+                else:
+                    yield url, content, headers, None
+
+    def report(self):
+        """Lines describing throughput and per-driver memory, for printing."""
+        elapsed = time.perf_counter() - self.start
+        stats = self.stats
+        lines = [f'渲染 {stats["pages"]} 页, 失败 {stats["failed"]} 页, '
+                 f'{stats["pages"] * 60 / elapsed if elapsed else 0:.1f} 页/分钟, '
+                 f'启动浏览器 {len(self.started)} 个, 回收 {stats["recycled"]} 个, '
+                 f'等待就绪 {self.waits.waited:.1f}s']
+        for pooled in self.started:
+            rss = f'{pooled.rss / 1024 / 1024:.0f} MB' if pooled.rss else '未知(需要psutil)'
+            lines.append(f'  浏览器#{pooled.number}: {pooled.pages} 页, 内存 {rss}, '
+                         f'每页WebDriver命令 {pooled.commands.per_page():.1f} 次')
+        return lines
+
+    def close(self):
+        while True:
+            try:
+                pooled = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self._retire(pooled)
@@ -0,0 +1,152 @@
+"""Indexing throughput and query latency of blog_spider.search.
+
+Builds an index of --posts synthetic posts (100k by default) mixing
+Chinese and English with a Zipf-like word distribution, re-indexes and
+deletes a share of them the way a re-crawl does, then times queries:
+
+    python search_bench.py [--posts N] [--queries N] [--batch N] [--index FILE] [--seed N]
+
+Without --index the database goes to a temporary directory and is
+removed afterwards.
+"""
+import itertools
+import optparse
+import random
+import shutil
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, getsize, join
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+from blog_spider.search import SearchIndex
+
+CHARS = ('的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所'
+         '民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日'
+         '那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已'
+         '通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九'
+         '区强放决西被干做必战先回则任取据处理世车博客爬虫配置主题美化部署插件测试文章评论')
+ENGLISH = ['hexo', 'next', 'scrapy', 'selenium', 'python', 'git', 'deploy', 'theme', 'config', 'sitemap',
+           'markdown', 'docker', 'nginx', 'redis', 'mysql', 'linux', 'chrome', 'webdriver', 'xpath', 'css',
+           'javascript', 'node', 'npm', 'yaml', 'json', 'http', 'proxy', 'cookie', 'session', 'async']
+
+
+def make_vocabulary(rnd, size=20000):
+    words = set(ENGLISH)
+    while len(words) < size:
+        words.add(''.join(rnd.choice(CHARS) for _ in range(rnd.choice((2, 2, 2, 3, 4)))))
+    words = sorted(words)
+    rnd.shuffle(words)
+    return words
+
+
+class Corpus(object):
+    """Deterministic synthetic posts: word i has weight 1 / (i + 1)."""
+
+    def __init__(self, seed=0):
+        self.rnd = random.Random(seed)
+        self.words = make_vocabulary(self.rnd)
+        self.weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(self.words))))
+
+    def sample(self, n):
+        return self.rnd.choices(self.words, cum_weights=self.weights, k=n)
+
+    def text(self, n):
+        parts = []
+        for word in self.sample(n):
+            parts.append(word)
+            parts.append(' ' if word.isascii() else self.rnd.choice(('', '', '', '，', '。')))
+        return ''.join(parts)
+
+    def post(self, i):
+        return (f'https://blog{i % 500}.example.com/{2015 + i % 8}/01/01/post-{i}/',
+                self.text(self.rnd.randrange(3, 8)),
+                self.text(self.rnd.randrange(150, 700)))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0
+
+
+def main():
+    p = optparse.OptionParser('%prog [options]')
+    p.add_option("--posts", dest="posts", type="int", default=100000)
+    p.add_option("--queries", dest="queries", type="int", default=500)
+    p.add_option("--batch", dest="batch", type="int", default=1000, help="posts per commit")
+    p.add_option("--index", dest="index", help="database file, a temporary one by default")
+    p.add_option("--seed", dest="seed", type="int", default=0)
+    options, args = p.parse_args()
+
+    tmp = None
+    path = options.index
+    if not path:
+        tmp = tempfile.mkdtemp()
+        path = join(tmp, 'search.db')
+    corpus = Corpus(options.seed)
+    index = SearchIndex(path, options.batch)
+    try:
+        # 只计索引的时间, 不计生成文章的时间
+        chars = 0
+        elapsed = 0.0
+        for i in range(options.posts):
+            url, title, text = corpus.post(i)
+            chars += len(title) + len(text)
+            start = time.perf_counter()
+            index.add(url, title, text)
+            elapsed += time.perf_counter() - start
+        start = time.perf_counter()
+        index.commit()
+        elapsed += time.perf_counter() - start
+        print(f'索引 {options.posts} 篇 {chars / 1e6:.1f}M字: {elapsed:.1f}s, '
+              f'{options.posts / elapsed:.0f} 篇/秒, {chars / elapsed / 1e6:.2f}M字/秒')
+
+        start = time.perf_counter()
+        index.optimize()
+        print(f'合并段: {time.perf_counter() - start:.1f}s, 数据库 {getsize(path) / 1e6:.0f} MB')
+
+        # 重新爬取: 1%的文章改了, 1%的删了
+        changed = deleted = 0
+        elapsed = 0.0
+        rnd = random.Random(options.seed + 1)
+        for i in rnd.sample(range(options.posts), options.posts // 50):
+            url, title, text = corpus.post(i)
+            start = time.perf_counter()
+            if i % 2:
+                index.add(url, title, text)
+                changed += 1
+            else:
+                index.delete(url)
+                deleted += 1
+            elapsed += time.perf_counter() - start
+        start = time.perf_counter()
+        index.commit()
+        elapsed += time.perf_counter() - start
+        print(f'增量: 更新 {changed}, 删除 {deleted} 篇, {(changed + deleted) / elapsed:.0f} 篇/秒')
+
+        queries = []
+        for _ in range(options.queries):
+            kind = rnd.random()
+            if kind < 0.4:
+                queries.append(corpus.sample(1)[0])
+            elif kind < 0.8:
+                queries.append(' '.join(corpus.sample(2)))
+            else:
+                queries.append(rnd.choice(corpus.words[:2000]))
+        latencies = []
+        found = 0
+        for query in queries:
+            start = time.perf_counter()
+            found += bool(index.search(query))
+            latencies.append(time.perf_counter() - start)
+        print(f'查询 {len(queries)} 次 (共 {len(index)} 篇): 有结果 {found}, '
+              f'p50 {percentile(latencies, 50) * 1000:.2f}ms, p95 {percentile(latencies, 95) * 1000:.2f}ms, '
+              f'p99 {percentile(latencies, 99) * 1000:.2f}ms, 最慢 {max(latencies) * 1000:.2f}ms')
+    finally:
+        index.close()
+        if tmp:
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()